@@ -0,0 +1,81 @@
+<?php
+header('Content-Type: application/json');
+header('Access-Control-Allow-Origin: http://localhost:3000');
+header('Access-Control-Allow-Methods: GET, OPTIONS');
+header('Access-Control-Allow-Headers: Content-Type, Authorization');
+header('Access-Control-Allow-Credentials: true');
+
+// Handle preflight OPTIONS request
+if ($_SERVER['REQUEST_METHOD'] === 'OPTIONS') {
+    http_response_code(200);
+    exit();
+}
+
+// Include database connection
+require_once 'config.php';
+
+// Get user session
+session_start();
+
+// Check if user is logged in
+if (!isset($_SESSION['id'])) {
+    echo json_encode(['success' => false, 'message' => 'User not authenticated']);
+    exit();
+}
+
+$user_id = $_SESSION['id'];
+session_write_close();
+
+// Get note_id parameter
+$note_id = $_GET['note_id'] ?? null;
+
+if (!$note_id) {
+    echo json_encode(['success' => false, 'message' => 'Note ID is required']);
+    exit();
+}
+
+try {
+    // Status of the note's text extraction (set by py ingest_service.py work)
+    $stmt = $pdo->prepare("
+        SELECT n.id, n.file_type, ec.extraction_status, ec.error_message, ec.attempts,
+               ec.started_at, ec.extracted_at
+        FROM notes n
+        LEFT JOIN extracted_content ec ON ec.note_id = n.id
+        WHERE n.id = ? AND n.user_id = ?
+    ");
+    $stmt->execute([$note_id, $user_id]);
+    $note = $stmt->fetch(PDO::FETCH_ASSOC);
+
+    if (!$note) {
+        echo json_encode(['success' => false, 'message' => 'Note not found']);
+        exit();
+    }
+
+    if ($note['file_type'] !== 'PDF Document') {
+        // Text notes need no extraction
+        $status = 'completed';
+    } else {
+        // A PDF without a row is queued by the ingestion service's next sweep
+        $status = $note['extraction_status'] ?? 'pending';
+    }
+
+    echo json_encode([
+        'success' => true,
+        'extraction' => [
+            'note_id' => (int)$note['id'],
+            'status' => $status,
+            'error' => $note['error_message'],
+            'attempts' => (int)$note['attempts'],
+            'started_at' => $note['started_at'],
+            'finished_at' => in_array($status, ['completed', 'failed']) ? $note['extracted_at'] : null
+        ]
+    ]);
+
+} catch (PDOException $e) {
+    error_log('Extraction status error: ' . $e->getMessage());
+    echo json_encode([
+        'success' => false,
+        'message' => 'Failed to load extraction status.'
+    ]);
+}
+?>
@@ -19,6 +19,7 @@ if ($_SERVER['REQUEST_METHOD'] !== 'POST') {
 
 // Include database connection
 require_once 'config.php';
+require_once 'jobQueue.php';
 
 // Get user session
 session_start();
@@ -34,6 +35,7 @@ $user_id = $_SESSION['id'];
 // Get note_id from request body
 $input = json_decode(file_get_contents('php://input'), true);
 $note_id = $input['note_id'] ?? null;
+$regenerate = !empty($input['regenerate']);
 
 error_log('Debug: user_id=' . $user_id . ', note_id=' . $note_id);
 
@@ -57,106 +59,26 @@ try {
         exit();
     }
 
-    // Call the Python quiz generator script
-    $python_script = dirname(__DIR__, 1) . DIRECTORY_SEPARATOR . 'summary_generator.py';
-    $command = 'py ' . escapeshellarg($python_script) . ' quiz ' . escapeshellarg($note_id) . ' ' . escapeshellarg($user_id);
-    error_log('Command: ' . $command);
-
-    // Execute the Python script and capture output
-    $descriptors = [
-        0 => ['pipe', 'r'], // stdin
-        1 => ['pipe', 'w'], // stdout
-        2 => ['pipe', 'w']  // stderr
-    ];
-
-    $process = proc_open($command, $descriptors, $pipes, dirname($python_script));
-
-    if (!is_resource($process)) {
-        $error = error_get_last();
-        error_log('Failed to execute script. Error: ' . print_r($error, true));
-        echo json_encode([
-            'success' => false,
-            'message' => 'Failed to start quiz generation process',
-            'error' => $error['message'] ?? 'Unknown error'
-        ]);
-        exit();
-    }
-
-    // Read output and errors
-    $stdout = stream_get_contents($pipes[1]);
-    $stderr = stream_get_contents($pipes[2]);
-
-    // Close all pipes and the process
-    fclose($pipes[0]);
-    fclose($pipes[1]);
-    fclose($pipes[2]);
-    $exitCode = proc_close($process);
-
-    // Log the output and errors
-    if (!empty($stderr)) {
-        error_log('Python script stderr: ' . $stderr);
-    }
-
-    if ($exitCode !== 0) {
-        error_log('Python script exited with code: ' . $exitCode);
-        echo json_encode([
-            'success' => false,
-            'message' => 'Quiz generation script failed',
-            'error' => 'Script exited with code ' . $exitCode,
-            'stderr' => $stderr
-        ]);
-        exit();
-    }
-
-    // Clean and parse the JSON output
-    $output = trim($stdout);
-    $jsonStart = strpos($output, '{');
-    $jsonEnd = strrpos($output, '}');
-
-    if ($jsonStart === false || $jsonEnd === false) {
-        error_log('Could not find JSON in output: ' . $output);
-        echo json_encode([
-            'success' => false,
-            'message' => 'Invalid response format from quiz generation script',
-            'output' => $output,
-            'stderr' => $stderr
-        ]);
-        exit();
-    }
-
-    $jsonStr = substr($output, $jsonStart, $jsonEnd - $jsonStart + 1);
-
-    // Try to parse the JSON
-    $result = json_decode($jsonStr, true);
-
-    if (json_last_error() !== JSON_ERROR_NONE) {
-        $jsonError = json_last_error_msg();
-        error_log('JSON decode error: ' . $jsonError);
-        error_log('Raw output that failed to parse: ' . $output);
+    // Queue generation; a job already queued or running for this note is reused
+    $job = enqueueGenerationJob($pdo, $note_id, $user_id, 'quiz', $regenerate);
 
+    if (!$job['refresh_applied']) {
+        // The running job will reuse the banked questions; it cannot be switched to a regenerate
         echo json_encode([
             'success' => false,
-            'message' => 'Failed to parse script output',
-            'error' => $jsonError,
-            'output' => $output,
-            'stderr' => $stderr
+            'message' => 'A quiz is already being generated for this note, so the regenerate was not applied. Try again once it finishes.',
+            'created' => false,
+            'job_id' => $job['job_id']
         ]);
         exit();
     }
 
-    // Return the result from the Python script
-    if ($result['success']) {
-        echo json_encode([
-            'success' => true,
-            'message' => 'Quiz generated successfully',
-            'quiz' => $result['quiz']
-        ]);
-    } else {
-        echo json_encode([
-            'success' => false,
-            'message' => $result['message'] ?? 'Failed to generate quiz'
-        ]);
-    }
+    echo json_encode([
+        'success' => true,
+        'message' => $job['created'] ? 'Quiz generation queued' : 'Quiz generation already in progress',
+        'processing' => true,
+        'job_id' => $job['job_id']
+    ]);
 
 } catch (PDOException $e) {
     error_log('Generate quiz error: ' . $e->getMessage());
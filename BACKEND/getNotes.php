@@ -28,10 +28,11 @@ $user_id = $_SESSION['id'];
 try {
     // Get all notes for the user
     $stmt = $pdo->prepare("
-        SELECT id, title, content, file_size, file_type, uploaded_at
-        FROM notes
-        WHERE user_id = ?
-        ORDER BY uploaded_at DESC
+        SELECT n.id, n.title, n.content, n.file_size, n.file_type, n.uploaded_at, ec.extraction_status
+        FROM notes n
+        LEFT JOIN extracted_content ec ON ec.note_id = n.id
+        WHERE n.user_id = ?
+        ORDER BY n.uploaded_at DESC
     ");
 
     $stmt->execute([$user_id]);
@@ -55,7 +56,8 @@ try {
             'date' => date('m/d/Y', strtotime($note['uploaded_at'])), // Format as mm/dd/yyyy
             'size' => $note['file_size'] ?: 'Unknown size',
             'content' => $content,
-            'file_type' => $file_type
+            'file_type' => $file_type,
+            'extraction_status' => $note['extraction_status']
         ];
     }
 
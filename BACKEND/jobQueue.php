@@ -0,0 +1,37 @@
+<?php
+// Helpers for the generation job queue (consumed by `py job_queue.py work`)
+
+// Queue a summary/quiz job, or join the active one for the same note and mode.
+// $refresh asks for a fresh generation instead of reused or cached output.
+// Returns ['job_id' => int, 'created' => bool, 'refresh_applied' => bool];
+// refresh_applied is false when a refresh joined a job that was already
+// running without one (the worker read the flag when it claimed the job).
+function enqueueGenerationJob($pdo, $note_id, $user_id, $mode, $refresh = false) {
+    $maxAttempts = (int)(getenv('JOB_MAX_ATTEMPTS') ?: 3);
+
+    // On a duplicate active job, LAST_INSERT_ID(id) makes lastInsertId() return it,
+    // and a refresh request upgrades it while it is still queued
+    $stmt = $pdo->prepare("
+        INSERT INTO generation_jobs (note_id, user_id, mode, dedupe_key, refresh, max_attempts)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id),
+            refresh = IF(status = 'queued', GREATEST(refresh, VALUES(refresh)), refresh)
+    ");
+    $stmt->execute([$note_id, $user_id, $mode, $mode . ':' . $note_id, $refresh ? 1 : 0, $maxAttempts]);
+
+    $job_id = (int)$pdo->lastInsertId();
+    $created = $stmt->rowCount() === 1;
+    $refreshApplied = true;
+    if ($refresh && !$created) {
+        $check = $pdo->prepare("SELECT refresh FROM generation_jobs WHERE id = ?");
+        $check->execute([$job_id]);
+        $refreshApplied = (bool)$check->fetchColumn();
+    }
+
+    return [
+        'job_id' => $job_id,
+        'created' => $created,
+        'refresh_applied' => $refreshApplied
+    ];
+}
+?>
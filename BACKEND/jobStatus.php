@@ -0,0 +1,76 @@
+<?php
+header('Content-Type: application/json');
+header('Access-Control-Allow-Origin: http://localhost:3000');
+header('Access-Control-Allow-Methods: GET, OPTIONS');
+header('Access-Control-Allow-Headers: Content-Type, Authorization');
+header('Access-Control-Allow-Credentials: true');
+
+// Handle preflight OPTIONS request
+if ($_SERVER['REQUEST_METHOD'] === 'OPTIONS') {
+    http_response_code(200);
+    exit();
+}
+
+// Include database connection
+require_once 'config.php';
+
+// Get user session
+session_start();
+
+// Check if user is logged in
+if (!isset($_SESSION['id'])) {
+    echo json_encode(['success' => false, 'message' => 'User not authenticated']);
+    exit();
+}
+
+$user_id = $_SESSION['id'];
+session_write_close();
+
+// Get job_id parameter
+$job_id = $_GET['job_id'] ?? null;
+
+if (!$job_id) {
+    echo json_encode(['success' => false, 'message' => 'Job ID is required']);
+    exit();
+}
+
+try {
+    $stmt = $pdo->prepare("
+        SELECT id, note_id, mode, status, attempts, max_attempts, result, error_message,
+               created_at, started_at, finished_at
+        FROM generation_jobs
+        WHERE id = ? AND user_id = ?
+    ");
+    $stmt->execute([$job_id, $user_id]);
+    $job = $stmt->fetch(PDO::FETCH_ASSOC);
+
+    if (!$job) {
+        echo json_encode(['success' => false, 'message' => 'Job not found']);
+        exit();
+    }
+
+    echo json_encode([
+        'success' => true,
+        'job' => [
+            'id' => (int)$job['id'],
+            'note_id' => (int)$job['note_id'],
+            'mode' => $job['mode'],
+            'status' => $job['status'],
+            'attempts' => (int)$job['attempts'],
+            'max_attempts' => (int)$job['max_attempts'],
+            'result' => $job['result'] !== null ? json_decode($job['result'], true) : null,
+            'error' => $job['error_message'],
+            'created_at' => $job['created_at'],
+            'started_at' => $job['started_at'],
+            'finished_at' => $job['finished_at']
+        ]
+    ]);
+
+} catch (PDOException $e) {
+    error_log('Job status error: ' . $e->getMessage());
+    echo json_encode([
+        'success' => false,
+        'message' => 'Failed to load job status.'
+    ]);
+}
+?>
@@ -67,21 +67,23 @@ try {
             exit();
         }
 
-        // Generate unique filename
-        $fileName = uniqid() . '.pdf';
+        // Name the file by its content hash so identical uploads share one copy
+        $contentHash = hash_file('sha256', $file['tmp_name']);
+        $fileName = $contentHash . '.pdf';
         $filePath = $uploadDir . $fileName;
         error_log("Target file path: " . $filePath);
 
-        // Move uploaded file
-        if (!move_uploaded_file($file['tmp_name'], $filePath)) {
+        if (file_exists($filePath)) {
+            error_log("Duplicate upload, reusing existing file: " . $filePath);
+        } elseif (!move_uploaded_file($file['tmp_name'], $filePath)) {
             error_log("move_uploaded_file failed. Source: " . $file['tmp_name'] . ", Dest: " . $filePath);
             error_log("Source file exists: " . file_exists($file['tmp_name']));
             echo json_encode(['success' => false, 'message' => 'Failed to save file']);
             exit();
+        } else {
+            error_log("File saved successfully to: " . $filePath);
         }
 
-        error_log("File saved successfully to: " . $filePath);
-
         // Get form data
         $title = trim($_POST['title'] ?? 'Untitled Note');
         $original_filename = $_POST['original_filename'] ?? $file['name'];
@@ -89,8 +91,8 @@ try {
 
         // Insert note into database with file path
         $stmt = $pdo->prepare("
-            INSERT INTO notes (user_id, title, content, file_size, file_type, original_filename, uploaded_at)
-            VALUES (?, ?, ?, ?, 'PDF Document', ?, NOW())
+            INSERT INTO notes (user_id, title, content, file_size, file_type, original_filename, content_hash, uploaded_at)
+            VALUES (?, ?, ?, ?, 'PDF Document', ?, ?, NOW())
         ");
 
         $stmt->execute([
@@ -98,35 +100,30 @@ try {
             $title,
             '/uploads/' . $fileName, // Store file path in content
             $file_size,
-            $original_filename
+            $original_filename,
+            $contentHash
         ]);
 
         $note_id = $pdo->lastInsertId();
 
-        // Extract content from the uploaded PDF
+        // Queue text extraction; the ingestion service (py ingest_service.py work)
+        // picks it up, so the upload returns as soon as the file is stored
         try {
-            $python_script = dirname(__DIR__) . DIRECTORY_SEPARATOR . 'content_extractor.py';
-            $extraction_command = 'py ' . escapeshellarg($python_script) . ' extract ' . escapeshellarg($note_id) . ' 2>&1';
-
-            error_log('Content extraction command: ' . $extraction_command);
-
-            $extraction_output = shell_exec($extraction_command);
-            $extraction_result = json_decode($extraction_output, true);
-
-            if ($extraction_result && isset($extraction_result['success']) && $extraction_result['success']) {
-                error_log('Content extraction successful for note ' . $note_id);
-            } else {
-                error_log('Content extraction failed for note ' . $note_id . ': ' . ($extraction_result['message'] ?? 'Unknown error'));
-            }
-        } catch (Exception $e) {
-            error_log('Exception during content extraction: ' . $e->getMessage());
-            // Don't fail the upload if extraction fails
+            $stmt = $pdo->prepare("
+                INSERT INTO extracted_content (note_id, user_id, extraction_status)
+                VALUES (?, ?, 'pending')
+            ");
+            $stmt->execute([$note_id, $user_id]);
+        } catch (PDOException $e) {
+            // Don't fail the upload; the service's sweep queues notes without a row
+            error_log('Could not queue content extraction for note ' . $note_id . ': ' . $e->getMessage());
         }
 
         echo json_encode([
             'success' => true,
             'message' => 'PDF uploaded successfully',
             'note_id' => $note_id,
+            'extraction_status' => 'pending',
             'note_data' => [
                 'id' => $note_id,
                 'title' => $title,
@@ -161,8 +158,8 @@ try {
 
         // Insert note into database
         $stmt = $pdo->prepare("
-            INSERT INTO notes (user_id, title, content, file_size, file_type, original_filename, uploaded_at)
-            VALUES (?, ?, ?, ?, ?, ?, NOW())
+            INSERT INTO notes (user_id, title, content, file_size, file_type, original_filename, content_hash, uploaded_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, NOW())
         ");
 
         $stmt->execute([
@@ -171,7 +168,8 @@ try {
             $content,
             $file_size,
             $file_type,
-            $original_filename
+            $original_filename,
+            hash('sha256', $content)
         ]);
 
         $note_id = $pdo->lastInsertId();
@@ -20,34 +20,19 @@ if ($_SERVER['REQUEST_METHOD'] !== 'POST') {
 // Include database connection
 require_once 'config.php';
 
-// Function to extract text content from notes - now uses stored extracted content
+// Function to get the note content passed to the chat script
 function extractNoteContent($pdo, $noteId, $content, $fileType, $originalFilename = null) {
-    if (strtoupper($fileType) === 'PDF DOCUMENT') {
-        // For PDFs, try to get extracted content from database first
-        try {
-            $stmt = $pdo->prepare("
-                SELECT extracted_text
-                FROM extracted_content
-                WHERE note_id = ? AND extraction_status = 'completed'
-                LIMIT 1
-            ");
-            $stmt->execute([$noteId]);
-            $extracted = $stmt->fetch(PDO::FETCH_ASSOC);
-
-            if ($extracted && !empty($extracted['extracted_text'])) {
-                return $extracted['extracted_text'];
-            }
-        } catch (Exception $e) {
-            error_log('Error getting extracted content: ' . $e->getMessage());
-        }
+    // PDFs are passed as their file path: the Python script reads only the part
+    // of the stored (compressed) extraction it needs, or extracts on demand when
+    // nothing is stored yet. Text notes are returned as-is.
+    return $content;
+}
 
-        // Fallback: let the Python script handle on-demand extraction
-        // Just return the file path which will signal the Python script to extract on demand
-        return $content;
-    } else {
-        // For text notes, return as-is
-        return $content;
-    }
+// Send one Server-Sent Event and push it to the client immediately
+function sendSseEvent($event, $data) {
+    echo "event: $event\n";
+    echo 'data: ' . json_encode($data, JSON_UNESCAPED_UNICODE) . "\n\n";
+    flush();
 }
 
 // Get user session
@@ -60,11 +45,15 @@ if (!isset($_SESSION['id'])) {
 }
 
 $user_id = $_SESSION['id'];
+// Release the session lock: a streamed answer would otherwise block every
+// other request from this user until it finishes
+session_write_close();
 
 // Get request data
 $input = json_decode(file_get_contents('php://input'), true);
 $conversation_id = $input['conversation_id'] ?? null;
 $message = trim($input['message'] ?? '');
+$stream = !empty($input['stream']);
 
 if (!$conversation_id || !$message) {
     echo json_encode(['success' => false, 'message' => 'Conversation ID and message are required']);
@@ -98,22 +87,15 @@ try {
     $stmt->execute([$conversation_id, $user_id, $message]);
     $message_id = $pdo->lastInsertId();
 
-    // Get conversation history for context
-    $stmt = $pdo->prepare("
-        SELECT role, content
-        FROM chat_messages
-        WHERE conversation_id = ?
-        ORDER BY created_at ASC
-    ");
-    $stmt->execute([$conversation_id]);
-    $history = $stmt->fetchAll(PDO::FETCH_ASSOC);
-
-    // Prepare the context for the AI
+    // Prepare the context for the AI; the Python side loads the conversation
+    // history itself, within its token budget
     $context = [
+        'note_id' => $conversation['note_id'],
         'note_title' => $conversation['note_title'],
         'note_content' => $noteContent,
         'file_type' => $conversation['file_type'],
-        'conversation_history' => $history
+        'conversation_id' => (int)$conversation_id,
+        'message_id' => (int)$message_id
     ];
 
     // Call the Python chat script
@@ -128,6 +110,9 @@ try {
         file_put_contents($temp_file, $json_context);
 
         $command = 'python ' . escapeshellarg($python_script) . ' ' . escapeshellarg($temp_file) . ' ' . escapeshellarg($message);
+        if ($stream) {
+            $command .= ' --stream';
+        }
         error_log('Chat command: ' . $command);
         error_log('JSON context: ' . $json_context);
     } catch (Exception $e) {
@@ -155,6 +140,76 @@ try {
         exit();
     }
 
+    if ($stream) {
+        fclose($pipes[0]);
+
+        // Switch to Server-Sent Events and relay tokens as the model produces them
+        header('Content-Type: text/event-stream');
+        header('Cache-Control: no-cache');
+        header('X-Accel-Buffering: no');
+        while (ob_get_level() > 0) {
+            ob_end_flush();
+        }
+
+        $ai_message = null;
+        $ai_token_count = 0;
+        while (($line = fgets($pipes[1])) !== false) {
+            $event = json_decode(trim($line), true);
+            if (!is_array($event) || !isset($event['type'])) {
+                continue;
+            }
+
+            if ($event['type'] === 'token') {
+                sendSseEvent('token', ['content' => $event['content']]);
+            } elseif ($event['type'] === 'done') {
+                $ai_message = $event['message'];
+                $ai_token_count = (int)($event['token_count'] ?? 0);
+            } else {
+                error_log('Chat stream error: ' . ($event['error'] ?? $event['message'] ?? 'Unknown error'));
+            }
+        }
+
+        $stderr = stream_get_contents($pipes[2]);
+        fclose($pipes[1]);
+        fclose($pipes[2]);
+        proc_close($process);
+
+        if (!empty($stderr)) {
+            error_log('Chat script stderr: ' . $stderr);
+        }
+        if (file_exists($temp_file)) {
+            unlink($temp_file);
+        }
+
+        if ($ai_message === null || $ai_message === '') {
+            sendSseEvent('error', ['success' => false, 'message' => 'Failed to generate AI response']);
+            exit();
+        }
+
+        // Persist the assistant message once the stream has completed
+        $stmt = $pdo->prepare("
+            INSERT INTO chat_messages (conversation_id, user_id, role, content, token_count)
+            VALUES (?, ?, 'assistant', ?, ?)
+        ");
+        $stmt->execute([$conversation_id, $user_id, $ai_message, $ai_token_count]);
+
+        sendSseEvent('done', [
+            'success' => true,
+            'user_message' => [
+                'id' => $message_id,
+                'role' => 'user',
+                'content' => $message,
+                'created_at' => date('Y-m-d H:i:s')
+            ],
+            'ai_message' => [
+                'role' => 'assistant',
+                'content' => $ai_message,
+                'created_at' => date('Y-m-d H:i:s')
+            ]
+        ]);
+        exit();
+    }
+
     // Read output and errors
     $stdout = stream_get_contents($pipes[1]);
     $stderr = stream_get_contents($pipes[2]);
@@ -208,10 +263,10 @@ try {
 
     // Save the AI's response
     $stmt = $pdo->prepare("
-        INSERT INTO chat_messages (conversation_id, user_id, role, content)
-        VALUES (?, ?, 'assistant', ?)
+        INSERT INTO chat_messages (conversation_id, user_id, role, content, token_count)
+        VALUES (?, ?, 'assistant', ?, ?)
     ");
-    $stmt->execute([$conversation_id, $user_id, $ai_message]);
+    $stmt->execute([$conversation_id, $user_id, $ai_message, (int)($response['token_count'] ?? 0)]);
 
     // Clean up temporary file
     if (file_exists($temp_file)) {
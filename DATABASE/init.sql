@@ -25,13 +25,15 @@ CREATE TABLE IF NOT EXISTS notes (
     file_size VARCHAR(20),
     file_type VARCHAR(50) DEFAULT 'Text Document',
     original_filename VARCHAR(255),
+    content_hash CHAR(64),
     uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     INDEX idx_user_id (user_id),
     INDEX idx_uploaded_at (uploaded_at),
     INDEX idx_title (title),
-    INDEX idx_updated_at (updated_at)
+    INDEX idx_updated_at (updated_at),
+    INDEX idx_content_hash (content_hash)
 );
 
 CREATE TABLE IF NOT EXISTS summaries (
@@ -54,9 +56,14 @@ CREATE TABLE IF NOT EXISTS extracted_content (
 
     note_id INT NOT NULL,
     user_id INT NOT NULL,
-    extracted_text LONGTEXT NOT NULL,
-    extraction_status ENUM('pending', 'completed', 'failed') DEFAULT 'pending',
+    extracted_text LONGTEXT,  -- uncompressed text of rows written before extracted_blob
+    extracted_blob LONGBLOB,  -- compressed text (text_store.py)
+    extraction_status ENUM('pending', 'processing', 'completed', 'failed') DEFAULT 'pending',
     error_message TEXT,
+    -- claims by the ingestion service (ingest_service.py)
+    attempts INT NOT NULL DEFAULT 0,
+    worker_id VARCHAR(100),
+    started_at TIMESTAMP NULL,
     extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (note_id) REFERENCES notes(id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
@@ -68,6 +75,94 @@ CREATE TABLE IF NOT EXISTS extracted_content (
 );
 
 
+CREATE TABLE IF NOT EXISTS extracted_pages (
+    note_id INT NOT NULL,
+    page_number INT NOT NULL,
+    page_text LONGTEXT NOT NULL,
+    extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (note_id, page_number),
+    FOREIGN KEY (note_id) REFERENCES notes(id) ON DELETE CASCADE
+);
+
+
+CREATE TABLE IF NOT EXISTS content_chunks (
+    note_id INT NOT NULL,
+    chunk_index INT NOT NULL,
+    page_number INT,
+    chunk_text MEDIUMTEXT NOT NULL,
+    term_freqs JSON NOT NULL,
+    term_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (note_id, chunk_index),
+    FOREIGN KEY (note_id) REFERENCES notes(id) ON DELETE CASCADE
+);
+
+
+CREATE TABLE IF NOT EXISTS content_index (
+    content_hash CHAR(64) PRIMARY KEY,
+    extracted_text LONGTEXT,
+    extracted_blob LONGBLOB,
+    summary_text LONGTEXT,
+    summary_model VARCHAR(50),
+    quiz_questions JSON,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+
+CREATE TABLE IF NOT EXISTS summary_chunks (
+    chunk_key CHAR(64) PRIMARY KEY,
+    ai_model VARCHAR(50) NOT NULL,
+    summary_text LONGTEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    note_id INT NOT NULL,
+    user_id INT NOT NULL,
+    mode ENUM('summary', 'quiz') NOT NULL,
+    status ENUM('queued', 'running', 'completed', 'failed') NOT NULL DEFAULT 'queued',
+    -- '<mode>:<note_id>' while queued or running, NULL once finished, so
+    -- duplicate requests coalesce onto the active job
+    dedupe_key VARCHAR(64),
+    -- regenerate: skip reused and cached AI outputs
+    refresh TINYINT(1) NOT NULL DEFAULT 0,
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    result JSON,
+    error_message TEXT,
+    worker_id VARCHAR(100),
+    run_after TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP NULL,
+    -- refreshed by the worker while the job runs; a stale one means the worker died
+    heartbeat_at TIMESTAMP NULL,
+    finished_at TIMESTAMP NULL,
+    FOREIGN KEY (note_id) REFERENCES notes(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    UNIQUE KEY unique_active_job (dedupe_key),
+    INDEX idx_status_run_after (status, run_after),
+    INDEX idx_note_mode (note_id, mode)
+);
+
+
+CREATE TABLE IF NOT EXISTS question_bank (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    content_hash CHAR(64) NOT NULL,
+    section_key CHAR(64) NOT NULL,
+    section_number INT NOT NULL,
+    question_hash CHAR(64) NOT NULL,
+    question TEXT NOT NULL,
+    options JSON NOT NULL,
+    correct CHAR(1) NOT NULL,
+    ai_model VARCHAR(50),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY unique_bank_question (content_hash, question_hash),
+    INDEX idx_bank_section (content_hash, section_key)
+);
+
+
 CREATE TABLE IF NOT EXISTS quizzes (
     id INT AUTO_INCREMENT PRIMARY KEY,
     note_id INT NOT NULL,
@@ -95,7 +190,7 @@ CREATE TABLE IF NOT EXISTS quiz_attempts (
     UNIQUE KEY unique_quiz_attempt (quiz_id, user_id, completed_at)
 );
 
-CREATE TABLE chat_conversations (
+CREATE TABLE IF NOT EXISTS chat_conversations (
     id INT AUTO_INCREMENT PRIMARY KEY,
     note_id INT NOT NULL,
     user_id INT NOT NULL,
@@ -113,7 +208,7 @@ CREATE TABLE chat_conversations (
     INDEX idx_is_active (is_active)
 );
 
-CREATE TABLE chat_messages (
+CREATE TABLE IF NOT EXISTS chat_messages (
     id INT AUTO_INCREMENT PRIMARY KEY,
     conversation_id INT NOT NULL,
     user_id INT NOT NULL,
@@ -129,7 +224,17 @@ CREATE TABLE chat_messages (
     INDEX idx_created_at (created_at)
 );
 
-CREATE TABLE feedback (
+CREATE TABLE IF NOT EXISTS conversation_memory (
+    conversation_id INT PRIMARY KEY,
+    summary_text LONGTEXT NOT NULL,
+    -- id of the last chat_messages row folded into the summary
+    summarized_through INT NOT NULL DEFAULT 0,
+    token_count INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (conversation_id) REFERENCES chat_conversations(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS feedback (
     id INT AUTO_INCREMENT PRIMARY KEY,
     name VARCHAR(100) NOT NULL,
     email VARCHAR(100) NOT NULL,
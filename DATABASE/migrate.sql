@@ -0,0 +1,63 @@
+-- Upgrades a database created from an older init.sql. Safe to run any number
+-- of times: every step checks information_schema first, and the MODIFY
+-- statements only restate the current definitions.
+--
+--   mysql -u your_username -p ai_study_helper < DATABASE/init.sql      (adds missing tables)
+--   mysql -u your_username -p ai_study_helper < DATABASE/migrate.sql   (adds missing columns)
+
+USE ai_study_helper;
+
+DROP PROCEDURE IF EXISTS add_column_if_missing;
+DROP PROCEDURE IF EXISTS add_index_if_missing;
+
+DELIMITER //
+
+CREATE PROCEDURE add_column_if_missing(IN table_name_in VARCHAR(64), IN column_name_in VARCHAR(64), IN definition TEXT)
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = table_name_in AND COLUMN_NAME = column_name_in
+    ) THEN
+        SET @ddl = CONCAT('ALTER TABLE `', table_name_in, '` ADD COLUMN `', column_name_in, '` ', definition);
+        PREPARE statement FROM @ddl;
+        EXECUTE statement;
+        DEALLOCATE PREPARE statement;
+    END IF;
+END //
+
+CREATE PROCEDURE add_index_if_missing(IN table_name_in VARCHAR(64), IN index_name_in VARCHAR(64), IN columns_in TEXT)
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = table_name_in AND INDEX_NAME = index_name_in
+    ) THEN
+        SET @ddl = CONCAT('ALTER TABLE `', table_name_in, '` ADD INDEX `', index_name_in, '` (', columns_in, ')');
+        PREPARE statement FROM @ddl;
+        EXECUTE statement;
+        DEALLOCATE PREPARE statement;
+    END IF;
+END //
+
+DELIMITER ;
+
+
+-- Uploads deduplicated by content hash
+CALL add_column_if_missing('notes', 'content_hash', 'CHAR(64) AFTER original_filename');
+CALL add_index_if_missing('notes', 'idx_content_hash', 'content_hash');
+
+-- Compressed extracted text; extracted_text stays for rows written before it
+CALL add_column_if_missing('extracted_content', 'extracted_blob', 'LONGBLOB AFTER extracted_text');
+ALTER TABLE extracted_content MODIFY extracted_text LONGTEXT;
+
+-- Claims by the ingestion service (ingest_service.py)
+ALTER TABLE extracted_content
+    MODIFY extraction_status ENUM('pending', 'processing', 'completed', 'failed') DEFAULT 'pending';
+CALL add_column_if_missing('extracted_content', 'attempts', 'INT NOT NULL DEFAULT 0 AFTER error_message');
+CALL add_column_if_missing('extracted_content', 'worker_id', 'VARCHAR(100) AFTER attempts');
+CALL add_column_if_missing('extracted_content', 'started_at', 'TIMESTAMP NULL AFTER worker_id');
+
+-- Job heartbeats (job_queue.py)
+CALL add_column_if_missing('generation_jobs', 'heartbeat_at', 'TIMESTAMP NULL AFTER started_at');
+
+DROP PROCEDURE add_column_if_missing;
+DROP PROCEDURE add_index_if_missing;
@@ -0,0 +1,297 @@
+"""
+Buffered structured logging shared by the Python modules.
+
+Log calls only format a record and put it on an in-memory queue; a
+background thread writes the queue to LOGS/activity.log in batches as JSON
+lines, keeping the file open between batches and rotating it by size.
+Each record carries the component, level, process id and the current
+request id (set per worker request, job or CLI call), and long messages and
+fields are truncated so note contents never end up in the log.
+
+Records at LOG_STDERR_LEVEL and above are also printed to stderr right away,
+in the old "[timestamp] [COMPONENT_ERROR] message" form.
+
+Usage in a module:
+    logger = app_log.get_logger('CHAT')
+    activity_log = logger.info
+    error_log = logger.error
+"""
+
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'LOGS')
+LOG_PATH = os.getenv('LOG_PATH') or os.path.join(LOG_DIR, 'activity.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_STDERR_LEVEL = os.getenv('LOG_STDERR_LEVEL', 'WARNING').upper()
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))  # rotate above this size, 0 = never
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', '5'))
+LOG_FLUSH_INTERVAL = float(os.getenv('LOG_FLUSH_INTERVAL', '1'))       # seconds between writes
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '500'))               # records per write
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))             # records dropped when the writer falls this far behind
+LOG_MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', '1000'))
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+
+
+# ---------- Request ids ----------
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+def get_request_id():
+    """The request id of the current thread or task, if one is set."""
+    return _request_id.get()
+
+
+def set_request_id(request_id=None):
+    """Set the request id for the current context. Returns it."""
+    request_id = request_id or new_request_id()
+    _request_id.set(request_id)
+    return request_id
+
+
+@contextlib.contextmanager
+def request_context(request_id=None):
+    """Run a block under a request id, restoring the previous one afterwards."""
+    token = _request_id.set(request_id or new_request_id())
+    try:
+        yield _request_id.get()
+    finally:
+        _request_id.reset(token)
+
+
+def in_request(fn):
+    """Wrap fn to run under the caller's request id, e.g. for thread pool tasks."""
+    request_id = _request_id.get()
+
+    def run(*args, **kwargs):
+        with request_context(request_id) if request_id else contextlib.nullcontext():
+            return fn(*args, **kwargs)
+    return run
+
+
+# ---------- Writer ----------
+
+def _rotate(path):
+    for i in range(LOG_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    if LOG_BACKUPS > 0:
+        os.replace(path, f"{path}.1")
+    else:
+        os.remove(path)
+
+
+class LogWriter:
+    """Background thread that drains the record queue into the log file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self.dropped = 0
+        self.file = None
+        self.closing = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='app-log-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, line):
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            # Never block the caller on logging
+            self.dropped += 1
+
+    def _open(self):
+        """(Re)open the log file, following rotations done by other processes."""
+        if self.file is not None:
+            try:
+                if os.fstat(self.file.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return
+            except OSError:
+                pass
+            self.file.close()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def _write(self, lines):
+        if self.dropped:
+            lines.append(json.dumps({"ts": _timestamp(), "level": "WARNING", "component": "LOG",
+                                     "pid": os.getpid(), "msg": f"Dropped {self.dropped} log records"}))
+            self.dropped = 0
+        try:
+            self._open()
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+            if LOG_MAX_BYTES and self.file.tell() >= LOG_MAX_BYTES:
+                self.file.close()
+                self.file = None
+                _rotate(self.path)
+        except OSError as e:
+            print(f"[LOG_ERROR] Could not write {self.path}: {e}", file=sys.stderr)
+
+    def _drain(self, first):
+        lines = [first]
+        while len(lines) < LOG_BATCH_SIZE:
+            try:
+                lines.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return [line for line in lines if line is not None]
+
+    def _run(self):
+        while True:
+            line = self.queue.get()
+            if line is not None:
+                self._write(self._drain(line))
+            if self._gather():
+                break
+        self._flush_remaining()
+
+    def _gather(self):
+        """Let records collect until a batch is full or LOG_FLUSH_INTERVAL passes. True when closing."""
+        deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+        while self.queue.qsize() < LOG_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.closing.wait(min(remaining, 0.05)):
+                return True
+        return self.closing.is_set()
+
+    def _flush_remaining(self):
+        lines = []
+        while True:
+            try:
+                line = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if line is not None:
+                lines.append(line)
+        if lines:
+            self._write(lines)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self, timeout=5):
+        """Write everything queued so far and stop the thread."""
+        self.closing.set()
+        try:
+            # Wake the thread if it is waiting for records
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    """The writer for this process (a forked child starts its own)."""
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer_pid != os.getpid():
+                _writer = LogWriter(LOG_PATH)
+                _writer_pid = os.getpid()
+    return _writer
+
+
+def flush():
+    """Write out everything queued. Called at exit; later records start a new writer."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None and _writer_pid == os.getpid():
+        writer.close()
+
+
+atexit.register(flush)
+
+
+# ---------- Loggers ----------
+
+def _timestamp():
+    return datetime.now().astimezone().isoformat(timespec='milliseconds')
+
+
+def _truncate(value):
+    if isinstance(value, str) and len(value) > LOG_MAX_FIELD_CHARS:
+        return value[:LOG_MAX_FIELD_CHARS] + f"... [{len(value) - LOG_MAX_FIELD_CHARS} more chars]"
+    return value
+
+
+class Logger:
+    """Logger for one component. Messages are joined like print(); keyword arguments become fields."""
+
+    def __init__(self, component):
+        self.component = component
+        self.min_level = LEVELS.get(LOG_LEVEL, 20)
+        self.stderr_level = LEVELS.get(LOG_STDERR_LEVEL, 30)
+
+    def log(self, level, *args, **fields):
+        number = LEVELS[level]
+        if number < self.min_level and number < self.stderr_level:
+            return
+        message = _truncate(" ".join(str(arg) for arg in args))
+        timestamp = _timestamp()
+
+        if number >= self.min_level:
+            record = {
+                "ts": timestamp,
+                "level": level,
+                "component": self.component,
+                "pid": os.getpid(),
+                "request_id": _request_id.get(),
+                "msg": message,
+            }
+            record.update({key: _truncate(value) for key, value in fields.items()})
+            _get_writer().put(json.dumps(record, ensure_ascii=False, default=str))
+
+        if number >= self.stderr_level:
+            suffix = "_ERROR" if number >= LEVELS['ERROR'] else ("_WARNING" if number >= LEVELS['WARNING'] else "")
+            print(f"[{timestamp}] [{self.component}{suffix}]", message, file=sys.stderr)
+
+    def debug(self, *args, **fields):
+        self.log('DEBUG', *args, **fields)
+
+    def info(self, *args, **fields):
+        self.log('INFO', *args, **fields)
+
+    def warning(self, *args, **fields):
+        self.log('WARNING', *args, **fields)
+
+    def error(self, *args, **fields):
+        self.log('ERROR', *args, **fields)
+
+
+_loggers = {}
+
+
+def get_logger(component):
+    """Get the shared logger for a component name."""
+    if component not in _loggers:
+        _loggers[component] = Logger(component)
+    return _loggers[component]
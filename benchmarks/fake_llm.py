@@ -0,0 +1,142 @@
+"""
+Local OpenAI-compatible fake LLM endpoint for benchmarks.
+
+Serves POST /v1/chat/completions (blocking and streaming) with the
+deterministic synthetic answers of llm_replay.synthesize: point-wise
+summaries, valid MCQ JSON for quiz prompts, and short answers for chat. Latency is configurable so the client-side limits
+and queueing can be measured without a real provider. Like OpenRouter, it
+reports the prompt up to the last cache_control breakpoint as cached tokens
+once it has seen that prefix before.
+
+Usage: py benchmarks/fake_llm.py [--port 8799] [--latency-ms 200] [--jitter-ms 50]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Same synthetic answers as the in-process replay provider
+from llm_replay import message_text, split_stream, synthesize
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """Minimal /v1/chat/completions implementation."""
+
+    latency = 0.2
+    jitter = 0.05
+    chunk_delay = 0.005
+    requests = 0
+    lock = threading.Lock()
+    prefixes = set()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        with FakeLLMHandler.lock:
+            FakeLLMHandler.requests += 1
+
+        messages = body.get('messages', [])
+        text = synthesize(messages, body.get('max_tokens'))
+        usage = self._usage(messages, text)
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+        if body.get('stream'):
+            self._stream(body.get('model', 'fake'), text,
+                         usage if (body.get('stream_options') or {}).get('include_usage') else None)
+        else:
+            self._complete(body.get('model', 'fake'), text, usage)
+
+    def _usage(self, messages, text):
+        prompt_tokens = sum(len(message_text(m.get('content', ''))) for m in messages) // 4
+        breakpoints = [i for i, m in enumerate(messages)
+                       if isinstance(m.get('content'), list) and any('cache_control' in part for part in m['content'])]
+        cached = 0
+        if breakpoints:
+            prefix = messages[:breakpoints[-1] + 1]
+            key = json.dumps(prefix, sort_keys=True)
+            with FakeLLMHandler.lock:
+                if key in FakeLLMHandler.prefixes:
+                    cached = sum(len(message_text(m.get('content', ''))) for m in prefix) // 4
+                FakeLLMHandler.prefixes.add(key)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4,
+                "total_tokens": prompt_tokens + len(text) // 4,
+                "prompt_tokens_details": {"cached_tokens": cached}}
+
+    def _complete(self, model, text, usage):
+        payload = json.dumps({
+            "id": "fake-completion",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, model, text, usage=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for piece in split_stream(text):
+            chunk = {
+                "id": "fake-completion",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.chunk_delay)
+        if usage:
+            chunk = {"id": "fake-completion", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [], "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start(port=0, latency_ms=200, jitter_ms=50):
+    """Start the fake endpoint in a background thread. Returns (server, base_url)."""
+    FakeLLMHandler.latency = latency_ms / 1000
+    FakeLLMHandler.jitter = jitter_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeLLMHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM endpoint")
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--jitter-ms', type=float, default=50)
+    args = parser.parse_args()
+
+    server, url = start(args.port, args.latency_ms, args.jitter_ms)
+    print(f"Fake LLM listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,625 @@
+"""
+Performance benchmarks for the AI Study Helper hot paths.
+
+Runs PDF extraction over uploads/ and synthetic large PDFs, chunking and
+retrieval, and the summary, quiz and chat flows against a local fake LLM
+endpoint (benchmarks/fake_llm.py, or the in-process llm_replay provider with
+--replay). Each benchmark reports throughput, p50/p95/p99 latency, per-stage
+time and the peak RSS sampled while it ran (with its rise over the RSS at its
+start) as JSON, so runs from two commits can be compared with the compare
+command. The provider rate limits are off unless --rate-limit is given, so
+the LLM flows measure our code rather than LLM_RATE_PER_SEC.
+
+With --mysql the full database-backed flows also run, against a scratch
+database (BENCH_DB_NAME, default <DB_NAME>_bench) created from
+DATABASE/init.sql. Without it those flows are reported as skipped.
+
+Usage:
+    py benchmarks/run_benchmarks.py [--output results.json] [--iterations 3]
+                                    [--concurrency 4] [--mysql] [--only extract,chat]
+    py benchmarks/run_benchmarks.py compare <base.json> <new.json>
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_pdf
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# ---------- Measurement ----------
+
+_stage_times = threading.local()
+
+
+def _stages():
+    if not hasattr(_stage_times, 'totals'):
+        _stage_times.totals = {}
+    return _stage_times.totals
+
+
+def _add_stage(stage, seconds):
+    totals = _stages()
+    totals[stage] = totals.get(stage, 0.0) + seconds
+
+
+def instrument(module, name, stage):
+    """Time every call of module.name under stage (generators until exhausted)."""
+    original = getattr(module, name)
+
+    if name == 'stream_sync':
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                yield from original(*args, **kwargs)
+            finally:
+                _add_stage(stage, time.perf_counter() - start)
+    else:
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                _add_stage(stage, time.perf_counter() - start)
+
+    wrapper.__wrapped__ = original
+    setattr(module, name, wrapper)
+
+
+RSS_SAMPLE_INTERVAL = 0.01  # seconds
+
+
+def current_rss_mb():
+    """Resident set size now in MB: this process, plus its children with psutil. None if unknown."""
+    if psutil is not None:
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass  # exited between listing and reading
+        return total / (1024 * 1024)
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RssSampler:
+    """Samples RSS on a thread while a benchmark runs.
+
+    ru_maxrss is the peak over the whole process lifetime, so every benchmark
+    after a big one would report the big one's peak.
+    """
+
+    def __enter__(self):
+        self.start = self.peak = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self._sample()
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def report(self):
+        if self.peak is None:
+            return {"peak_rss_mb": None, "rss_delta_mb": None}
+        return {"peak_rss_mb": round(self.peak, 1), "rss_delta_mb": round(self.peak - self.start, 1)}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize_latencies(seconds):
+    ms = [s * 1000 for s in seconds]
+    if not ms:
+        return {}
+    return {
+        "p50": round(percentile(ms, 50), 2),
+        "p95": round(percentile(ms, 95), 2),
+        "p99": round(percentile(ms, 99), 2),
+        "mean": round(statistics.fmean(ms), 2),
+        "max": round(max(ms), 2),
+    }
+
+
+def run_benchmark(name, fn, items, iterations=1, concurrency=1, units=None):
+    """Call fn(item) for every item, iterations times, on concurrency threads.
+
+    units(item, result) may return how many units (pages, tokens...) a call
+    processed, reported as units_per_s.
+    """
+    latencies = []
+    stage_samples = {}
+    errors = []
+    unit_count = 0
+    lock = threading.Lock()
+
+    def call(item):
+        nonlocal unit_count
+        _stages().clear()
+        start = time.perf_counter()
+        try:
+            result = fn(item)
+            error = None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - start
+        with lock:
+            if error:
+                errors.append(error)
+                return
+            latencies.append(elapsed)
+            for stage, seconds in _stages().items():
+                stage_samples.setdefault(stage, []).append(seconds)
+            if units:
+                unit_count += units(item, result) or 0
+
+    work = [item for _ in range(iterations) for item in items]
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(call, work))
+        else:
+            for item in work:
+                call(item)
+        wall = time.perf_counter() - start
+
+    report = {
+        "calls": len(work),
+        "errors": len(errors),
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(len(latencies) / wall, 3) if wall else None,
+        "latency_ms": summarize_latencies(latencies),
+        "stages_ms": {stage: summarize_latencies(samples) for stage, samples in sorted(stage_samples.items())},
+        **rss.report(),
+    }
+    if units:
+        report["units_per_s"] = round(unit_count / wall, 1) if wall else None
+    if errors:
+        report["first_errors"] = errors[:3]
+    print(f"  {name}: {report['calls']} calls, p50 {report['latency_ms'].get('p50')} ms, "
+          f"p95 {report['latency_ms'].get('p95')} ms, {report['errors']} errors", file=sys.stderr)
+    return report
+
+
+# ---------- Environment ----------
+
+def configure_environment(args):
+    """Settings the app modules read at import time."""
+    os.environ['LLM_PROVIDER'] = 'replay' if args.replay else 'live'
+    os.environ['OPENROUTER_API_KEY1'] = 'sk-or-bench'
+    os.environ['OPENROUTER_API_KEY2'] = 'sk-or-bench'
+    os.environ['GEMINI_API_KEY'] = 'bench'
+    os.environ['WORKER_ENABLED'] = '0'
+    if args.pdf_backend:
+        os.environ['PDF_BACKEND'] = args.pdf_backend
+    if not args.llm_cache:
+        os.environ['LLM_CACHE_ENABLED'] = '0'
+    if not args.rate_limit:
+        # A fake endpoint has no quota to protect; the token buckets would only add waits
+        for name in ('', 'GEMINI_', 'OPENROUTER_', 'OPENROUTER_CHAT_'):
+            os.environ[f'LLM_{name}RATE_PER_SEC'] = '0'
+    # summary_generator refuses to start without these
+    os.environ.setdefault('DB_USER', 'bench')
+    os.environ.setdefault('DB_PASS', 'bench')
+    os.environ.setdefault('DB_NAME', 'ai_study_helper')
+    if args.mysql:
+        os.environ['DB_NAME'] = os.getenv('BENCH_DB_NAME') or f"{os.environ['DB_NAME']}_bench"
+
+
+def setup_providers(llm_url):
+    """Send every provider's calls to the fake endpoint."""
+    import llm_providers
+    llm_providers.OPENROUTER_BASE_URL = llm_url
+    for name in llm_providers.PROVIDER_FACTORIES:
+        llm_providers.PROVIDER_FACTORIES[name] = (
+            lambda name=name: llm_providers.OpenAICompatibleProvider(name, 'sk-or-bench', llm_url)
+        )
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+# ---------- Corpus ----------
+
+def load_corpus(args, workdir):
+    """Return [(label, path)] for uploads/ PDFs plus generated large PDFs."""
+    corpus = [(os.path.basename(p), p) for p in sorted(glob.glob(os.path.join(ROOT, 'uploads', '*.pdf')))]
+    if args.max_uploads:
+        corpus = corpus[:args.max_uploads]
+    for pages in args.synthetic_pages:
+        path = os.path.join(workdir, f"synthetic_{pages}.pdf")
+        synthetic_pdf.write_pdf(path, pages=pages, seed=pages)
+        corpus.append((f"synthetic_{pages}p", path))
+    return corpus
+
+
+# ---------- Benchmarks without a database ----------
+
+def bench_extraction(args, corpus, texts):
+    import content_extractor
+    import pdf_text
+
+    instrument(pdf_text, 'extract_pages', 'pdf_parse')
+    results = {}
+
+    def extract(item):
+        _, path = item
+        pages = pdf_text.extract_pages(path)
+        texts[path] = pdf_text.join_pages(pages)
+        return pages
+
+    results['extract_serial'] = run_benchmark(
+        'extract_serial', extract, corpus, 1, 1, units=lambda item, pages: len(pages))
+
+    notes = [{"id": i, "user_id": 0, "content": path, "content_hash": None}
+             for i, (_, path) in enumerate(corpus)]
+
+    def parallel(_):
+        import extract_limits
+        # One isolated process per document, as content_extractor.run_parallel_batch does
+        with extract_limits.IsolatedExecutor(max_workers=content_extractor.EXTRACT_WORKERS) as pool:
+            rows = list(pool.map(content_extractor.parse_pdf_note,
+                                 [n['id'] for n in notes], [0] * len(notes), [n['content'] for n in notes]))
+        return rows
+
+    results['extract_parallel_batch'] = run_benchmark(
+        'extract_parallel_batch', parallel, [None], 1, 1,
+        units=lambda item, rows: sum(len(r.get('pages') or ()) for r in rows))
+    results['extract_parallel_batch']['workers'] = content_extractor.EXTRACT_WORKERS
+    return results
+
+
+def bench_chunking(args, texts):
+    import chunk_index
+
+    documents = [t for t in texts.values() if t]
+    queries = ["what is the main concept", "define the process and its result", "examples of structure"]
+
+    return {
+        'chunk_build': run_benchmark(
+            'chunk_build', lambda text: chunk_index.build_chunks(text), documents, args.iterations, 1,
+            units=lambda text, chunks: len(chunks)),
+        'chunk_search_text': run_benchmark(
+            'chunk_search_text', lambda pair: chunk_index.search_text(pair[0], pair[1]),
+            [(t, q) for t in documents for q in queries], 1, 1),
+    }
+
+
+def bench_llm_flows(args, texts):
+    import chat_response
+    import db
+    import llm_router
+    import question_bank
+    import summary_generator
+
+    instrument(llm_router, 'complete_sync', 'llm')
+    instrument(llm_router, 'stream_sync', 'llm')
+
+    # In-memory stand-in for the section summary cache
+    section_cache = {}
+    db.get_chunk_summaries = lambda keys: {k: section_cache[k] for k in keys if k in section_cache}
+    db.save_chunk_summary = lambda key, model, text: section_cache.__setitem__(key, text)
+
+    documents = [t for t in texts.values() if t][:args.max_documents]
+    results = {}
+
+    def summarize(text):
+        section_cache.clear()
+        return summary_generator.summarize_text_with_gemini(text)
+
+    results['summary_text'] = run_benchmark(
+        'summary_text', summarize, documents, args.iterations, args.concurrency)
+
+    def quiz_sections(text):
+        sections = [c for _, c in question_bank.chunk_index.chunk_text(text, limit=question_bank.QUIZ_SECTION_CHARS)]
+        questions = []
+        for number, section in enumerate(sections[:3], start=1):
+            valid, _, _ = question_bank.generate_section_questions(
+                number, len(sections), section, question_bank.QUIZ_QUESTIONS_PER_SECTION)
+            questions.extend(valid)
+        return questions
+
+    results['quiz_sections'] = run_benchmark(
+        'quiz_sections', quiz_sections, documents, args.iterations, args.concurrency,
+        units=lambda text, questions: len(questions))
+
+    # Serialized the way PHP passes it
+    contexts = [
+        json.dumps({"note_title": "Benchmark", "note_content": text, "file_type": "Text", "conversation_history": []})
+        for text in documents
+    ]
+    questions = ["What is the main idea?", "Explain the process described.", "Give an example of a result."]
+    turns = [(c, q) for c in contexts for q in questions]
+
+    results['chat_blocking'] = run_benchmark(
+        'chat_blocking', lambda turn: _check(chat_response.generate_chat_response(turn[0], turn[1])),
+        turns, args.iterations, args.concurrency)
+
+    first_token = []
+
+    def chat_stream(turn):
+        start = time.perf_counter()
+        waiting = True
+        for event in chat_response.generate_chat_response_stream(turn[0], turn[1]):
+            if event['type'] == 'token' and waiting:
+                first_token.append(time.perf_counter() - start)
+                waiting = False
+            elif event['type'] == 'error':
+                raise RuntimeError(event.get('error'))
+
+    results['chat_stream'] = run_benchmark('chat_stream', chat_stream, turns, args.iterations, args.concurrency)
+    results['chat_stream']['time_to_first_token_ms'] = summarize_latencies(first_token)
+    return results
+
+
+def _check(result):
+    if not result.get('success'):
+        raise RuntimeError(result.get('error') or result.get('message'))
+    return result
+
+
+# ---------- Benchmarks against the MySQL scratch database ----------
+
+def setup_database(corpus):
+    """Create the scratch schema and seed one user with a note per PDF."""
+    import mysql.connector
+    import content_index
+    import db
+
+    conn = mysql.connector.connect(host=db.DB_HOST, user=db.DB_USER, password=db.DB_PASSWORD)
+    cursor = conn.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{db.DB_NAME}`")
+    cursor.execute(f"CREATE DATABASE `{db.DB_NAME}`")
+    cursor.execute(f"USE `{db.DB_NAME}`")
+
+    with open(os.path.join(ROOT, 'DATABASE', 'init.sql'), encoding='utf-8') as f:
+        sql = "\n".join(line for line in f if not line.strip().startswith('--'))
+    for statement in sql.split(';'):
+        statement = statement.strip()
+        if statement and not statement.upper().startswith(('CREATE DATABASE', 'USE ')):
+            cursor.execute(statement)
+
+    cursor.execute("INSERT INTO users (name, password, email) VALUES ('bench', 'x', 'bench@example.com')")
+    user_id = cursor.lastrowid
+    notes = []
+    for label, path in corpus:
+        cursor.execute(
+            "INSERT INTO notes (user_id, title, content, file_type, content_hash) VALUES (%s, %s, %s, 'PDF Document', %s)",
+            (user_id, label, path, content_index.hash_file(path))
+        )
+        notes.append(cursor.lastrowid)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return user_id, notes
+
+
+def bench_database_flows(args, corpus):
+    import chat_response
+    import chunk_index
+    import content_extractor
+    import conversation_memory
+    import db
+    import summary_generator
+
+    instrument(db, 'get_db_connection', 'db_checkout')
+    instrument(chunk_index, 'search', 'retrieval')
+    instrument(conversation_memory, 'load_history', 'memory')
+    user_id, notes = setup_database(corpus)
+    results = {}
+
+    results['db_extract_and_store'] = run_benchmark(
+        'db_extract_and_store', lambda note_id: _check(content_extractor.extract_and_store_content(note_id)),
+        notes, 1, args.concurrency)
+
+    documents = notes[:args.max_documents]
+    results['db_summary'] = run_benchmark(
+        'db_summary', lambda note_id: _check(summary_generator.generate_summary(note_id, user_id, refresh=True)),
+        documents, args.iterations, args.concurrency)
+
+    def clear_bank():
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM question_bank")
+            conn.commit()
+            cursor.close()
+
+    def quiz_cold(note_id):
+        return _check(summary_generator.generate_quiz(note_id, user_id))
+
+    clear_bank()
+    results['db_quiz_cold'] = run_benchmark('db_quiz_cold', quiz_cold, documents, 1, args.concurrency)
+    results['db_quiz_sampled'] = run_benchmark('db_quiz_sampled', quiz_cold, documents, args.iterations, args.concurrency)
+
+    def chat_turn(note_id):
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO chat_conversations (note_id, user_id) VALUES (%s, %s)", (note_id, user_id))
+            conversation_id = cursor.lastrowid
+            message_id = None
+            for i in range(args.chat_turns):
+                cursor.execute(
+                    "INSERT INTO chat_messages (conversation_id, user_id, role, content) VALUES (%s, %s, %s, %s)",
+                    (conversation_id, user_id, 'user' if i % 2 == 0 else 'assistant', f"Turn {i} about the topic")
+                )
+                message_id = cursor.lastrowid
+            conn.commit()
+            cursor.close()
+        context = json.dumps({"note_id": note_id, "note_title": "Benchmark", "note_content": "",
+                              "file_type": "PDF Document", "conversation_id": conversation_id,
+                              "message_id": message_id})
+        return _check(chat_response.generate_chat_response(context, "Turn about the topic"))
+
+    results['db_chat_turn'] = run_benchmark('db_chat_turn', chat_turn, documents, args.iterations, args.concurrency)
+    return results
+
+
+# ---------- Entry points ----------
+
+def run(args):
+    configure_environment(args)
+    import fake_llm
+    server, llm_url = fake_llm.start(0, args.llm_latency_ms, args.llm_jitter_ms)
+    os.chdir(ROOT)
+    setup_providers(llm_url)
+
+    only = set(args.only.split(',')) if args.only else None
+    wanted = lambda group: only is None or group in only
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "started_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "args": {k: v for k, v in vars(args).items() if k not in ('command', 'output')},
+            "env": {k: v for k, v in sorted(os.environ.items())
+                    if k.startswith(('LLM_', 'EXTRACT_', 'SUMMARY_', 'QUIZ_', 'CHAT_', 'CHUNK_', 'DB_POOL_'))},
+        },
+        "benchmarks": {},
+        "skipped": {},
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus = load_corpus(args, workdir)
+        report["meta"]["corpus"] = [label for label, _ in corpus]
+        texts = {}
+
+        if wanted('extract') or wanted('chunk') or wanted('llm'):
+            print("Extraction", file=sys.stderr)
+            report["benchmarks"].update(bench_extraction(args, corpus, texts))
+        if wanted('chunk'):
+            print("Chunking", file=sys.stderr)
+            report["benchmarks"].update(bench_chunking(args, texts))
+        if wanted('llm'):
+            print("LLM flows (fake endpoint)", file=sys.stderr)
+            report["benchmarks"].update(bench_llm_flows(args, texts))
+        if wanted('db'):
+            if args.mysql:
+                print("Database flows", file=sys.stderr)
+                try:
+                    report["benchmarks"].update(bench_database_flows(args, corpus))
+                except Exception as e:
+                    report["skipped"]["db"] = f"{type(e).__name__}: {e}"
+            else:
+                report["skipped"]["db"] = "run with --mysql to benchmark the database-backed flows"
+
+    report["meta"]["fake_llm_requests"] = fake_llm.FakeLLMHandler.requests
+    server.shutdown()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+def compare(base_path, new_path):
+    """Print latency and throughput changes between two result files."""
+    with open(base_path, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+
+    def change(old, value):
+        if old in (None, 0) or value is None:
+            return "n/a"
+        return f"{(value - old) / old * 100:+.1f}%"
+
+    print(f"{'benchmark':28} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18} {'throughput/s':>20}")
+    for name in sorted(set(base['benchmarks']) | set(new['benchmarks'])):
+        old_b = base['benchmarks'].get(name)
+        new_b = new['benchmarks'].get(name)
+        if not old_b or not new_b:
+            print(f"{name:28} {'only in ' + ('new' if new_b else 'base'):>18}")
+            continue
+        cells = []
+        for pct in ('p50', 'p95', 'p99'):
+            old = old_b['latency_ms'].get(pct)
+            value = new_b['latency_ms'].get(pct)
+            cells.append(f"{value} ({change(old, value)})")
+        cells.append(f"{new_b['throughput_per_s']} ({change(old_b['throughput_per_s'], new_b['throughput_per_s'])})")
+        print(f"{name:28} " + " ".join(f"{cell:>18}" for cell in cells[:3]) + f" {cells[3]:>20}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        if len(sys.argv) != 4:
+            print("Usage: py benchmarks/run_benchmarks.py compare <base.json> <new.json>", file=sys.stderr)
+            sys.exit(1)
+        compare(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description="AI Study Helper benchmarks")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--only', help="comma-separated groups: extract,chunk,llm,db")
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--max-uploads', type=int, default=0, help="limit the uploads/ PDFs used (0 = all)")
+    parser.add_argument('--max-documents', type=int, default=5, help="documents used by the LLM and database flows")
+    parser.add_argument('--synthetic-pages', type=int, nargs='*', default=[200, 1000])
+    parser.add_argument('--pdf-backend', help="PDF extraction backend (pdf_backends.py), default PDF_BACKEND")
+    parser.add_argument('--llm-latency-ms', type=float, default=200)
+    parser.add_argument('--llm-jitter-ms', type=float, default=50)
+    parser.add_argument('--replay', action='store_true',
+                        help="use the in-process replay provider (LLM_REPLAY_* settings) instead of the fake HTTP endpoint")
+    parser.add_argument('--llm-cache', action='store_true', help="keep the LLM response cache enabled")
+    parser.add_argument('--rate-limit', action='store_true',
+                        help="keep the provider token buckets (LLM_RATE_PER_SEC) on, as in production")
+    parser.add_argument('--chat-turns', type=int, default=20, help="history length for database chat turns")
+    parser.add_argument('--mysql', action='store_true', help="also run the flows that need MySQL")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
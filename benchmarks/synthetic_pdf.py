@@ -0,0 +1,67 @@
+"""
+Write large text PDFs for extraction benchmarks without extra dependencies.
+"""
+
+import random
+
+WORDS = (
+    "the process of learning involves memory attention practice feedback and review "
+    "students organize concepts into structures that connect definitions examples and "
+    "results so that new material builds on what is already understood"
+).split()
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _page_stream(rng, lines):
+    rows = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+    for _ in range(lines):
+        line = " ".join(rng.choice(WORDS) for _ in range(14))
+        rows.append(f"({_escape(line)}) '")
+    rows.append("ET")
+    return "\n".join(rows).encode('latin-1')
+
+
+def write_pdf(path, pages=100, lines_per_page=60, seed=0):
+    """Write a PDF of pages pages of pseudo-random text lines."""
+    rng = random.Random(seed)
+    objects = []  # object bodies, numbered from 1
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages_id = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for _ in range(pages):
+        stream = _page_stream(rng, lines_per_page)
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font, content)
+        ))
+
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    kids = b" ".join(b"%d 0 R" % page for page in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+
+    with open(path, 'wb') as f:
+        f.write(out)
+    return path
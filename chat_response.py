@@ -1,9 +1,22 @@
 import json
 import sys
 import os
-from datetime import datetime
-from PyPDF2 import PdfReader
+import startup
+
+if __name__ == "__main__":
+    startup.begin("chat_response")
+    # Hand the request to the long-lived worker when one is running
+    import worker_client
+    worker_client.forward_cli("chat_response", sys.argv[1:])
+
 from dotenv import load_dotenv
+import app_log
+import chunk_index
+import conversation_memory
+import db
+import llm_router
+import metrics
+import text_store
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,63 +25,52 @@ load_dotenv()
 # Get API details from environment variables
 AI_API_KEY = os.getenv('OPENROUTER_API_KEY2')
 MODEL_NAME = os.getenv('MODEL_NAME', 'openai/gpt-3.5-turbo')  # Default fallback model
-
-# Validate API key
-if not AI_API_KEY:
-    raise ValueError("OPENROUTER_API_KEY not found in environment variables")
-
-# OpenAI client (you can change this to any AI provider)
-try:
-    from openai import OpenAI
-    client = OpenAI(
-        api_key=AI_API_KEY,
-        base_url="https://openrouter.ai/api/v1" if "sk-or-" in AI_API_KEY else None
-    )
-except ImportError:
-    print("OpenAI library not found. Please install with: pip install openai", file=sys.stderr)
-    sys.exit(1)
-
-def get_log_timestamp():
-    """Get current timestamp for logging."""
-    return datetime.now().strftime('%d-%b-%Y %H:%M:%S %Z')
-
-def activity_log(*args, **kwargs):
-    """Log activity messages to activity.log."""
-    try:
-        timestamp = get_log_timestamp()
-        with open('LOGS/activity.log', 'a', encoding='utf-8') as f:
-            print(f"[{timestamp}]", *args, file=f, **kwargs)
-        # Also print to stderr for server logs
-        print("[CHAT_ACTIVITY]", *args, file=sys.stderr, **kwargs)
-    except Exception:
-        # Fallback if file logging fails
-        print("[CHAT_ACTIVITY]", *args, file=sys.stderr, **kwargs)
-
-def error_log(*args, **kwargs):
-    """Log error messages to stderr."""
-    timestamp = get_log_timestamp()
-    print(f"[{timestamp}] [CHAT_ERROR]", *args, file=sys.stderr, **kwargs)
-
-def extract_content_from_note(note_content, file_type):
+# Start of a long note sent on every turn as part of the cached prompt prefix,
+# on top of the retrieved excerpts. Off by default: it only pays off on chat
+# models with prompt caching; short notes are always sent whole
+CHAT_PREFIX_CHARS = int(os.getenv('CHAT_PREFIX_CHARS', '0'))
+# How much of a note chat reads when it has no chunk index, the same whether
+# the text comes from storage or on-demand extraction
+CHAT_NOTE_CHARS = max(CHAT_PREFIX_CHARS, chunk_index.CHAT_CONTEXT_CHARS)
+MISSING_KEY_MESSAGE = "OPENROUTER_API_KEY not found in environment variables"
+
+# Provider in llm_providers that holds the chat client (OPENROUTER_API_KEY2)
+CHAT_PROVIDER = 'openrouter_chat'
+CHAT_ROUTE = llm_router.route('chat', f"{CHAT_PROVIDER}:{MODEL_NAME}")  # LLM_CHAT_ROUTE, see llm_router
+
+logger = app_log.get_logger('CHAT')
+activity_log = logger.info
+error_log = logger.error
+
+def extract_content_from_note(note_content, file_type, note_id=None):
     """Extract readable content from note data."""
     try:
-        if file_type.upper() == 'PDF' and note_content.startswith('/uploads/'):
-            # For PDFs, if we get a file path, it means no stored content was found
-            # We need to extract on-demand (try to use the content_extractor script)
-            import subprocess
-            import json
-
+        if file_type.upper() in ('PDF', 'PDF DOCUMENT') and note_content.startswith('/uploads/'):
+            # For PDFs PHP passes the file path; read the start of the stored
+            # extraction (one character past CHAT_NOTE_CHARS shows whether there
+            # is more), which only fetches the compressed blocks it needs
+            if note_id:
+                try:
+                    with db.connection() as conn:
+                        stored = text_store.open_note_text(conn, note_id)
+                        text = stored.read_range(0, CHAT_NOTE_CHARS + 1) if stored else None
+                    if text:
+                        activity_log(f"Read {len(text)} stored characters for chat")
+                        return text
+                except Exception as e:
+                    error_log(f"Reading stored content failed: {str(e)}")
+
+            # Nothing stored yet: extract on-demand, through the note's page cache when we know the note
             try:
-                # Since we don't have the note_id here, we need to extract directly from the file path
                 activity_log(f"Attempting on-demand extraction for PDF: {note_content}")
                 # Build the full path
                 script_dir = os.path.dirname(os.path.abspath(__file__))
                 full_path = os.path.join(script_dir, note_content.lstrip('/'))
 
                 if os.path.exists(full_path):
-                    text = extract_text_from_pdf(full_path)
+                    text = extract_text_from_pdf(full_path, note_id)
                     activity_log(f"Extracted {len(text)} characters for chat")
-                    return text[:4000] if len(text) > 4000 else text  # Limit for token usage
+                    return text[:CHAT_NOTE_CHARS + 1]  # Limit for token usage
                 else:
                     return f"[PDF file not found: {note_content}]"
 
@@ -82,84 +84,172 @@ def extract_content_from_note(note_content, file_type):
         error_log(f"Error extracting content: {str(e)}")
         return note_content
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF for chat purposes - simplified version."""
+def extract_text_from_pdf(pdf_path, note_id=None):
+    """Extract text from PDF for chat purposes - first pages only."""
+    import extract_limits
+    import pdf_text
     try:
-        with open(pdf_path, "rb") as file:
-            reader = PdfReader(file)
-            text = ""
-            for page in reader.pages[:5]:  # Limit to first 5 pages for chat
-                text += page.extract_text() or ""
-                if len(text) > 4000:  # Limit content for chat
-                    break
-            return text.strip()
+        pages = range(1, 6)  # Limit to first 5 pages for chat
+        # Parsed in a child process under the per-document limits (extract_limits.py)
+        if note_id is not None:
+            page_texts = extract_limits.run(pdf_text.get_note_pages, note_id, pdf_path, pages)
+        else:
+            page_texts = extract_limits.run(pdf_text.extract_pages, pdf_path, pages)
+
+        texts = []
+        length = 0
+        for _, text in page_texts:
+            texts.append(text)
+            length += len(text)
+            if length > CHAT_NOTE_CHARS:  # Limit content for chat
+                break
+        return "".join(texts).strip()
     except Exception as e:
         error_log(f"PDF extraction error: {str(e)}")
         raise
 
-def generate_chat_response(context, user_message):
-    """Generate AI response using conversation context."""
+def get_note_context(context_data, user_message):
+    """Get (document, excerpts) for a chat turn.
+
+    document is the same on every turn so it can be part of the cached prompt
+    prefix: the whole note when it fits in CHAT_CONTEXT_CHARS (or
+    CHAT_PREFIX_CHARS), else the first CHAT_PREFIX_CHARS of it. For longer
+    notes, excerpts holds the chunks most relevant to the question that are
+    not already in document: from the note's chunk index when it has one,
+    otherwise ranked from the content passed in by PHP. Without excerpts or a
+    prefix, document falls back to the start of the note.
+    """
+    note_id = context_data.get('note_id')
+    file_type = context_data.get('file_type', 'Text')
+    history = context_data.get('conversation_history', [])
+    is_pdf = file_type.upper() in ('PDF', 'PDF DOCUMENT')
+
+    note_content = extract_content_from_note(context_data.get('note_content', ''), file_type, note_id)
+    if len(note_content) <= CHAT_NOTE_CHARS:
+        return note_content, ""
+    document = note_content[:CHAT_PREFIX_CHARS]
+
+    # Include the previous question so short follow-ups keep their topic
+    previous = [m.get('content', '') for m in history if m.get('role') == 'user' and m.get('content') != user_message]
+    query = " ".join(previous[-1:] + [user_message])
+
+    hits = None
+    if note_id:
+        try:
+            hits = chunk_index.search(note_id, query)
+        except Exception as e:
+            error_log(f"Chunk retrieval failed: {str(e)}")
+
+        if hits is None and not is_pdf:
+            # Index text notes on first use so later turns can retrieve from the database
+            try:
+                chunk_index.index_note(note_id, note_content)
+            except Exception as e:
+                error_log(f"Chunk indexing failed: {str(e)}")
 
-    try:
-        # Parse context
-        error_log(f"About to parse context: '{context[:100]}...'")
-        context_data = json.loads(context) if isinstance(context, str) else context
-        error_log(f"Successfully parsed context_data: {context_data.get('note_title', 'unknown')}")
-        note_title = context_data.get('note_title', 'Unknown Note')
-        note_content = extract_content_from_note(
-            context_data.get('note_content', ''),
-            context_data.get('file_type', 'Text')
-        )
-        conversation_history = context_data.get('conversation_history', [])
-
-        # Build conversation context
-        system_prompt = f"""You are an AI assistant strictly limited to answering questions about the user's uploaded study content.
-
-CONTENT TITLE: {note_title}
-CONTENT: {note_content[:4000]}... (truncated for brevity)
+    if hits is None and not is_pdf:
+        hits = chunk_index.search_text(note_content, query)
+
+    hits = [(page, text) for page, text in hits or () if not document or text not in document]
+    if not hits and not document:
+        return note_content[:chunk_index.CHAT_CONTEXT_CHARS], ""
+    if hits:
+        activity_log(f"Retrieved {len(hits)} chunks for note {note_id}")
+    return document, chunk_index.format_hits(hits)
+
+CHAT_INSTRUCTIONS = """You are an AI assistant strictly limited to answering questions about the user's uploaded study content.
 
 STRICT INSTRUCTIONS:
-- ONLY answer questions that can be answered using the provided content above
+- ONLY answer questions that can be answered using the provided content below
 - If a question is about ANYTHING ELSE (politics, current events, presidents, general knowledge, etc.), politely decline and say: "I'm sorry, but I can only help with questions about your uploaded content. The question you asked is outside the scope of this material."
 - Do NOT provide information not found in the content, even if you know it
 - Do NOT speculate or use external knowledge
 - If something is not in the content, say "This information is not available in your uploaded content"
 - Reference specific parts of the content when answering relevant questions
 - Be very strict about staying on topic - err on the side of declining irrelevant questions
-- If user wants to know something about the content but that information is not there in it, then search it up in the web using ur intelligence. Ex : "is paypal fortune 500 company" is asked for my paypal uploaded document. Its not mentioned in the file but since its related u must answer it.
-
-CONVERSATION HISTORY:
-"""
+- If user wants to know something about the content but that information is not there in it, then search it up in the web using ur intelligence. Ex : "is paypal fortune 500 company" is asked for my paypal uploaded document. Its not mentioned in the file but since its related u must answer it."""
+
+# Generation parameters shared by the blocking and streaming calls
+CHAT_PARAMS = {
+    "max_tokens": 1000,
+    "temperature": 0.3,  # Lower temperature for more focused responses
+    "top_p": 0.9
+}
+
+def load_conversation_history(context_data):
+    """Get (summary, recent_messages) for the turn within the history token budget."""
+    conversation_id = context_data.get('conversation_id')
+    if not conversation_id:
+        # Older callers send the history themselves
+        return None, conversation_memory.fit_to_budget(context_data.get('conversation_history', []))
 
-        messages = [{"role": "system", "content": system_prompt}]
-
-        # Add conversation history (last 10 messages to avoid token limits)
-        for msg in conversation_history[-10:]:
-            messages.append({
-                "role": msg.get('role', 'user'),
-                "content": msg.get('content', '')
-            })
+    try:
+        memory = conversation_memory.load_history(conversation_id, context_data.get('message_id'))
+        return memory['summary'], memory['messages']
+    except Exception as e:
+        error_log(f"Error loading conversation memory: {str(e)}")
+        return None, []
+
+def build_chat_messages(context, user_message):
+    """Build the model messages for a chat turn. Returns (note_title, messages)."""
+    # Parse context
+    logger.debug(f"About to parse context: '{str(context)[:100]}...'")
+    context_data = json.loads(context) if isinstance(context, str) else context
+    logger.debug(f"Successfully parsed context_data: {context_data.get('note_title', 'unknown')}")
+    note_title = context_data.get('note_title', 'Unknown Note')
+    with metrics.span('memory'):
+        history_summary, conversation_history = load_conversation_history(context_data)
+    context_data['conversation_history'] = conversation_history
+    with metrics.span('retrieval'):
+        document, excerpts = get_note_context(context_data, user_message)
+
+    # Instructions and the note come first and are byte-identical on every
+    # turn, so the provider can serve them from its prompt cache; everything
+    # that changes per turn follows
+    system = f"{CHAT_INSTRUCTIONS}\n\nCONTENT TITLE: {note_title}"
+    if document:
+        system += f"\nCONTENT:\n{document}"
+    messages = [{"role": "system", "content": system, "cache": True}]
+    if history_summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {history_summary}"})
+
+    # Add the recent conversation history that fits the token budget
+    for msg in conversation_history:
+        messages.append({
+            "role": msg.get('role', 'user'),
+            "content": msg.get('content', '')
+        })
+
+    # Add current user message, with the excerpts retrieved for it
+    if excerpts:
+        intro = "Further excerpts from the content" if document else "Excerpts from the content"
+        user_message = f"{intro}, relevant to this question:\n{excerpts}\n\nQUESTION: {user_message}"
+    messages.append({"role": "user", "content": user_message})
+
+    return note_title, messages
+
+@metrics.timed_request('chat')
+def generate_chat_response(context, user_message):
+    """Generate AI response using conversation context."""
+    if not AI_API_KEY:
+        # Checked per call so importing this module (the study worker) never fails
+        error_log(MISSING_KEY_MESSAGE)
+        return {"success": False, "message": MISSING_KEY_MESSAGE}
 
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
+    try:
+        with metrics.span('prompt'):
+            note_title, messages = build_chat_messages(context, user_message)
 
         # Call AI API
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=messages,
-            max_tokens=1000,
-            temperature=0.3,  # Lower temperature for more focused responses
-            top_p=0.9
-        )
-
-        ai_response = response.choices[0].message.content.strip()
+        candidate, ai_response = llm_router.complete_sync(CHAT_ROUTE, messages, **CHAT_PARAMS)
 
         activity_log(f"Generated AI response for note: {note_title}")
 
         return {
             "success": True,
             "message": ai_response,
-            "model": MODEL_NAME
+            "model": candidate.model,
+            "token_count": conversation_memory.message_tokens({"content": ai_response})
         }
 
     except Exception as e:
@@ -170,24 +260,73 @@ CONVERSATION HISTORY:
             "error": str(e)
         }
 
+@metrics.timed_stream('chat_stream')
+def generate_chat_response_stream(context, user_message):
+    """Generate AI response incrementally.
+
+    Yields {"type": "token", "content": ...} for each chunk from the model, then a
+    final "done" event carrying the full message (or an "error" event).
+    """
+    if not AI_API_KEY:
+        error_log(MISSING_KEY_MESSAGE)
+        yield {"type": "error", "success": False, "message": MISSING_KEY_MESSAGE}
+        return
+
+    try:
+        with metrics.span('prompt'):
+            note_title, messages = build_chat_messages(context, user_message)
+
+        parts = []
+        model = MODEL_NAME
+        for delta in llm_router.stream_sync(CHAT_ROUTE, messages, **CHAT_PARAMS):
+            if isinstance(delta, llm_router.Candidate):
+                # The pair the router picked (it may fail over or hedge to another)
+                model = delta.model
+                continue
+            parts.append(delta)
+            yield {"type": "token", "content": delta}
+
+        ai_response = "".join(parts).strip()
+
+        activity_log(f"Streamed AI response for note: {note_title}")
+
+        yield {
+            "type": "done",
+            "success": True,
+            "message": ai_response,
+            "model": model,
+            "token_count": conversation_memory.message_tokens({"content": ai_response})
+        }
+
+    except Exception as e:
+        error_log(f"Error streaming chat response: {str(e)}")
+        yield {
+            "type": "error",
+            "success": False,
+            "message": "I'm sorry, I encountered an error while processing your question. Please try again.",
+            "error": str(e)
+        }
+
 def main():
     """Main function for chat response generation."""
     if len(sys.argv) < 3:
         print(json.dumps({
             "success": False,
-            "message": "Missing arguments. Usage: python chat_response.py '<context_file>' '<user_message>'"
+            "message": "Missing arguments. Usage: python chat_response.py '<context_file>' '<user_message>' [--stream]"
         }))
         sys.exit(1)
 
     context_file = sys.argv[1]
     user_message = sys.argv[2]
+    stream = '--stream' in sys.argv[3:]
+    startup.ready()
 
     try:
         # Read context from file
         with open(context_file, 'r', encoding='utf-8') as f:
             context = f.read().strip()
 
-        error_log(f"Read context from file: {context[:200]}...")
+        logger.debug(f"Read context from file: {context[:200]}...")
     except Exception as e:
         error_log(f"Failed to read context file: {str(e)}")
         print(json.dumps({
@@ -196,6 +335,12 @@ def main():
         }))
         sys.exit(1)
 
+    if stream:
+        # One JSON object per line, flushed as soon as each chunk arrives
+        for event in generate_chat_response_stream(context, user_message):
+            print(json.dumps(event, ensure_ascii=False), flush=True)
+        return
+
     # Generate response
     result = generate_chat_response(context, user_message)
 
@@ -0,0 +1,227 @@
+"""
+Local BM25 index over note text, used to give chat only the relevant parts
+of a document.
+
+Notes are split into chunks at extraction time and stored in content_chunks
+with their term frequencies. Each chat turn scores the chunks against the
+question and sends the best ones to the model instead of the first 4000
+characters of the document.
+"""
+
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import db
+
+CHUNK_CHARS = int(os.getenv('CHUNK_CHARS', '1000'))
+CHAT_TOP_K = int(os.getenv('CHAT_TOP_K', '4'))
+CHAT_CONTEXT_CHARS = int(os.getenv('CHAT_CONTEXT_CHARS', '4000'))
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i in is it its
+me my of on or so that the their them there these they this to was we were what
+when where which who why will with you your about into than then also not no
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def _split_long(paragraph, limit):
+    """Split a paragraph longer than limit at sentence, then word boundaries."""
+    pieces = []
+    current = ""
+    for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+        while len(sentence) > limit:
+            cut = sentence.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + len(sentence) + 1 > limit:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_text(text, page_number=None, limit=None):
+    """Split text into chunks of roughly limit characters on paragraph boundaries.
+
+    Returns [(page_number, chunk_text), ...].
+    """
+    limit = limit or CHUNK_CHARS
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n|\n(?=\s*[•\-*\d])", text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        for piece in _split_long(paragraph, limit) if len(paragraph) > limit else [paragraph]:
+            if current and len(current) + len(piece) + 1 > limit:
+                chunks.append((page_number, current))
+                current = piece
+            else:
+                current = f"{current}\n{piece}" if current else piece
+    if current:
+        chunks.append((page_number, current))
+    return chunks
+
+
+def build_chunks(text=None, pages=None):
+    """Chunk a document, per page when page texts are available."""
+    if pages:
+        chunks = []
+        for number, page_text in pages:
+            chunks.extend(chunk_text(page_text, number))
+        return chunks
+    return chunk_text(text or "")
+
+
+def index_notes(documents):
+    """Replace the chunk index for several notes.
+
+    documents is an iterable of (note_id, text, pages) where pages may be None.
+    """
+    note_ids = []
+    rows = []
+    for note_id, text, pages in documents:
+        note_ids.append(note_id)
+        for chunk_number, (page_number, chunk) in enumerate(build_chunks(text, pages)):
+            terms = Counter(tokenize(chunk))
+            rows.append((note_id, chunk_number, page_number, chunk,
+                         json.dumps(terms), sum(terms.values())))
+
+    if not note_ids:
+        return 0
+
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ', '.join(['%s'] * len(note_ids))
+        cursor.execute(f"DELETE FROM content_chunks WHERE note_id IN ({placeholders})", note_ids)
+        if rows:
+            cursor.executemany(
+                """
+                INSERT INTO content_chunks (note_id, chunk_index, page_number, chunk_text, term_freqs, term_count)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                """,
+                rows
+            )
+        conn.commit()
+        cursor.close()
+    return len(rows)
+
+
+def index_note(note_id, text=None, pages=None):
+    """Replace the chunk index for one note."""
+    return index_notes([(note_id, text, pages)])
+
+
+def bm25_scores(query_terms, documents):
+    """Score documents ({key: (term_freqs, term_count)}) against query terms."""
+    n = len(documents)
+    if not n or not query_terms:
+        return {}
+
+    avg_length = sum(length for _, length in documents.values()) / n or 1
+    df = Counter(term for freqs, _ in documents.values() for term in set(query_terms) if term in freqs)
+
+    scores = {}
+    for key, (freqs, length) in documents.items():
+        score = 0.0
+        for term in query_terms:
+            tf = freqs.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+        if score > 0:
+            scores[key] = score
+    return scores
+
+
+def _select(scores, lengths, k, max_chars):
+    """Pick the best-scoring chunks within the character budget, in document order."""
+    chosen = []
+    used = 0
+    for key in sorted(scores, key=scores.get, reverse=True)[:k]:
+        if chosen and used + lengths[key] > max_chars:
+            break
+        chosen.append(key)
+        used += lengths[key]
+    return sorted(chosen)
+
+
+def search(note_id, query, k=None, max_chars=None):
+    """Return the most relevant chunks of an indexed note as [(page_number, text), ...].
+
+    Returns None when the note has no chunk index, and [] when nothing matches.
+    """
+    k = k or CHAT_TOP_K
+    max_chars = max_chars or CHAT_CONTEXT_CHARS
+
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT chunk_index, term_freqs, term_count, CHAR_LENGTH(chunk_text) "
+            "FROM content_chunks WHERE note_id = %s",
+            (note_id,)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            cursor.close()
+            return None
+
+        documents = {chunk: (json.loads(freqs), count) for chunk, freqs, count, _ in rows}
+        lengths = {chunk: chars for chunk, _, _, chars in rows}
+        chosen = _select(bm25_scores(tokenize(query), documents), lengths, k, max_chars)
+        if not chosen:
+            cursor.close()
+            return []
+
+        placeholders = ', '.join(['%s'] * len(chosen))
+        cursor.execute(
+            f"SELECT page_number, chunk_text FROM content_chunks "
+            f"WHERE note_id = %s AND chunk_index IN ({placeholders}) ORDER BY chunk_index",
+            [note_id] + chosen
+        )
+        hits = cursor.fetchall()
+        cursor.close()
+    return hits
+
+
+def search_text(text, query, k=None, max_chars=None):
+    """Same as search() for a document that is not indexed in the database."""
+    k = k or CHAT_TOP_K
+    max_chars = max_chars or CHAT_CONTEXT_CHARS
+
+    chunks = build_chunks(text)
+    documents = {}
+    for i, (_, chunk) in enumerate(chunks):
+        terms = Counter(tokenize(chunk))
+        documents[i] = (terms, sum(terms.values()))
+    lengths = {i: len(chunk) for i, (_, chunk) in enumerate(chunks)}
+    return [chunks[i] for i in _select(bm25_scores(tokenize(query), documents), lengths, k, max_chars)]
+
+
+def format_hits(hits):
+    """Render retrieved chunks for a prompt."""
+    return "\n\n".join(
+        f"[Page {page}] {text}" if page else text
+        for page, text in hits
+    )
@@ -1,78 +1,94 @@
-import mysql.connector
 import os
 import sys
 import json
-from datetime import datetime
-from PyPDF2 import PdfReader
-from dotenv import load_dotenv
+import startup
 
-def get_log_timestamp():
-    """Get current timestamp for logging."""
-    return datetime.now().strftime('%d-%b-%Y %H:%M:%S %Z')
+if __name__ == "__main__":
+    startup.begin("content_extractor")
+    # Hand the request to the long-lived worker when one is running
+    import worker_client
+    worker_client.forward_cli("content_extractor", sys.argv[1:])
 
-def activity_log(*args, **kwargs):
-    """Log activity messages to activity.log."""
-    try:
-        timestamp = get_log_timestamp()
-        with open('LOGS/activity.log', 'a', encoding='utf-8') as f:
-            print(f"[{timestamp}]", *args, file=f, **kwargs)
-        print("[CONTENT_EXTRACTOR]", *args, file=sys.stderr, **kwargs)
-    except Exception:
-        print("[CONTENT_EXTRACTOR]", *args, file=sys.stderr, **kwargs)
-
-def error_log(*args, **kwargs):
-    """Log error messages to stderr."""
-    timestamp = get_log_timestamp()
-    print(f"[{timestamp}] [CONTENT_ERROR]", *args, file=sys.stderr, **kwargs)
+from dotenv import load_dotenv
+import app_log
+import chunk_index
+import content_index
+import db
+import extract_limits
+import metrics
+import pdf_text
+import text_store
+from db import get_db_connection
+
+logger = app_log.get_logger('CONTENT')
+activity_log = logger.info
+error_log = logger.error
 
 # Load environment variables
 load_dotenv()
 
-# Database configuration from environment variables
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_USER = os.getenv("DB_USER", "root")
-DB_PASSWORD = os.getenv("DB_PASS", "")
-DB_NAME = os.getenv("DB_NAME", "ai_study_helper")
-
-activity_log("Content extractor database configuration loaded")
-
-def get_db_connection():
-    """Create and return a database connection."""
-    return mysql.connector.connect(
-        host=DB_HOST,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME
-    )
-
-def extract_text_from_pdf(pdf_path):
-    """Extract all text from a PDF."""
+# Parallel batch extraction settings
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or os.cpu_count() or 1
+EXTRACT_FLUSH_SIZE = int(os.getenv("EXTRACT_FLUSH_SIZE", "50"))
+
+def extract_text_from_pdf(pdf_path, note_id=None):
+    """Extract all text from a PDF, through the note's page cache when note_id is given."""
     activity_log(f"Extracting text from PDF: {pdf_path}")
     try:
-        with open(pdf_path, "rb") as file:
-            reader = PdfReader(file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() or ""
-            activity_log(f"Extracted {len(text)} characters from PDF")
-            return text.strip()
+        if note_id is not None:
+            text = pdf_text.extract_note_text(note_id, pdf_path)
+        else:
+            text = pdf_text.extract_text_from_pdf(pdf_path)
+        activity_log(f"Extracted {len(text)} characters from PDF")
+        return text
     except Exception as e:
         error_log(f"Error extracting text from PDF: {str(e)}")
         raise
 
+def ocr_image_pages(full_path, pages):
+    """Fill the image-only pages of a scanned PDF with OCR text.
+
+    Only pages where the parser found (almost) no text and that draw an image
+    are OCRed. Returns the pages list with those pages replaced.
+    """
+    import pdf_ocr
+    if not pdf_ocr.OCR_ENABLED:
+        return pages
+    try:
+        numbers = pdf_ocr.find_image_pages(full_path, pages)
+        if not numbers:
+            return pages
+        activity_log(f"Running OCR on {len(numbers)} image-only pages of {os.path.basename(full_path)}")
+        recognized = pdf_ocr.ocr_pages(full_path, numbers)
+        return [(number, recognized.get(number, text)) for number, text in pages]
+    except Exception as e:
+        error_log(f"OCR failed: {str(e)}")
+        return pages
+
+def extract_note_pages(note_id, full_path):
+    """Pages of a note's PDF through its page cache, OCRing them when the parser found no text.
+
+    For the on-demand paths, which run it under the limits with extract_limits.run().
+    """
+    pages = pdf_text.get_note_pages(note_id, full_path)
+    if not pdf_text.join_pages(pages):
+        # Scanned PDF: OCR its image-only pages and cache them for the next run
+        pages = ocr_image_pages(full_path, pages)
+        pdf_text.store_pages(note_id, pages)
+    return pages
+
+def empty_text_message(full_path):
+    """Failure message for a PDF that gave no text, saying why OCR did not help."""
+    import pdf_ocr
+    if pdf_ocr.OCR_ENABLED and not pdf_ocr.available():
+        return "Extracted text is empty (scanned PDF; OCR needs pypdfium2 and tesseract installed)"
+    return "Extracted text is empty"
+
 def get_note_content(note_id):
-    """Get note file path from database."""
+    """Get note file path and its content index entry from database."""
     try:
         activity_log(f"Fetching note {note_id} for content extraction")
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        query = "SELECT id, user_id, content, file_type FROM notes WHERE id = %s"
-        cursor.execute(query, (note_id,))
-        note = cursor.fetchone()
-
-        cursor.close()
-        conn.close()
+        note = db.fetch_note_bundle(note_id, include_extracted=False)
 
         if not note:
             activity_log(f"Note {note_id} not found")
@@ -84,27 +100,23 @@ def get_note_content(note_id):
         error_log(f"Database error in get_note_content: {str(e)}")
         return None
 
-def store_extracted_content(note_id, user_id, extracted_text, status='completed', error_msg=None):
-    """Store extracted content in the database."""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+def store_extracted_content(note_id, user_id, extracted_text, status='completed', error_msg=None, content_hash=None, pages=None, blob=None):
+    """Store extracted content in the database, indexing it under content_hash.
 
-        query = """
-        INSERT INTO extracted_content (note_id, user_id, extracted_text, extraction_status, error_message, extracted_at)
-        VALUES (%s, %s, %s, %s, %s, NOW())
-        ON DUPLICATE KEY UPDATE
-        extracted_text = VALUES(extracted_text),
-        extraction_status = VALUES(extraction_status),
-        error_message = VALUES(error_message),
-        extracted_at = NOW()
-        """
-
-        cursor.execute(query, (note_id, user_id, extracted_text, status, error_msg))
-        conn.commit()
-
-        cursor.close()
-        conn.close()
+    pages ([(page_number, text), ...]) adds the page offsets used for page range
+    reads; blob is the already compressed text when it comes from the content index.
+    """
+    try:
+        db.store_extractions([{
+            "note_id": note_id,
+            "user_id": user_id,
+            "text": extracted_text,
+            "pages": pages,
+            "blob": blob,
+            "status": status,
+            "error": error_msg,
+            "content_hash": content_hash
+        }])
 
         activity_log(f"Stored extracted content for note {note_id}, status: {status}")
         return True
@@ -114,12 +126,12 @@ def store_extracted_content(note_id, user_id, extracted_text, status='completed'
         return False
 
 def get_extracted_content(note_id):
-    """Get stored extracted content for a note."""
+    """Get the extraction record of a note (without its text), or None."""
     try:
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
 
-        query = "SELECT * FROM extracted_content WHERE note_id = %s AND extraction_status = 'completed'"
+        query = "SELECT note_id, extracted_at FROM extracted_content WHERE note_id = %s AND extraction_status = 'completed'"
         cursor.execute(query, (note_id,))
         result = cursor.fetchone()
 
@@ -132,6 +144,53 @@ def get_extracted_content(note_id):
         error_log(f"Error getting extracted content: {str(e)}")
         return None
 
+def read_extracted_text(note_id, start=0, end=None, pages=None):
+    """Yield a note's stored text in pieces: characters start..end, or pages (first, last).
+
+    Only the compressed blocks that overlap the range are read from the
+    database. Yields nothing when the note has no stored text.
+    """
+    with db.connection() as conn:
+        stored = text_store.open_note_text(conn, note_id)
+        if stored is None:
+            return
+        if pages:
+            span = stored.page_range(*pages)
+            if span is None:
+                # Stored without a page index (legacy row or reused extraction): use the page cache
+                cached = pdf_text.get_cached_pages(note_id, range(pages[0], pages[1] + 1))
+                yield "".join(text for _, text in sorted(cached.items()))
+                return
+            start, end = span
+        yield from stored.iter_range(start, end)
+
+def resolve_pdf_path(pdf_path):
+    """Resolve a stored /uploads/ path against the project directory."""
+    if os.path.isabs(pdf_path) and os.path.exists(pdf_path):
+        return pdf_path
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, pdf_path.lstrip('/'))
+
+def index_chunks(documents):
+    """Build the chat retrieval index for extracted notes ([(note_id, text, pages), ...])."""
+    try:
+        with metrics.span('index_chunks'):
+            count = chunk_index.index_notes(documents)
+        activity_log(f"Indexed {count} chunks for retrieval")
+    except Exception as e:
+        error_log(f"Error indexing chunks: {str(e)}")
+
+def get_indexed_text(content_hash):
+    """Get previously extracted text for identical file bytes, if any."""
+    try:
+        with db.connection() as conn:
+            entry = content_index.get_entry(conn, content_hash)
+        return entry['extracted_text'] if entry and entry['extracted_text'] else None
+    except Exception as e:
+        error_log(f"Error reading content index: {str(e)}")
+        return None
+
+@metrics.timed_request('extract')
 def extract_and_store_content(note_id):
     """Extract content from a note's PDF and store it."""
     try:
@@ -144,12 +203,7 @@ def extract_and_store_content(note_id):
             return {"success": False, "message": "Note is not a PDF document"}
 
         # Get PDF file path
-        pdf_path = note['content']
-        if not os.path.isabs(pdf_path):
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            full_path = os.path.join(script_dir, pdf_path.lstrip('/'))
-        else:
-            full_path = pdf_path
+        full_path = resolve_pdf_path(note['content'])
 
         activity_log(f"Processing PDF: {full_path}")
 
@@ -158,16 +212,39 @@ def extract_and_store_content(note_id):
             store_extracted_content(note_id, note['user_id'], '', 'failed', error_msg)
             return {"success": False, "message": error_msg}
 
-        # Extract text
+        # Extract text, reusing a previous extraction of the same bytes
         try:
-            extracted_text = extract_text_from_pdf(full_path)
+            blob = None
+            if note['content_hash']:
+                content_hash = note['content_hash']
+                extracted_text = note['index']['extracted_text'] if note['index'] else None
+                blob = note['index']['extracted_blob'] if note['index'] else None
+            else:
+                with metrics.span('hash'):
+                    content_hash = content_index.hash_file(full_path)
+                extracted_text = get_indexed_text(content_hash)
+
+            pages = None
+            if extracted_text:
+                activity_log(f"Reusing indexed extraction for note {note_id} (hash {content_hash[:12]})")
+            else:
+                activity_log(f"Extracting text from PDF: {full_path}")
+                # Parsed in a child process under the per-document limits (extract_limits.py)
+                row = extract_limits.run(parse_pdf_note, note_id, note['user_id'], full_path, content_hash)
+                if row['status'] != 'completed':
+                    store_extracted_content(note_id, note['user_id'], '', 'failed', row['error'])
+                    return {"success": False, "message": row['error']}
+                pages, extracted_text = row['pages'], row['text']
+                activity_log(f"Extracted {len(extracted_text)} characters from PDF")
+
             if not extracted_text.strip():
-                error_msg = "Extracted text is empty"
+                error_msg = empty_text_message(full_path)
                 store_extracted_content(note_id, note['user_id'], '', 'failed', error_msg)
                 return {"success": False, "message": error_msg}
 
             # Store the extracted content
-            if store_extracted_content(note_id, note['user_id'], extracted_text):
+            if store_extracted_content(note_id, note['user_id'], extracted_text, content_hash=content_hash, pages=pages, blob=blob):
+                index_chunks([(note_id, extracted_text, pages)])
                 return {
                     "success": True,
                     "message": "Content extracted and stored successfully",
@@ -194,11 +271,11 @@ def get_all_pdf_notes():
         cursor = conn.cursor(dictionary=True)
 
         query = """
-        SELECT n.id, n.user_id, n.content, n.file_type
+        SELECT n.id, n.user_id, n.content, n.file_type, n.content_hash
         FROM notes n
         LEFT JOIN extracted_content ec ON n.id = ec.note_id
         WHERE n.file_type = 'PDF Document'
-        AND (ec.note_id IS NULL OR ec.extraction_status != 'completed')
+        AND (ec.note_id IS NULL OR ec.extraction_status NOT IN ('completed', 'processing'))
         """
 
         cursor.execute(query)
@@ -214,6 +291,132 @@ def get_all_pdf_notes():
         error_log(f"Error getting PDF notes: {str(e)}")
         return []
 
+def parse_pdf_note(note_id, user_id, full_path, content_hash=None):
+    """Parse one PDF in a pool worker. Does no database work."""
+    try:
+        if not os.path.exists(full_path):
+            return {"note_id": note_id, "user_id": user_id, "content_hash": content_hash,
+                    "text": '', "status": 'failed', "error": f"PDF file not found: {full_path}"}
+
+        content_hash = content_hash or content_index.hash_file(full_path)
+        pages = ocr_image_pages(full_path, pdf_text.extract_pages(full_path))
+        text = pdf_text.join_pages(pages)
+        if not text:
+            return {"note_id": note_id, "user_id": user_id, "content_hash": content_hash,
+                    "text": '', "status": 'failed', "error": empty_text_message(full_path)}
+
+        return {"note_id": note_id, "user_id": user_id, "content_hash": content_hash,
+                "text": text, "pages": pages, "status": 'completed', "error": None}
+
+    except MemoryError:
+        # Reported by extract_limits as the memory limit
+        raise
+    except Exception as e:
+        # May be transient (a file still being written, a flaky mount); retry=True
+        # lets the ingestion service try again
+        return {"note_id": note_id, "user_id": user_id, "content_hash": content_hash,
+                "text": '', "status": 'failed', "error": f"Error during text extraction: {str(e)}",
+                "retry": True}
+
+def failed_extraction(note, error, retry=False):
+    """Failed result row for a note whose parse was stopped (extract_limits.py) or crashed."""
+    error_log(f"Extraction of note {note['id']} stopped: {str(error)}")
+    return {"note_id": note['id'], "user_id": note['user_id'], "content_hash": note.get('content_hash'),
+            "text": '', "status": 'failed', "error": str(error), "retry": retry}
+
+def store_extracted_batch(rows):
+    """Upsert many extraction results with multi-row statements."""
+    if not rows:
+        return True
+    try:
+        db.store_extractions(rows)
+        index_chunks([(r['note_id'], r['text'], r.get('pages')) for r in rows if r['status'] == 'completed'])
+        activity_log(f"Stored batch of {len(rows)} extraction results")
+        return True
+
+    except Exception as e:
+        error_log(f"Error storing extraction batch: {str(e)}")
+        return False
+
+def get_indexed_texts(content_hashes):
+    """Get already extracted text for many content hashes in one query."""
+    content_hashes = [h for h in set(content_hashes) if h]
+    if not content_hashes:
+        return {}
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        placeholders = ', '.join(['%s'] * len(content_hashes))
+        cursor.execute(
+            f"SELECT content_hash, extracted_blob, extracted_text FROM content_index "
+            f"WHERE content_hash IN ({placeholders}) AND (extracted_blob IS NOT NULL OR extracted_text IS NOT NULL)",
+            content_hashes
+        )
+        found = {content_hash: text_store.decode(blob, text) for content_hash, blob, text in cursor.fetchall()}
+        cursor.close()
+        conn.close()
+        return found
+    except Exception as e:
+        error_log(f"Error reading content index: {str(e)}")
+        return {}
+
+def run_parallel_batch(notes, workers=None, flush_size=None, on_result=None):
+    """Extract many PDF notes across a process pool.
+
+    Results are passed to on_result as each note finishes and are written back
+    to the database in multi-row batches of flush_size.
+    """
+    workers = workers or EXTRACT_WORKERS
+    flush_size = flush_size or EXTRACT_FLUSH_SIZE
+    results = []
+    pending_rows = []
+
+    def finish(row):
+        pending_rows.append(row)
+        summary = {
+            "note_id": row['note_id'],
+            "success": row['status'] == 'completed',
+            "message": row['error'] or "Content extracted and stored successfully"
+        }
+        results.append(summary)
+        if on_result:
+            on_result(summary)
+        if len(pending_rows) >= flush_size:
+            store_extracted_batch(pending_rows)
+            pending_rows.clear()
+
+    # Notes whose bytes were extracted before need no parsing at all
+    known = get_indexed_texts(note.get('content_hash') for note in notes)
+    to_parse = []
+    for note in notes:
+        text = known.get(note.get('content_hash'))
+        if text:
+            finish({"note_id": note['id'], "user_id": note['user_id'], "content_hash": note['content_hash'],
+                    "text": text, "status": 'completed', "error": None})
+        else:
+            to_parse.append(note)
+
+    activity_log(f"Parallel batch: {len(to_parse)} to parse with {workers} workers, {len(notes) - len(to_parse)} reused")
+
+    if to_parse:
+        from concurrent.futures import as_completed
+        # Each PDF gets its own process and limits, so one bad file only fails itself
+        with extract_limits.IsolatedExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(parse_pdf_note, note['id'], note['user_id'],
+                            resolve_pdf_path(note['content']), note.get('content_hash')): note
+                for note in to_parse
+            }
+            for future in as_completed(futures):
+                try:
+                    row = future.result()
+                except Exception as e:
+                    row = failed_extraction(futures[future], e)
+                finish(row)
+
+    store_extracted_batch(pending_rows)
+    return results
+
 def main():
     """Main function for content extraction."""
     import io
@@ -224,9 +427,11 @@ def main():
     if sys.stderr.encoding != 'utf-8':
         sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
 
+    startup.ready()
+
     try:
         if len(sys.argv) < 2:
-            print(json.dumps({"success": False, "message": "Usage: py content_extractor.py <mode> [note_id]"}))
+            print(json.dumps({"success": False, "message": "Usage: py content_extractor.py <mode> [note_id] [--workers N] [--stream] [--start N] [--end N] [--pages A-B]"}))
             sys.exit(1)
 
         mode = sys.argv[1].lower()
@@ -238,18 +443,18 @@ def main():
             result = extract_and_store_content(note_id)
 
         elif mode == "batch":
-            # Extract content for all unprocessed PDFs
-            notes = get_all_pdf_notes()
-            results = []
+            # Extract content for all unprocessed PDFs across a process pool
+            # Options: --workers N (default EXTRACT_WORKERS), --stream (one JSON line per note)
+            options = sys.argv[2:]
+            workers = int(options[options.index('--workers') + 1]) if '--workers' in options else None
+            stream = '--stream' in options
+
+            def emit(note_result):
+                if stream:
+                    print(json.dumps(note_result, ensure_ascii=False), flush=True)
 
-            for note in notes:
-                activity_log(f"Processing note {note['id']}")
-                result = extract_and_store_content(note['id'])
-                results.append({
-                    "note_id": note['id'],
-                    "success": result["success"],
-                    "message": result["message"]
-                })
+            notes = get_all_pdf_notes()
+            results = run_parallel_batch(notes, workers=workers, on_result=emit)
 
             result = {
                 "success": True,
@@ -259,20 +464,38 @@ def main():
 
         elif mode == "get" and len(sys.argv) >= 3:
             # Get stored extracted content for a note
+            # Options: --start N / --end N (character range), --pages A[-B],
+            # --stream (one JSON line per piece of text, then a done line)
             note_id = sys.argv[2]
+            options = sys.argv[3:]
+            start = int(options[options.index('--start') + 1]) if '--start' in options else 0
+            end = int(options[options.index('--end') + 1]) if '--end' in options else None
+            pages = None
+            if '--pages' in options:
+                first, _, last = options[options.index('--pages') + 1].partition('-')
+                pages = (int(first), int(last or first))
+            stream = '--stream' in options
+
             extracted = get_extracted_content(note_id)
 
-            if extracted:
+            if not extracted:
                 result = {
-                    "success": True,
-                    "note_id": note_id,
-                    "extracted_text": extracted['extracted_text'],
-                    "extracted_at": extracted['extracted_at'].strftime('%Y-%m-%d %H:%M:%S') if extracted['extracted_at'] else None
+                    "success": False,
+                    "message": "No extracted content found for this note"
                 }
+            elif stream:
+                length = 0
+                for piece in read_extracted_text(note_id, start, end, pages):
+                    length += len(piece)
+                    print(json.dumps({"type": "text", "content": piece}, ensure_ascii=False), flush=True)
+                result = {"type": "done", "success": True, "note_id": note_id, "text_length": length}
             else:
+                text = "".join(read_extracted_text(note_id, start, end, pages))
                 result = {
-                    "success": False,
-                    "message": "No extracted content found for this note"
+                    "success": True,
+                    "note_id": note_id,
+                    "extracted_text": text,
+                    "extracted_at": extracted['extracted_at'].strftime('%Y-%m-%d %H:%M:%S') if extracted['extracted_at'] else None
                 }
 
         else:
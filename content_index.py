@@ -0,0 +1,48 @@
+"""
+Content-addressed index of extracted text and AI outputs.
+
+Notes with identical bytes (the same PDF uploaded twice, or the same pasted
+text) share one content_index row keyed by SHA-256, so extraction, summaries
+and quizzes are only produced once per distinct document.
+"""
+
+import hashlib
+import json
+import os
+
+import text_store
+
+# Set REUSE_AI_OUTPUTS=0 to always call the model even for known content
+REUSE_AI_OUTPUTS = os.getenv('REUSE_AI_OUTPUTS', '1') != '0'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """Return the SHA-256 hex digest of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_text(text):
+    """Return the SHA-256 hex digest of note text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def get_entry(conn, content_hash):
+    """Get the index row for a content hash, or None."""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT * FROM content_index WHERE content_hash = %s", (content_hash,))
+        entry = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    if entry:
+        entry['extracted_text'] = text_store.decode(entry.get('extracted_blob'), entry['extracted_text'])
+        if isinstance(entry.get('quiz_questions'), (str, bytes)):
+            entry['quiz_questions'] = json.loads(entry['quiz_questions'])
+    return entry
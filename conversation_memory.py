@@ -0,0 +1,189 @@
+"""
+Token-budgeted memory for chat conversations.
+
+Each chat turn gets the conversation's rolling summary plus as many recent
+messages as fit in CHAT_HISTORY_TOKENS. Message token counts are stored in
+chat_messages.token_count the first time a message is loaded. When the
+unsummarized messages go over the budget, the oldest ones are folded into
+the conversation's summary (conversation_memory table) until what is left
+fits in CHAT_HISTORY_KEEP_TOKENS. The last exchange is always kept verbatim,
+even when a long reply alone is over the budget, so a follow-up question can
+refer to it.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+import app_log
+import db
+import llm_router
+
+load_dotenv()
+
+logger = app_log.get_logger('CHAT_MEMORY')
+activity_log = logger.info
+error_log = logger.error
+
+CHAT_HISTORY_TOKENS = int(os.getenv('CHAT_HISTORY_TOKENS', '1500'))     # history budget per turn
+CHAT_HISTORY_KEEP_TOKENS = int(os.getenv('CHAT_HISTORY_KEEP_TOKENS', '750'))  # verbatim history left after compaction
+CHAT_SUMMARY_TOKENS = int(os.getenv('CHAT_SUMMARY_TOKENS', '300'))     # max length of the rolling summary
+CHAT_MEMORY_MODEL = os.getenv('CHAT_MEMORY_MODEL') or os.getenv('MODEL_NAME', 'openai/gpt-3.5-turbo')
+CHAT_MEMORY_PROVIDER = 'openrouter_chat'
+MEMORY_ROUTE = llm_router.route('memory', f"{CHAT_MEMORY_PROVIDER}:{CHAT_MEMORY_MODEL}")  # LLM_MEMORY_ROUTE
+
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# The last user question and assistant reply are kept whatever their size
+MIN_KEPT_MESSAGES = 2
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+except Exception:
+    # tiktoken is optional; fall back to the usual ~4 characters per token
+    _encoding = None
+
+
+def count_tokens(text):
+    """Approximate prompt tokens for a piece of text."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message):
+    """Tokens a message costs in the prompt."""
+    return count_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+
+def fit_to_budget(messages, budget=None):
+    """Keep the newest messages whose tokens fit in budget, and at least the last exchange."""
+    budget = CHAT_HISTORY_TOKENS if budget is None else budget
+    kept = []
+    used = 0
+    for message in reversed(messages):
+        tokens = message.get('token_count') or message_tokens(message)
+        if used + tokens > budget and len(kept) >= MIN_KEPT_MESSAGES:
+            break
+        kept.append(message)
+        used += tokens
+    return kept[::-1]
+
+
+def _load(cursor, conversation_id, through_id):
+    cursor.execute(
+        "SELECT summary_text, summarized_through FROM conversation_memory WHERE conversation_id = %s",
+        (conversation_id,)
+    )
+    memory = cursor.fetchone() or {"summary_text": None, "summarized_through": 0}
+
+    query = """
+        SELECT id, role, content, token_count
+        FROM chat_messages
+        WHERE conversation_id = %s AND id > %s
+    """
+    params = [conversation_id, memory['summarized_through']]
+    if through_id:
+        query += " AND id <= %s"
+        params.append(through_id)
+    cursor.execute(query + " ORDER BY id", params)
+    return memory, cursor.fetchall()
+
+
+def _store_token_counts(cursor, messages):
+    """Count and persist tokens for messages stored before they were counted."""
+    uncounted = [m for m in messages if not m['token_count']]
+    for message in uncounted:
+        message['token_count'] = message_tokens(message)
+    if uncounted:
+        cursor.executemany(
+            "UPDATE chat_messages SET token_count = %s WHERE id = %s",
+            [(m['token_count'], m['id']) for m in uncounted]
+        )
+    return len(uncounted)
+
+
+def summarize_turns(summary, messages):
+    """Fold messages into the running conversation summary."""
+    transcript = "\n".join(f"{m['role'].upper()}: {m['content']}" for m in messages)
+    prompt = (
+        "You maintain a running summary of a study chat between a student and an assistant "
+        "about one document. Update the summary with the new turns below. Keep the questions "
+        "asked, the key facts and explanations given, and anything the student said about "
+        "what they understand or want. Write compact notes, not a transcript.\n\n"
+        f"CURRENT SUMMARY:\n{summary or '(none yet)'}\n\nNEW TURNS:\n{transcript}"
+    )
+    _, summary = llm_router.complete_sync(
+        MEMORY_ROUTE,
+        [{"role": "user", "content": prompt}],
+        max_tokens=CHAT_SUMMARY_TOKENS, temperature=0.2
+    )
+    return summary
+
+
+def compact(conversation_id, memory, messages):
+    """Fold the oldest messages into the summary until the rest fit the keep budget.
+
+    Returns (summary, remaining_messages). On failure the summary is left alone
+    and the oldest messages are just dropped from this turn.
+    """
+    keep = fit_to_budget(messages, CHAT_HISTORY_KEEP_TOKENS)
+    folded = messages[:len(messages) - len(keep)]
+    if not folded:
+        return memory['summary_text'], messages
+
+    try:
+        summary = summarize_turns(memory['summary_text'], folded)
+    except Exception as e:
+        error_log(f"Conversation {conversation_id} compaction failed: {str(e)}")
+        return memory['summary_text'], keep
+
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        # The summarized_through check keeps a concurrent turn's compaction from being overwritten
+        cursor.execute(
+            """
+            INSERT INTO conversation_memory (conversation_id, summary_text, summarized_through, token_count)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+            summary_text = IF(summarized_through = %s, VALUES(summary_text), summary_text),
+            token_count = IF(summarized_through = %s, VALUES(token_count), token_count),
+            summarized_through = IF(summarized_through = %s, VALUES(summarized_through), summarized_through)
+            """,
+            (conversation_id, summary, folded[-1]['id'], count_tokens(summary),
+             memory['summarized_through'], memory['summarized_through'], memory['summarized_through'])
+        )
+        conn.commit()
+        cursor.close()
+
+    activity_log(f"Compacted {len(folded)} messages of conversation {conversation_id} into its summary")
+    return summary, keep
+
+
+def load_history(conversation_id, current_message_id=None):
+    """Memory for one chat turn: {"summary": str or None, "messages": [...]}.
+
+    Messages up to current_message_id are token-counted; the current message
+    itself is left out of the history since it is sent as the question.
+    """
+    with db.connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        memory, messages = _load(cursor, conversation_id, current_message_id)
+        if _store_token_counts(cursor, messages):
+            conn.commit()
+        cursor.close()
+
+    if current_message_id:
+        messages = [m for m in messages if m['id'] != int(current_message_id)]
+
+    summary = memory['summary_text']
+    if sum(m['token_count'] for m in messages) > CHAT_HISTORY_TOKENS:
+        summary, messages = compact(conversation_id, memory, messages)
+
+    return {
+        "summary": summary,
+        "messages": [{"role": m['role'], "content": m['content']} for m in messages]
+    }
@@ -0,0 +1,338 @@
+"""
+Shared MySQL access for the Python modules.
+
+Connections come from one process-wide pool. Callers keep using the
+get_db_connection() / conn.close() pattern; close() hands the connection
+back to the pool instead of tearing down the TCP session. Checkouts,
+queries and fetches are timed as the db_checkout, db_query and db_fetch
+stages (metrics.py).
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+import metrics
+import text_store
+
+load_dotenv()
+
+# Database configuration from environment variables
+DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_USER = os.getenv('DB_USER', 'root')
+DB_PASSWORD = os.getenv('DB_PASS', '')
+DB_NAME = os.getenv('DB_NAME', 'ai_study_helper')
+
+# Pool settings
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))  # seconds before a connection is reopened, 0 = never
+DB_POOL_PING = os.getenv('DB_POOL_PING', '1') != '0'          # check connections on checkout
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))   # seconds to wait for a free connection
+
+_pool = None
+_pool_lock = threading.Lock()
+_opened_at = {}
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Imported on first use; the driver is a large share of a CLI's startup
+            from mysql.connector import pooling
+            _pool = pooling.MySQLConnectionPool(
+                pool_name='study_helper',
+                pool_size=DB_POOL_SIZE,
+                pool_reset_session=True,
+                host=DB_HOST,
+                user=DB_USER,
+                password=DB_PASSWORD,
+                database=DB_NAME
+            )
+    return _pool
+
+
+class TimedCursor:
+    """Cursor wrapper that records query and fetch times."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        with metrics.span('db_query'):
+            return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        with metrics.span('db_query'):
+            return self._cursor.executemany(*args, **kwargs)
+
+    def fetchone(self):
+        with metrics.span('db_fetch'):
+            return self._cursor.fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        with metrics.span('db_fetch'):
+            return self._cursor.fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        with metrics.span('db_fetch'):
+            return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """Pooled connection wrapper whose cursors are timed."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def get_db_connection():
+    """Check out a pooled connection. Call close() to return it."""
+    with metrics.span('db_checkout'):
+        conn = _checkout()
+    return TimedConnection(conn) if metrics.METRICS_ENABLED else conn
+
+
+def _checkout():
+    from mysql.connector import errors
+    deadline = time.monotonic() + DB_POOL_TIMEOUT
+    while True:
+        try:
+            conn = _get_pool().get_connection()
+            break
+        except errors.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+
+    key = id(conn._cnx)
+    now = time.monotonic()
+    opened_at = _opened_at.setdefault(key, now)
+
+    if DB_POOL_RECYCLE and now - opened_at > DB_POOL_RECYCLE:
+        conn.reconnect()
+        _opened_at[key] = now
+    elif DB_POOL_PING:
+        conn.ping(reconnect=True, attempts=2, delay=0)
+
+    return conn
+
+
+@contextmanager
+def connection():
+    """Context manager around get_db_connection()."""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+# ---------- Batched helpers ----------
+
+def fetch_note_bundle(note_id, include_extracted=True):
+    """Get a note with its stored extraction and content index entry in one query.
+
+    The content index columns are returned under note['index'] (None when the
+    note's hash has no entry yet). Stored text is decompressed (text_store.py).
+    """
+    extracted_columns = "ec.extracted_text, ec.extracted_blob" if include_extracted else "NULL AS extracted_text, NULL AS extracted_blob"
+    query = f"""
+    SELECT n.id, n.title, n.content, n.file_type, n.user_id, n.content_hash,
+           {extracted_columns},
+           ci.content_hash AS ci_content_hash,
+           ci.extracted_text AS ci_extracted_text,
+           ci.extracted_blob AS ci_extracted_blob,
+           ci.summary_text AS ci_summary_text,
+           ci.summary_model AS ci_summary_model,
+           ci.quiz_questions AS ci_quiz_questions
+    FROM notes n
+    LEFT JOIN extracted_content ec ON ec.note_id = n.id AND ec.extraction_status = 'completed'
+    LEFT JOIN content_index ci ON ci.content_hash = n.content_hash
+    WHERE n.id = %s
+    """
+
+    with connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(query, (note_id,))
+        row = cursor.fetchone()
+        cursor.close()
+
+    if not row:
+        return None
+
+    index = {key[3:]: row.pop(key) for key in list(row) if key.startswith('ci_')}
+    row['extracted_text'] = text_store.decode(row.pop('extracted_blob'), row['extracted_text'])
+    index['extracted_text'] = text_store.decode(index['extracted_blob'], index['extracted_text'])
+    if isinstance(index['quiz_questions'], (str, bytes)):
+        index['quiz_questions'] = json.loads(index['quiz_questions'])
+    row['index'] = index if index['content_hash'] else None
+    return row
+
+
+def save_summary(note_id, user_id, summary_text, ai_model, content_hash=None):
+    """Upsert a note's summary and its content index entry in one transaction."""
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO summaries (note_id, user_id, summary_text, ai_model)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+            summary_text = VALUES(summary_text),
+            ai_model = VALUES(ai_model),
+            created_at = NOW()
+            """,
+            (note_id, user_id, summary_text, ai_model)
+        )
+        if content_hash:
+            cursor.execute(
+                """
+                INSERT INTO content_index (content_hash, summary_text, summary_model)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                summary_text = VALUES(summary_text),
+                summary_model = VALUES(summary_model)
+                """,
+                (content_hash, summary_text, ai_model)
+            )
+        conn.commit()
+        cursor.close()
+
+
+def save_quiz(note_id, user_id, quiz_questions, note_title=None, content_hash=None):
+    """Upsert a note's quiz and its content index entry in one transaction. Returns the quiz id."""
+    questions_json = json.dumps(quiz_questions)
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO quizzes (note_id, user_id, questions, title)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+            questions = VALUES(questions),
+            title = VALUES(title),
+            created_at = NOW()
+            """,
+            (note_id, user_id, questions_json, note_title)
+        )
+        quiz_id = cursor.lastrowid
+        if content_hash:
+            cursor.execute(
+                """
+                INSERT INTO content_index (content_hash, quiz_questions)
+                VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE quiz_questions = VALUES(quiz_questions)
+                """,
+                (content_hash, questions_json)
+            )
+        conn.commit()
+        cursor.close()
+    return quiz_id
+
+
+def store_extractions(rows):
+    """Upsert extraction results and index their text with multi-row statements.
+
+    Each row is a dict with note_id, user_id, text, status, error and content_hash,
+    and optionally pages ([(page_number, text), ...]) for the page cache. Text
+    is stored compressed in the extracted_blob columns (text_store.py); a row
+    may carry an already encoded blob (reused from the content index).
+    """
+    if not rows:
+        return
+    blobs = [r.get('blob') or (text_store.encode(r['text'], r.get('pages')) if r['text'] else None) for r in rows]
+    with connection() as conn:
+        cursor = conn.cursor()
+
+        # executemany() on a plain INSERT is sent as one multi-row statement
+        cursor.executemany(
+            """
+            INSERT INTO extracted_content (note_id, user_id, extracted_text, extracted_blob, extraction_status, error_message, extracted_at)
+            VALUES (%s, %s, NULL, %s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE
+            extracted_text = NULL,
+            extracted_blob = VALUES(extracted_blob),
+            extraction_status = VALUES(extraction_status),
+            error_message = VALUES(error_message),
+            extracted_at = NOW()
+            """,
+            [(r['note_id'], r['user_id'], blob, r['status'], r['error']) for r, blob in zip(rows, blobs)]
+        )
+
+        pages = [(r['note_id'], number, text) for r in rows for number, text in r.get('pages') or ()]
+        if pages:
+            cursor.executemany(
+                """
+                INSERT INTO extracted_pages (note_id, page_number, page_text)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE page_text = VALUES(page_text)
+                """,
+                pages
+            )
+
+        indexed = {r['content_hash']: blob for r, blob in zip(rows, blobs)
+                   if r['status'] == 'completed' and r.get('content_hash') and blob}
+        if indexed:
+            cursor.executemany(
+                """
+                INSERT INTO content_index (content_hash, extracted_text, extracted_blob)
+                VALUES (%s, NULL, %s)
+                ON DUPLICATE KEY UPDATE
+                extracted_blob = COALESCE(extracted_blob, VALUES(extracted_blob)),
+                extracted_text = NULL
+                """,
+                list(indexed.items())
+            )
+
+        conn.commit()
+        cursor.close()
+
+
+def get_chunk_summaries(chunk_keys):
+    """Get cached section summaries as {chunk_key: summary_text}."""
+    chunk_keys = list(set(chunk_keys))
+    if not chunk_keys:
+        return {}
+    with connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ', '.join(['%s'] * len(chunk_keys))
+        cursor.execute(
+            f"SELECT chunk_key, summary_text FROM summary_chunks WHERE chunk_key IN ({placeholders})",
+            chunk_keys
+        )
+        found = dict(cursor.fetchall())
+        cursor.close()
+    return found
+
+
+def save_chunk_summary(chunk_key, ai_model, summary_text):
+    """Cache the summary of one document section."""
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO summary_chunks (chunk_key, ai_model, summary_text)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE summary_text = VALUES(summary_text)
+            """,
+            (chunk_key, ai_model, summary_text)
+        )
+        conn.commit()
+        cursor.close()
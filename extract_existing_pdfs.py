@@ -2,6 +2,8 @@
 """
 Script to extract content from all existing PDF notes that don't have extracted content yet.
 This should be run once to process legacy PDFs in the system.
+
+Usage: py extract_existing_pdfs.py [workers]
 """
 
 import subprocess
@@ -22,6 +24,8 @@ def main():
     try:
         # Run the content_extractor in batch mode
         cmd = ['py', 'content_extractor.py', 'batch']
+        if len(sys.argv) > 1:
+            cmd += ['--workers', str(int(sys.argv[1]))]
         log_message(f"Running command: {' '.join(cmd)}")
 
         result = subprocess.run(
@@ -0,0 +1,287 @@
+"""
+Per-document resource limits for PDF extraction.
+
+One pathological PDF can keep a parser spinning for minutes or grow to
+gigabytes. IsolatedExecutor parses every document in a child process of its
+own, so a document that breaks a limit is killed and fails on its own while
+the rest of a batch carries on:
+
+    EXTRACT_TIMEOUT        wall-clock seconds per document
+    EXTRACT_PAGE_TIMEOUT   wall-clock seconds until the next page is done
+    EXTRACT_CPU_SECONDS    CPU seconds per document (RLIMIT_CPU)
+    EXTRACT_MAX_MEMORY_MB  memory per document (RLIMIT_AS)
+
+The wall-clock limits are watched by the parent; the page limit relies on
+the progress() calls pdf_text and pdf_ocr make as pages finish. CPU and
+memory are limited with setrlimit() in the child, which needs the resource
+module and so is skipped on Windows. RLIMIT_AS caps address space, which is
+stricter than RSS (Linux does not enforce RLIMIT_RSS). A limit of 0 is off.
+
+Each child leads its own process group, so stopping it also stops what it
+started (the OCR pool and its tesseract runs).
+"""
+
+import os
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+
+import app_log
+import metrics
+
+logger = app_log.get_logger('LIMITS')
+
+EXTRACT_TIMEOUT = float(os.getenv('EXTRACT_TIMEOUT', '600'))
+EXTRACT_PAGE_TIMEOUT = float(os.getenv('EXTRACT_PAGE_TIMEOUT', '60'))
+EXTRACT_CPU_SECONDS = int(os.getenv('EXTRACT_CPU_SECONDS', '600'))
+EXTRACT_MAX_MEMORY_MB = int(os.getenv('EXTRACT_MAX_MEMORY_MB', '2048'))
+
+POLL_INTERVAL = 0.1  # seconds between limit checks
+
+
+class LimitExceeded(Exception):
+    """A document was stopped for breaking one of the limits."""
+
+    def __init__(self, limit, message):
+        super().__init__(message)
+        self.limit = limit
+
+
+# ---------- In the child ----------
+
+_progress = None  # pipe to the parent, set in isolated children
+
+
+def progress(page, allowance=None):
+    """Report a finished page (0 for an opened document, None for no page); the next
+    page gets allowance seconds, EXTRACT_PAGE_TIMEOUT by default.
+
+    Does nothing outside an isolated child, so parsers can call it unconditionally.
+    """
+    if _progress is not None:
+        _progress.send(('page', page, allowance))
+
+
+def _set_rlimits():
+    try:
+        import resource
+    except ImportError:
+        return
+    try:
+        # A CPU limit ends the child with SIGXCPU, which would otherwise dump core
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        if EXTRACT_CPU_SECONDS > 0:
+            resource.setrlimit(resource.RLIMIT_CPU, (EXTRACT_CPU_SECONDS, EXTRACT_CPU_SECONDS + 5))
+        if EXTRACT_MAX_MEMORY_MB > 0:
+            limit = EXTRACT_MAX_MEMORY_MB * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not set extraction limits: {str(e)}")
+
+
+def _run_child(conn, fn, args, kwargs):
+    global _progress
+    _progress = conn
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    _set_rlimits()
+    try:
+        message = ('result', fn(*args, **kwargs))
+    except MemoryError:
+        message = ('memory', None)
+    except BaseException as e:
+        message = ('error', e)
+    try:
+        conn.send(message)
+    except Exception:
+        # The result or exception could not be pickled
+        conn.send(('error', RuntimeError(str(message[1]))))
+    finally:
+        # The child leaves with os._exit(), which skips the log writer's exit flush
+        app_log.flush()
+        conn.close()
+
+
+# ---------- In the parent ----------
+
+def _kill(process):
+    """Kill a child and the processes it started."""
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        except (ProcessLookupError, PermissionError):
+            # Not (yet) a group leader, or the group is gone
+            pass
+    process.kill()
+
+
+class _Task:
+    def __init__(self, future, process, conn):
+        self.future = future
+        self.process = process
+        self.conn = conn
+        self.started = time.monotonic()
+        self.page = None
+        self.allowance = None
+        self.page_deadline = None
+
+
+class IsolatedExecutor(Executor):
+    """Executor running each call in its own child process under the extraction limits.
+
+    Used like ProcessPoolExecutor: at most max_workers calls run at once, and
+    a call that breaks a limit gets LimitExceeded as its exception. A child
+    that dies without a result fails its own call with RuntimeError.
+    """
+
+    def __init__(self, max_workers=None):
+        import multiprocessing
+        # Children come from a fork server rather than a fork of this process,
+        # which may be running threads (the study worker); Windows only spawns
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(method)
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._supervisor = None
+        self._shutdown = False
+        self._stop = False
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            if self._context.get_start_method() == 'forkserver':
+                # The fork server imports the parser once instead of every child
+                # (no effect once the server is running)
+                self._context.set_forkserver_preload([fn.__module__])
+            self._pending.append((future, fn, args, kwargs))
+            if self._supervisor is None:
+                self._supervisor = threading.Thread(target=self._supervise, name='extract-limits', daemon=True)
+                self._supervisor.start()
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        """Stop accepting calls. cancel_futures=True also cancels queued calls and kills running ones."""
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                self._stop = True
+                while self._pending:
+                    self._pending.popleft()[0].cancel()
+            supervisor = self._supervisor
+        if wait and supervisor:
+            supervisor.join()
+
+    def _start(self, fn, args, kwargs):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_run_child, args=(sender, fn, args, kwargs))
+        process.start()
+        sender.close()
+        return process, receiver
+
+    def _supervise(self):
+        from multiprocessing.connection import wait
+
+        running = []
+        while True:
+            with self._lock:
+                if self._stop:
+                    for task in running:
+                        _kill(task.process)
+                        self._finish(task)
+                        self._fail(task, RuntimeError("Extraction stopped"))
+                    running.clear()
+                while self._pending and len(running) < self._max_workers:
+                    future, fn, args, kwargs = self._pending.popleft()
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        running.append(_Task(future, *self._start(fn, args, kwargs)))
+                    except Exception as e:
+                        future.set_exception(e)
+                if not running and not self._pending:
+                    self._supervisor = None
+                    return
+
+            for conn in wait([task.conn for task in running], timeout=POLL_INTERVAL):
+                task = next(task for task in running if task.conn is conn)
+                if self._receive(task):
+                    running.remove(task)
+
+            now = time.monotonic()
+            for task in list(running):
+                error = self._check(task, now)
+                if error:
+                    _kill(task.process)
+                    self._finish(task)
+                    self._fail(task, error)
+                    running.remove(task)
+
+    def _receive(self, task):
+        """Read what the child sent. Returns True when the call is finished."""
+        try:
+            # Drain every waiting page report so a slow supervisor does not misjudge the child
+            while task.conn.poll():
+                kind, value, *extra = task.conn.recv()
+                if kind == 'page':
+                    task.page = task.page if value is None else value
+                    task.allowance = extra[0] or EXTRACT_PAGE_TIMEOUT
+                    task.page_deadline = time.monotonic() + task.allowance if EXTRACT_PAGE_TIMEOUT > 0 else None
+                    continue
+                self._finish(task)
+                if kind == 'result':
+                    task.future.set_result(value)
+                elif kind == 'memory':
+                    self._fail(task, LimitExceeded('memory', f"Extraction exceeded the {EXTRACT_MAX_MEMORY_MB} MB memory limit"))
+                else:
+                    self._fail(task, value)
+                return True
+            return False
+        except (EOFError, OSError):
+            # The child died without a result
+            self._finish(task)
+            code = task.process.exitcode
+            if code is not None and code == -getattr(signal, 'SIGXCPU', 0):
+                self._fail(task, LimitExceeded('cpu', f"Extraction exceeded the {EXTRACT_CPU_SECONDS} s CPU limit"))
+            else:
+                self._fail(task, RuntimeError(f"Extraction process exited with code {code}"))
+            return True
+
+    def _check(self, task, now):
+        """The limit a running task has broken, or None."""
+        if EXTRACT_TIMEOUT > 0 and now - task.started > EXTRACT_TIMEOUT:
+            return LimitExceeded('time', f"Extraction took longer than {EXTRACT_TIMEOUT:g} s")
+        if task.page_deadline is not None and now > task.page_deadline:
+            after = f"page {task.page}" if task.page else "opening the document"
+            return LimitExceeded('page_time', f"Extraction stalled for {task.allowance:g} s after {after}")
+        return None
+
+    def _finish(self, task, timeout=5):
+        task.conn.close()
+        task.process.join(timeout)
+        if task.process.is_alive():
+            _kill(task.process)
+            task.process.join()
+        elif hasattr(os, 'killpg'):
+            # A child that crashed or hit a limit may leave OCR workers behind
+            try:
+                os.killpg(task.process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def _fail(self, task, error):
+        if isinstance(error, LimitExceeded):
+            logger.warning(str(error), limit=error.limit)
+            metrics.count('extract_limits_total', limit=error.limit)
+        task.future.set_exception(error)
+
+
+def run(fn, *args, **kwargs):
+    """Run one call in an isolated child under the limits and return its result."""
+    with IsolatedExecutor(max_workers=1) as pool:
+        return pool.submit(fn, *args, **kwargs).result()
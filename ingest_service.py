@@ -0,0 +1,316 @@
+"""
+Background ingestion of uploaded PDFs.
+
+saveNote.php only stores the file, inserts the note and a 'pending'
+extracted_content row, and returns. This service (py ingest_service.py work)
+claims pending rows, parses up to INGEST_WORKERS PDFs at once and writes the
+text back, moving each row from pending to processing to completed or failed
+so the UI can poll BACKEND/extractionStatus.php. Extraction throughput is set
+here, independently of web traffic. Every PDF is parsed in its own process
+under the time and memory limits of extract_limits.py; a note that breaks
+one fails with the reason while the rest go on. A parse error or a crashed
+parser may be transient, so that note goes back to pending until it has
+been tried INGEST_MAX_ATTEMPTS times.
+
+A periodic sweep queues PDF notes that have no extracted_content row yet
+(uploaded before this service, or whose pending row could not be written)
+and requeues rows left 'processing' by a service that died. A note is
+claimed at most INGEST_MAX_ATTEMPTS times.
+
+Usage:
+    py ingest_service.py work [--workers N]
+    py ingest_service.py status <note_id>
+"""
+
+import argparse
+import json
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from dotenv import load_dotenv
+
+import app_log
+import content_extractor
+import db
+import extract_limits
+import metrics
+
+logger = app_log.get_logger('INGEST')
+activity_log = logger.info
+error_log = logger.error
+
+load_dotenv()
+
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '2'))                 # PDFs parsed at once
+INGEST_MAX_ATTEMPTS = int(os.getenv('INGEST_MAX_ATTEMPTS', '3'))
+INGEST_POLL_INTERVAL = float(os.getenv('INGEST_POLL_INTERVAL', '1'))
+INGEST_SWEEP_INTERVAL = int(os.getenv('INGEST_SWEEP_INTERVAL', '60'))
+INGEST_STALE_SECONDS = int(os.getenv('INGEST_STALE_SECONDS', '1800'))  # processing longer than this = service died
+
+
+def enqueue_missing():
+    """Queue PDF notes that have no extracted_content row. Returns how many were queued."""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT IGNORE INTO extracted_content (note_id, user_id, extraction_status)
+            SELECT n.id, n.user_id, 'pending'
+            FROM notes n
+            LEFT JOIN extracted_content ec ON ec.note_id = n.id
+            WHERE n.file_type = 'PDF Document' AND ec.note_id IS NULL
+            """
+        )
+        count = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return count
+
+
+def claim_notes(worker_id, limit):
+    """Atomically take up to limit pending notes. Returns note rows (id, user_id, content, content_hash)."""
+    with db.connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            conn.start_transaction()
+            # SKIP LOCKED lets several services claim different notes without waiting
+            cursor.execute(
+                """
+                SELECT n.id, n.user_id, n.content, n.content_hash
+                FROM extracted_content ec
+                JOIN notes n ON n.id = ec.note_id
+                WHERE ec.extraction_status = 'pending'
+                ORDER BY ec.id
+                LIMIT %s
+                FOR UPDATE OF ec SKIP LOCKED
+                """,
+                (limit,)
+            )
+            notes = cursor.fetchall()
+            if notes:
+                placeholders = ', '.join(['%s'] * len(notes))
+                cursor.execute(
+                    f"""
+                    UPDATE extracted_content
+                    SET extraction_status = 'processing', attempts = attempts + 1,
+                        started_at = NOW(), worker_id = %s, error_message = NULL
+                    WHERE note_id IN ({placeholders})
+                    """,
+                    [worker_id] + [note['id'] for note in notes]
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    return notes
+
+
+def release_notes(note_ids, message):
+    """Return claimed notes to the queue, or fail those out of attempts."""
+    if not note_ids:
+        return
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ', '.join(['%s'] * len(note_ids))
+        cursor.execute(
+            f"""
+            UPDATE extracted_content
+            SET extraction_status = IF(attempts < %s, 'pending', 'failed'), error_message = %s
+            WHERE note_id IN ({placeholders}) AND extraction_status = 'processing'
+            """,
+            [INGEST_MAX_ATTEMPTS, message] + list(note_ids)
+        )
+        conn.commit()
+        cursor.close()
+
+
+def requeue_stale_notes(running_ids=()):
+    """Return notes stuck in 'processing' (their service died) to the queue, except running_ids."""
+    running_ids = list(running_ids) or [0]
+    placeholders = ', '.join(['%s'] * len(running_ids))
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            UPDATE extracted_content
+            SET extraction_status = IF(attempts < %s, 'pending', 'failed'),
+                error_message = 'Ingestion stopped before finishing the note'
+            WHERE extraction_status = 'processing'
+            AND started_at < NOW() - INTERVAL %s SECOND
+            AND note_id NOT IN ({placeholders})
+            """,
+            [INGEST_MAX_ATTEMPTS, INGEST_STALE_SECONDS] + running_ids
+        )
+        count = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return count
+
+
+def get_status(note_id):
+    """Get a note's extraction status row, or None."""
+    with db.connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            """
+            SELECT note_id, extraction_status, error_message, attempts, started_at, extracted_at
+            FROM extracted_content WHERE note_id = %s
+            """,
+            (note_id,)
+        )
+        status = cursor.fetchone()
+        cursor.close()
+    return status
+
+
+def sweep(running_ids):
+    """Queue notes missing a row and requeue stale ones other than running_ids."""
+    try:
+        queued = enqueue_missing()
+        if queued:
+            activity_log(f"Queued {queued} PDF notes without extraction")
+        stale = requeue_stale_notes(running_ids)
+        if stale:
+            activity_log(f"Requeued {stale} stale notes")
+    except Exception as e:
+        error_log(f"Error sweeping extraction queue: {str(e)}")
+
+
+def retry_notes(rows, started):
+    """Requeue notes whose extraction failed in a way that may not happen again."""
+    for row in rows:
+        metrics.observe('request_seconds', time.monotonic() - started.pop(row['note_id']), operation='ingest')
+        metrics.count('requests_total', operation='ingest', success='false')
+        with app_log.request_context(f"ingest-{row['note_id']}"):
+            error_log(f"Ingestion of note {row['note_id']} failed, retrying while attempts remain: {row['error']}")
+        try:
+            release_notes([row['note_id']], row['error'])
+        except Exception as e:
+            # Left 'processing'; the stale sweep requeues it
+            error_log(f"Error releasing note {row['note_id']}: {str(e)}")
+
+
+def store_results(rows, started):
+    """Write finished notes back and record their metrics; transient failures are requeued."""
+    retry_notes([row for row in rows if row.get('retry')], started)
+    rows = [row for row in rows if not row.get('retry')]
+    if not rows:
+        return
+    if not content_extractor.store_extracted_batch(rows):
+        error_log(f"Could not store {len(rows)} extraction results")
+        note_ids = [row['note_id'] for row in rows]
+        for note_id in note_ids:
+            started.pop(note_id, None)
+        try:
+            release_notes(note_ids, "Could not store the extracted text")
+        except Exception as e:
+            # Left 'processing'; the stale sweep requeues them
+            error_log(f"Error releasing notes: {str(e)}")
+        return
+    for row in rows:
+        success = row['status'] == 'completed'
+        metrics.observe('request_seconds', time.monotonic() - started.pop(row['note_id']), operation='ingest')
+        metrics.count('requests_total', operation='ingest', success=str(success).lower())
+        with app_log.request_context(f"ingest-{row['note_id']}"):
+            if success:
+                activity_log(f"Ingested note {row['note_id']} ({len(row['text'])} characters)")
+            else:
+                error_log(f"Ingestion of note {row['note_id']} failed: {row['error']}")
+
+
+def run_service(workers=None):
+    """Claim and extract pending notes in isolated processes until interrupted."""
+    workers = workers or INGEST_WORKERS
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    pool = extract_limits.IsolatedExecutor(max_workers=workers)
+    running = {}  # future -> note
+    started = {}  # note id -> claim time
+    activity_log(f"Ingestion service started with {workers} workers")
+
+    last_sweep = last_metrics = 0
+    try:
+        while True:
+            if time.monotonic() - last_sweep >= INGEST_SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                sweep(started)
+
+            free = workers - len(running)
+            notes = []
+            if free > 0:
+                try:
+                    notes = claim_notes(worker_id, free)
+                except Exception as e:
+                    error_log(f"Error claiming notes: {str(e)}")
+
+            # Notes whose bytes were extracted before need no parsing at all
+            known = content_extractor.get_indexed_texts(note['content_hash'] for note in notes)
+            reused = []
+            for note in notes:
+                started[note['id']] = time.monotonic()
+                text = known.get(note['content_hash'])
+                if text:
+                    reused.append({"note_id": note['id'], "user_id": note['user_id'], "content_hash": note['content_hash'],
+                                   "text": text, "status": 'completed', "error": None})
+                else:
+                    future = pool.submit(content_extractor.parse_pdf_note, note['id'], note['user_id'],
+                                         content_extractor.resolve_pdf_path(note['content']), note['content_hash'])
+                    running[future] = note
+            store_results(reused, started)
+
+            if running:
+                done, _ = wait(running, timeout=INGEST_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                rows = []
+                for future in done:
+                    note = running.pop(future)
+                    try:
+                        rows.append(future.result())
+                    except extract_limits.LimitExceeded as e:
+                        # Over a limit: only this note fails, and would fail again if retried
+                        rows.append(content_extractor.failed_extraction(note, e))
+                    except Exception as e:
+                        # The parser crashed, which may not happen again
+                        rows.append(content_extractor.failed_extraction(note, e, retry=True))
+                store_results(rows, started)
+            elif not notes:
+                time.sleep(INGEST_POLL_INTERVAL)
+
+            if time.monotonic() - last_metrics >= metrics.METRICS_WRITE_INTERVAL:
+                last_metrics = time.monotonic()
+                try:
+                    metrics.write_textfile('ingest_service')
+                except OSError as e:
+                    error_log(f"Error writing metrics: {str(e)}")
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        release_notes([note['id'] for note in running.values()], "Ingestion service stopped")
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Background PDF ingestion")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    work = commands.add_parser('work', help="run the ingestion service")
+    work.add_argument('--workers', type=int, default=INGEST_WORKERS)
+
+    show = commands.add_parser('status', help="show a note's extraction status")
+    show.add_argument('note_id', type=int)
+
+    args = parser.parse_args()
+
+    if args.command == 'work':
+        run_service(args.workers)
+    else:
+        status = get_status(args.note_id)
+        if status is None:
+            print(json.dumps({"success": False, "message": "Note not found in extraction queue"}))
+        else:
+            print(json.dumps({"success": True, "status": status}, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""
+Durable queue for summary and quiz generation.
+
+Jobs live in the generation_jobs table. The PHP endpoints enqueue them, and a
+pool of worker threads (py job_queue.py work) claims and runs them. A request
+for a note and mode that already has a queued or running job joins that job
+instead of starting another LLM run. Failed jobs are retried with backoff up
+to max_attempts. Workers heartbeat the jobs they are running, and a running
+job whose heartbeat stops (its worker died) is requeued, however long a
+healthy run takes.
+
+Usage:
+    py job_queue.py work [--workers N]
+    py job_queue.py enqueue <summary|quiz> <note_id> <user_id> [--refresh]
+    py job_queue.py status <job_id>
+"""
+
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import app_log
+import db
+import metrics
+
+logger = app_log.get_logger('JOB_QUEUE')
+activity_log = logger.info
+error_log = logger.error
+
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1'))
+JOB_RETRY_DELAY = int(os.getenv('JOB_RETRY_DELAY', '30'))       # seconds, doubled per attempt
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', '15'))  # seconds
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '120'))  # no heartbeat for this long = worker died
+
+MODES = ('summary', 'quiz')
+
+# Ids of the jobs this process is running, kept alive by heartbeat_loop()
+_running_jobs = set()
+_running_lock = threading.Lock()
+
+
+def dedupe_key(mode, note_id):
+    """Key shared by all active jobs for the same note and mode."""
+    return f"{mode}:{note_id}"
+
+
+def enqueue(note_id, user_id, mode, refresh=False):
+    """Queue a job, or join the active one for the same note and mode.
+
+    refresh=True asks for a fresh generation instead of reused or cached output.
+    Returns (job_id, created, refresh_applied); refresh_applied is False when a
+    refresh joined a job already running without one, since the worker read
+    the flag when it claimed the job.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode: {mode}")
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        # On a duplicate key LAST_INSERT_ID(id) makes lastrowid the existing job,
+        # and a refresh request upgrades it while it is still queued (a plain
+        # one never downgrades it)
+        cursor.execute(
+            """
+            INSERT INTO generation_jobs (note_id, user_id, mode, dedupe_key, refresh, max_attempts)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id),
+                refresh = IF(status = 'queued', GREATEST(refresh, VALUES(refresh)), refresh)
+            """,
+            (note_id, user_id, mode, dedupe_key(mode, note_id), int(refresh), JOB_MAX_ATTEMPTS)
+        )
+        job_id = cursor.lastrowid
+        created = cursor.rowcount == 1
+        refresh_applied = True
+        if refresh and not created:
+            cursor.execute("SELECT refresh FROM generation_jobs WHERE id = %s", (job_id,))
+            refresh_applied = bool(cursor.fetchone()[0])
+        conn.commit()
+        cursor.close()
+    return job_id, created, refresh_applied
+
+
+def get_job(job_id):
+    """Get a job row with its result decoded, or None."""
+    with db.connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            """
+            SELECT id, note_id, user_id, mode, status, attempts, max_attempts, result,
+                   error_message, created_at, started_at, finished_at
+            FROM generation_jobs WHERE id = %s
+            """,
+            (job_id,)
+        )
+        job = cursor.fetchone()
+        cursor.close()
+    if job and isinstance(job['result'], (str, bytes)):
+        job['result'] = json.loads(job['result'])
+    return job
+
+
+def claim_job(worker_id):
+    """Atomically take the oldest runnable job. Returns the job row or None."""
+    with db.connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            conn.start_transaction()
+            # SKIP LOCKED lets several workers claim different jobs without waiting
+            cursor.execute(
+                """
+                SELECT id, note_id, user_id, mode, refresh, attempts, max_attempts
+                FROM generation_jobs
+                WHERE status = 'queued' AND run_after <= NOW()
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+                """
+            )
+            job = cursor.fetchone()
+            if job:
+                cursor.execute(
+                    """
+                    UPDATE generation_jobs
+                    SET status = 'running', attempts = attempts + 1, started_at = NOW(),
+                        heartbeat_at = NOW(), worker_id = %s
+                    WHERE id = %s
+                    """,
+                    (worker_id, job['id'])
+                )
+                job['attempts'] += 1
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    return job
+
+
+def complete_job(job_id, result):
+    """Mark a job done and release its dedupe key."""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE generation_jobs
+            SET status = 'completed', result = %s, error_message = NULL,
+                dedupe_key = NULL, finished_at = NOW()
+            WHERE id = %s
+            """,
+            (json.dumps(result, ensure_ascii=False), job_id)
+        )
+        conn.commit()
+        cursor.close()
+
+
+def fail_job(job, message):
+    """Requeue a failed job with backoff, or mark it failed after its last attempt."""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        if job['attempts'] < job['max_attempts']:
+            delay = JOB_RETRY_DELAY * 2 ** (job['attempts'] - 1)
+            cursor.execute(
+                """
+                UPDATE generation_jobs
+                SET status = 'queued', error_message = %s,
+                    run_after = NOW() + INTERVAL %s SECOND
+                WHERE id = %s
+                """,
+                (message, delay, job['id'])
+            )
+        else:
+            cursor.execute(
+                """
+                UPDATE generation_jobs
+                SET status = 'failed', error_message = %s, dedupe_key = NULL, finished_at = NOW()
+                WHERE id = %s
+                """,
+                (message, job['id'])
+            )
+        conn.commit()
+        cursor.close()
+
+
+def heartbeat(job_ids):
+    """Mark running jobs as still alive."""
+    if not job_ids:
+        return
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ', '.join(['%s'] * len(job_ids))
+        cursor.execute(
+            f"UPDATE generation_jobs SET heartbeat_at = NOW() WHERE status = 'running' AND id IN ({placeholders})",
+            list(job_ids)
+        )
+        conn.commit()
+        cursor.close()
+
+
+def requeue_stale_jobs():
+    """Return running jobs whose heartbeat stopped (their worker died) to the queue."""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE generation_jobs
+            SET status = IF(attempts < max_attempts, 'queued', 'failed'),
+                dedupe_key = IF(attempts < max_attempts, dedupe_key, NULL),
+                finished_at = IF(attempts < max_attempts, NULL, NOW()),
+                error_message = 'Worker stopped before finishing the job'
+            WHERE status = 'running'
+              AND COALESCE(heartbeat_at, started_at) < NOW() - INTERVAL %s SECOND
+            """,
+            (JOB_STALE_SECONDS,)
+        )
+        count = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return count
+
+
+def run_job(job):
+    """Run one claimed job and record its outcome."""
+    import summary_generator
+
+    activity_log(f"Running {job['mode']} job {job['id']} for note {job['note_id']} "
+                 f"(attempt {job['attempts']}/{job['max_attempts']})")
+    try:
+        if job['mode'] == 'summary':
+            result = summary_generator.generate_summary(job['note_id'], job['user_id'], bool(job['refresh']))
+        else:
+            result = summary_generator.generate_quiz(job['note_id'], job['user_id'], bool(job['refresh']))
+    except Exception as e:
+        result = {"success": False, "message": f"Unexpected error: {str(e)}"}
+
+    if result.get('success'):
+        complete_job(job['id'], result)
+        activity_log(f"Job {job['id']} completed")
+    else:
+        fail_job(job, result.get('message', 'Unknown error'))
+        error_log(f"Job {job['id']} failed: {result.get('message')}")
+
+
+def worker_loop(worker_id, stop):
+    """Claim and run jobs until stop is set."""
+    while not stop.is_set():
+        try:
+            job = claim_job(worker_id)
+        except Exception as e:
+            error_log(f"Error claiming job: {str(e)}")
+            job = None
+        if job is None:
+            stop.wait(JOB_POLL_INTERVAL)
+            continue
+        with _running_lock:
+            _running_jobs.add(job['id'])
+        try:
+            with app_log.request_context(f"job-{job['id']}"):
+                run_job(job)
+        except Exception as e:
+            # Recording the outcome failed; once its heartbeat stops the stale-job sweep picks it up
+            error_log(f"Error finishing job {job['id']}: {str(e)}")
+        finally:
+            with _running_lock:
+                _running_jobs.discard(job['id'])
+
+
+def heartbeat_loop(stop):
+    """Heartbeat the jobs this process is running every JOB_HEARTBEAT_INTERVAL seconds until stop is set."""
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        with _running_lock:
+            job_ids = list(_running_jobs)
+        try:
+            heartbeat(job_ids)
+        except Exception as e:
+            error_log(f"Error sending job heartbeat: {str(e)}")
+
+
+def run_workers(workers=None):
+    """Run a pool of job workers until interrupted."""
+    workers = workers or JOB_WORKERS
+    stop = threading.Event()
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [
+        threading.Thread(target=worker_loop, args=(f"{prefix}:{i}", stop), daemon=True)
+        for i in range(workers)
+    ]
+    threads.append(threading.Thread(target=heartbeat_loop, args=(stop,), name='job-heartbeat', daemon=True))
+    for thread in threads:
+        thread.start()
+    activity_log(f"Job queue started with {workers} workers")
+
+    last_sweep = 0
+    try:
+        while True:
+            if time.monotonic() - last_sweep >= 60:
+                last_sweep = time.monotonic()
+                try:
+                    stale = requeue_stale_jobs()
+                    if stale:
+                        activity_log(f"Requeued {stale} stale jobs")
+                except Exception as e:
+                    error_log(f"Error requeueing stale jobs: {str(e)}")
+            try:
+                # Scraped like a node_exporter textfile: METRICS_DIR/job_queue.prom
+                metrics.write_textfile('job_queue')
+            except OSError as e:
+                error_log(f"Error writing metrics: {str(e)}")
+            time.sleep(metrics.METRICS_WRITE_INTERVAL)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Summary and quiz generation queue")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    work = commands.add_parser('work', help="run queue workers")
+    work.add_argument('--workers', type=int, default=JOB_WORKERS)
+
+    add = commands.add_parser('enqueue', help="queue a job")
+    add.add_argument('mode', choices=MODES)
+    add.add_argument('note_id', type=int)
+    add.add_argument('user_id', type=int)
+    add.add_argument('--refresh', action='store_true', help="regenerate instead of reusing output")
+
+    show = commands.add_parser('status', help="show a job")
+    show.add_argument('job_id', type=int)
+
+    args = parser.parse_args()
+
+    if args.command == 'work':
+        run_workers(args.workers)
+    elif args.command == 'enqueue':
+        job_id, created, refresh_applied = enqueue(args.note_id, args.user_id, args.mode, args.refresh)
+        print(json.dumps({"success": True, "job_id": job_id, "created": created,
+                          "refresh_applied": refresh_applied}))
+    else:
+        job = get_job(args.job_id)
+        if job is None:
+            print(json.dumps({"success": False, "message": "Job not found"}))
+        else:
+            print(json.dumps({"success": True, "job": job}, default=str, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
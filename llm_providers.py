@@ -0,0 +1,516 @@
+"""
+Shared asyncio client layer for the LLM providers.
+
+All model calls go through one background event loop that owns long-lived
+provider clients (and their HTTP sessions). Each provider has its own
+concurrency semaphore and token-bucket rate limiter, every call has a
+timeout, and 429/5xx/timeout failures are retried with jittered exponential
+backoff. Synchronous code uses complete_sync() and stream_sync(), which
+also answer repeated requests from the local response cache. The tasks call
+the providers through llm_router.py, which picks a provider and model per
+call from observed latency and errors and hedges slow calls.
+
+LLM_PROVIDER=replay swaps every provider for the offline stand-in in
+llm_replay.py; LLM_PROVIDER=record records live answers for it.
+
+Prompts are laid out for provider-side prefix caching: the stable part
+(instructions, then the document) comes first and the message that ends it
+is marked with "cache": True. Through OpenRouter that message gets a
+cache_control breakpoint (LLM_CACHE_HINTS); OpenAI and Gemini cache
+repeated prefixes on their own. Cached prompt tokens are counted in
+llm_cached_tokens_total next to llm_tokens_total{direction="in"}.
+"""
+
+import asyncio
+import os
+import queue
+from collections import namedtuple
+import random
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import metrics
+import response_cache
+
+load_dotenv()
+
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
+
+# live, replay (local stand-in, see llm_replay.py) or record (live, saving answers for replay)
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'live')
+
+# Defaults for every provider; override per provider with LLM_<NAME>_<SETTING>,
+# e.g. LLM_GEMINI_CONCURRENCY=2
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', '4'))
+LLM_RATE_PER_SEC = float(os.getenv('LLM_RATE_PER_SEC', '2'))
+LLM_BURST = int(os.getenv('LLM_BURST', '4'))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '60'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.5'))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '20'))
+LLM_CACHE_HINTS = os.getenv('LLM_CACHE_HINTS', '1') != '0'  # cache_control breakpoints on OpenRouter
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def provider_setting(name, setting, default, cast):
+    """Read LLM_<NAME>_<SETTING>, falling back to the global default."""
+    value = os.getenv(f"LLM_{name.upper()}_{setting}")
+    return cast(value) if value else default
+
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second with bursts of `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def error_status(error):
+    """HTTP-style status code of a provider error, if it has one."""
+    for attr in ('status_code', 'code', 'status'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def is_retryable(error):
+    """Whether a failed call is worth retrying."""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in ('APITimeoutError', 'APIConnectionError', 'DeadlineExceeded',
+                                'ServiceUnavailable', 'TooManyRequests', 'InternalServerError',
+                                'ResourceExhausted'):
+        return True
+    return error_status(error) in RETRYABLE_STATUS
+
+
+def retry_after(error):
+    """Seconds the provider asked us to wait, if it said so."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token) when the provider reports none."""
+    return (len(text) + 3) // 4
+
+
+# Token usage a provider reports at the end of a stream
+Usage = namedtuple('Usage', 'tokens_in tokens_out cached')
+
+
+def record_tokens(name, tokens_in, tokens_out, cached=None):
+    metrics.count('llm_tokens_total', tokens_in or 0, provider=name, direction='in')
+    metrics.count('llm_tokens_total', tokens_out or 0, provider=name, direction='out')
+    if cached is not None:
+        metrics.count('llm_cached_tokens_total', cached, provider=name)
+
+
+class Provider:
+    """Base class: limits, timeouts and retries around a provider's raw calls."""
+
+    def __init__(self, name):
+        self.name = name
+        self.concurrency = provider_setting(name, 'CONCURRENCY', LLM_CONCURRENCY, int)
+        self.timeout = provider_setting(name, 'TIMEOUT', LLM_TIMEOUT, float)
+        self.max_retries = provider_setting(name, 'MAX_RETRIES', LLM_MAX_RETRIES, int)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.bucket = TokenBucket(
+            provider_setting(name, 'RATE_PER_SEC', LLM_RATE_PER_SEC, float),
+            provider_setting(name, 'BURST', LLM_BURST, int)
+        )
+
+    async def _backoff(self, attempt, error):
+        metrics.count('llm_retries_total', provider=self.name, reason=error_status(error) or type(error).__name__)
+        delay = retry_after(error)
+        if delay is None:
+            # Full jitter keeps retries from many workers from lining up
+            delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+        await asyncio.sleep(delay)
+
+    async def complete(self, model, messages, **params):
+        """Return the full response text for a chat-style request."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.semaphore:
+                    await self.bucket.acquire()
+                    return await asyncio.wait_for(self._complete(model, messages, **params), self.timeout)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                await self._backoff(attempt, e)
+
+    async def stream(self, model, messages, **params):
+        """Yield response text pieces, and a Usage last if the provider reports one.
+
+        Retries only happen before the first piece.
+        """
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                async with self.semaphore:
+                    await self.bucket.acquire()
+                    pieces = self._stream(model, messages, **params).__aiter__()
+                    while True:
+                        try:
+                            # The timeout bounds the wait for each piece, not the whole answer
+                            piece = await asyncio.wait_for(pieces.__anext__(), self.timeout)
+                        except StopAsyncIteration:
+                            return
+                        started = True
+                        yield piece
+            except Exception as e:
+                if started or attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                await self._backoff(attempt, e)
+
+    async def _complete(self, model, messages, **params):
+        raise NotImplementedError
+
+    async def _stream(self, model, messages, **params):
+        # Providers without native streaming yield the whole answer at once
+        yield await self._complete(model, messages, **params)
+
+
+class OpenAICompatibleProvider(Provider):
+    """OpenRouter (or any OpenAI-compatible API) through one AsyncOpenAI client."""
+
+    def __init__(self, name, api_key, base_url=None):
+        super().__init__(name)
+        from openai import AsyncOpenAI
+        # Retries are handled here, so the SDK's own are turned off
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=self.timeout)
+        # cache_control is an OpenRouter extension; the OpenAI API rejects it
+        self.cache_hints = base_url is not None and provider_setting(name, 'CACHE_HINTS', LLM_CACHE_HINTS, lambda v: v != '0')
+
+    def _messages(self, messages):
+        """Messages for the API, with a cache breakpoint on those marked "cache"."""
+        wire = []
+        for message in messages:
+            message = dict(message)
+            if message.pop('cache', False) and self.cache_hints:
+                message['content'] = [{"type": "text", "text": message['content'], "cache_control": {"type": "ephemeral"}}]
+            wire.append(message)
+        return wire
+
+    @staticmethod
+    def _usage(usage):
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return Usage(usage.prompt_tokens, usage.completion_tokens, getattr(details, 'cached_tokens', None) or 0)
+
+    async def _complete(self, model, messages, **params):
+        response = await self.client.chat.completions.create(model=model, messages=self._messages(messages), **params)
+        if response.usage:
+            record_tokens(self.name, *self._usage(response.usage))
+        return (response.choices[0].message.content or "").strip()
+
+    async def _stream(self, model, messages, **params):
+        stream = await self.client.chat.completions.create(
+            model=model, messages=self._messages(messages), stream=True,
+            stream_options={"include_usage": True}, **params
+        )
+        usage = None
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if getattr(chunk, 'usage', None):
+                usage = self._usage(chunk.usage)
+        if usage:
+            yield usage
+
+
+class GeminiProvider(Provider):
+    """Google Gemini with the SDK configured once and models reused."""
+
+    def __init__(self, name, api_key):
+        super().__init__(name)
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.genai = genai
+        self.models = {}
+
+    def _model(self, model, system_instruction=None):
+        key = (model, system_instruction)
+        if key not in self.models:
+            self.models[key] = self.genai.GenerativeModel(model, system_instruction=system_instruction)
+        return self.models[key]
+
+    @staticmethod
+    def _prompt(messages):
+        system = "\n\n".join(m['content'] for m in messages if m['role'] == 'system') or None
+        contents = [
+            {"role": "model" if m['role'] == 'assistant' else "user", "parts": [m['content']]}
+            for m in messages if m['role'] != 'system'
+        ]
+        if len(contents) == 1:
+            contents = contents[0]['parts'][0]
+        return system, contents
+
+    @staticmethod
+    def _config(params):
+        config = {}
+        if 'max_tokens' in params:
+            config['max_output_tokens'] = params['max_tokens']
+        for key in ('temperature', 'top_p'):
+            if key in params:
+                config[key] = params[key]
+        return config or None
+
+    async def _complete(self, model, messages, **params):
+        system, contents = self._prompt(messages)
+        response = await self._model(model, system).generate_content_async(
+            contents, generation_config=self._config(params)
+        )
+        usage = getattr(response, 'usage_metadata', None)
+        if usage:
+            record_tokens(self.name, *self._usage(usage))
+        return response.text
+
+    @staticmethod
+    def _usage(usage):
+        # Gemini 2.5 models cache repeated prompt prefixes implicitly
+        return Usage(usage.prompt_token_count, usage.candidates_token_count,
+                     getattr(usage, 'cached_content_token_count', None) or 0)
+
+    async def _stream(self, model, messages, **params):
+        system, contents = self._prompt(messages)
+        response = await self._model(model, system).generate_content_async(
+            contents, generation_config=self._config(params), stream=True
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+        usage = getattr(response, 'usage_metadata', None)
+        if usage:
+            yield self._usage(usage)
+
+
+# Provider name -> environment variable holding its API key
+PROVIDER_KEYS = {
+    'gemini': 'GEMINI_API_KEY',
+    'openrouter': 'OPENROUTER_API_KEY1',
+    'openrouter_chat': 'OPENROUTER_API_KEY2',
+}
+
+
+def _openrouter_chat():
+    api_key = os.getenv(PROVIDER_KEYS['openrouter_chat'])
+    return OpenAICompatibleProvider('openrouter_chat', api_key,
+                                    OPENROUTER_BASE_URL if api_key and "sk-or-" in api_key else None)
+
+
+# Provider name -> factory. Each name has its own limits, so separate API keys
+# are limited separately.
+PROVIDER_FACTORIES = {
+    'gemini': lambda: GeminiProvider('gemini', os.getenv(PROVIDER_KEYS['gemini'])),
+    'openrouter': lambda: OpenAICompatibleProvider('openrouter', os.getenv(PROVIDER_KEYS['openrouter']), OPENROUTER_BASE_URL),
+    'openrouter_chat': _openrouter_chat,
+}
+
+_loop = None
+_loop_lock = threading.Lock()
+_providers = {}
+
+
+def get_loop():
+    """The background event loop all provider calls run on."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='llm-providers', daemon=True).start()
+    return _loop
+
+
+def provider_mode(name):
+    """live, replay or record for a provider (LLM_<NAME>_PROVIDER overrides LLM_PROVIDER)."""
+    return provider_setting(name, 'PROVIDER', LLM_PROVIDER, str).lower()
+
+
+def required_keys(pairs):
+    """Names of the API key variables the (provider, model) pairs need; replayed providers need none."""
+    names = []
+    for name, _ in pairs:
+        key = PROVIDER_KEYS.get(name)
+        if key and key not in names and provider_mode(name) != 'replay':
+            names.append(key)
+    return names
+
+
+def make_provider(name):
+    """Build a provider for the configured mode."""
+    mode = provider_mode(name)
+    if mode == 'replay':
+        import llm_replay
+        return llm_replay.ReplayProvider(name)
+    provider = PROVIDER_FACTORIES[name]()
+    if mode == 'record':
+        import llm_replay
+        return llm_replay.RecordingProvider(provider)
+    return provider
+
+
+def get_provider(name):
+    """Get (creating on first use) a provider. Must be called on the provider loop."""
+    if name not in _providers:
+        _providers[name] = make_provider(name)
+    return _providers[name]
+
+
+def run(coro):
+    """Run a coroutine on the provider loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+async def complete(name, model, messages, **params):
+    """Async entry point: full response text from a provider."""
+    return await get_provider(name).complete(model, messages, **params)
+
+
+def cached_answer(pairs, messages, params):
+    """A cached answer from the first (provider, model) pair in pairs that has one, or None."""
+    found = find_cached_answer(pairs, messages, params)
+    return found[1] if found else None
+
+
+def find_cached_answer(pairs, messages, params):
+    """Like cached_answer(), but as ((provider, model), answer) naming the pair it came from."""
+    # Load tests should reach the replay stand-in, and its answers must not end up in the real cache
+    pairs = [(name, model) for name, model in pairs if provider_mode(name) != 'replay']
+    if not pairs:
+        return None
+    try:
+        for name, model in pairs:
+            cached = response_cache.get(name, model, messages, params)
+            if cached is not None:
+                metrics.count('llm_cache_total', provider=name, result='hit')
+                return (name, model), cached
+    except Exception:
+        # A broken cache only costs a model call
+        return None
+    metrics.count('llm_cache_total', provider=pairs[0][0], result='miss')
+    return None
+
+
+def cache_answer(name, model, messages, params, response):
+    """Store an answer in the response cache."""
+    if provider_mode(name) == 'replay':
+        return
+    try:
+        response_cache.put(name, model, messages, params, response)
+    except Exception:
+        pass
+
+
+def complete_sync(name, model, messages, refresh=False, **params):
+    """Blocking entry point: full response text from a provider.
+
+    refresh=True skips the cache lookup (for regenerate) but still stores the new answer.
+    """
+    if not refresh:
+        cached = cached_answer([(name, model)], messages, params)
+        if cached is not None:
+            return cached
+    with metrics.span('llm', provider=name):
+        response = run(complete(name, model, messages, **params))
+    cache_answer(name, model, messages, params, response)
+    return response
+
+
+def iterate_sync(make_stream):
+    """Blocking generator over the items of an async generator run on the provider loop.
+
+    make_stream() is called on the loop to create the generator. The
+    generator is stopped if the consumer goes away early.
+    """
+    items = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in make_stream():
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_loop())
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        future.cancel()
+
+
+def finish_stream(name, model, messages, params, text, usage):
+    """Count the tokens of a finished stream and cache its answer.
+
+    usage is the Usage the provider reported, or None to estimate the tokens from the text.
+    """
+    if usage:
+        record_tokens(name, *usage)
+    else:
+        # The stream reported no usage, so count it from the text
+        record_tokens(name, sum(estimate_tokens(m['content']) for m in messages), estimate_tokens(text))
+    cache_answer(name, model, messages, params, text)
+
+
+def stream_sync(name, model, messages, refresh=False, **params):
+    """Blocking generator over response text pieces from a provider.
+
+    A cached answer is yielded as one piece; refresh=True skips the lookup.
+    """
+    if not refresh:
+        cached = cached_answer([(name, model)], messages, params)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    usage = None
+    start = time.perf_counter()
+    try:
+        for item in iterate_sync(lambda: get_provider(name).stream(model, messages, **params)):
+            if isinstance(item, Usage):
+                usage = item
+                continue
+            if not parts:
+                metrics.observe('llm_first_token_seconds', time.perf_counter() - start, provider=name)
+            parts.append(item)
+            yield item
+    finally:
+        metrics.record('llm', time.perf_counter() - start, provider=name)
+
+    finish_stream(name, model, messages, params, "".join(parts).strip(), usage)
@@ -0,0 +1,258 @@
+"""
+Local stand-in LLM backend for offline load tests.
+
+With LLM_PROVIDER=replay every provider name is served by ReplayProvider,
+which answers from recorded responses (or synthesizes a plausible one) after
+a sampled latency, streams in chunks, and fails a configurable share of calls
+with 429/5xx errors. The providers keep their real concurrency, rate-limit,
+timeout and retry settings, so those can be load-tested without a network
+or API keys. With LLM_PROVIDER=record the real providers are used and every
+answer (with its latency) is appended to LLM_REPLAY_PATH for later replay.
+
+The provider mode and the replay settings below can be set per provider
+with LLM_<NAME>_PROVIDER, LLM_<NAME>_REPLAY_LATENCY and so on.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import llm_providers
+import response_cache
+
+load_dotenv()
+
+LLM_REPLAY_PATH = os.getenv('LLM_REPLAY_PATH') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cache', 'llm_recordings.jsonl'
+)
+LLM_REPLAY_MISS = os.getenv('LLM_REPLAY_MISS', 'synthesize')           # synthesize or error when nothing was recorded
+LLM_REPLAY_LATENCY = os.getenv('LLM_REPLAY_LATENCY', 'lognormal:800:0.5')  # time to first token, see parse_distribution
+LLM_REPLAY_CHUNK_LATENCY = os.getenv('LLM_REPLAY_CHUNK_LATENCY', 'fixed:15')  # between streamed chunks
+LLM_REPLAY_CHUNK_CHARS = int(os.getenv('LLM_REPLAY_CHUNK_CHARS', '16'))
+LLM_REPLAY_ERROR_RATE = float(os.getenv('LLM_REPLAY_ERROR_RATE', '0'))  # share of calls that fail
+LLM_REPLAY_ERROR_STATUSES = os.getenv('LLM_REPLAY_ERROR_STATUSES', '429,500,503')
+LLM_REPLAY_RETRY_AFTER = os.getenv('LLM_REPLAY_RETRY_AFTER', '')       # seconds sent with injected 429s
+LLM_REPLAY_SEED = os.getenv('LLM_REPLAY_SEED')
+
+WORDS = (
+    "concept definition process result method system structure model value example "
+    "principle factor function theory analysis data evidence measure outcome property"
+).split()
+
+QUIZ_RE = re.compile(r"Generate (\d+) multiple-choice questions")
+
+
+# ---------- Synthetic answers ----------
+
+def _prompt_rng(messages):
+    """Random generator seeded by the prompt, so synthesized answers are reproducible."""
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode('utf-8')).digest()
+    return random.Random(digest)
+
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def message_text(content):
+    """Text of a message's content, which may also be a list of parts (OpenAI format)."""
+    if isinstance(content, list):
+        return "".join(part.get('text', '') for part in content)
+    return content
+
+
+def synthesize(messages, max_tokens=None):
+    """Deterministic answer shaped like what the prompt asks for."""
+    rng = _prompt_rng(messages)
+    # Instructions lead the prompt and the request ends it (llm_providers' prefix layout)
+    prompt = "\n".join(message_text(m['content']) for m in messages[:1] + messages[-1:]) if messages else ""
+
+    quiz = QUIZ_RE.search(prompt)
+    if quiz:
+        questions = [
+            {
+                "question": _sentence(rng, 8)[:-1] + "?",
+                "options": [f"{rng.choice(WORDS)} {i} {n}" for i in range(4)],
+                "correct": rng.choice("ABCD"),
+            }
+            for n in range(int(quiz.group(1)))
+        ]
+        return json.dumps(questions)
+
+    if "summar" in prompt.lower():
+        return "\n".join(f"* {_sentence(rng)}" for _ in range(8))
+
+    text = " ".join(_sentence(rng) for _ in range(4))
+    return text[:max_tokens * 4] if max_tokens else text
+
+
+def split_stream(text, chunk_chars=None):
+    """Split an answer into streaming pieces."""
+    chunk_chars = chunk_chars or LLM_REPLAY_CHUNK_CHARS
+    return [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+
+
+# ---------- Latency and errors ----------
+
+def parse_distribution(spec):
+    """Turn a latency spec into a sampler returning seconds (or None for 'recorded').
+
+    Specs are in milliseconds: fixed:MS, uniform:LOW:HIGH, normal:MEAN:SD,
+    lognormal:MEDIAN:SIGMA (long right tail), or recorded to replay the
+    latency stored with each recording.
+    """
+    kind, _, rest = spec.strip().partition(':')
+    args = [float(value) for value in rest.split(':') if value]
+    if kind == 'recorded':
+        return None
+    if kind == 'fixed' and len(args) == 1:
+        return lambda rng: args[0] / 1000
+    if kind == 'uniform' and len(args) == 2:
+        return lambda rng: rng.uniform(args[0], args[1]) / 1000
+    if kind == 'normal' and len(args) == 2:
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1])) / 1000
+    if kind == 'lognormal' and len(args) == 2:
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1]) / 1000
+    raise ValueError(f"Invalid latency distribution: {spec}")
+
+
+class InjectedError(Exception):
+    """A simulated provider failure, shaped like an SDK HTTP error."""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"Injected error {status_code}")
+        self.status_code = status_code
+        headers = {'retry-after': str(retry_after)} if retry_after else {}
+        self.response = type('InjectedResponse', (), {'status_code': status_code, 'headers': headers})()
+
+
+# ---------- Recordings ----------
+
+_recordings = None
+_recordings_lock = threading.Lock()
+
+
+def recordings():
+    """Recorded answers by request key, loaded from LLM_REPLAY_PATH once."""
+    global _recordings
+    with _recordings_lock:
+        if _recordings is None:
+            _recordings = {}
+            if os.path.exists(LLM_REPLAY_PATH):
+                with open(LLM_REPLAY_PATH, encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue  # a partly written last line
+                        _recordings[entry['key']] = entry
+    return _recordings
+
+
+def record(name, model, messages, params, response, latency):
+    """Append one answer to the recordings file."""
+    entry = {
+        "key": response_cache.cache_key(name, model, messages, params),
+        "provider": name,
+        "model": model,
+        "response": response,
+        "latency_ms": round(latency * 1000, 1),
+    }
+    with _recordings_lock:
+        os.makedirs(os.path.dirname(LLM_REPLAY_PATH), exist_ok=True)
+        with open(LLM_REPLAY_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        if _recordings is not None:
+            _recordings[entry['key']] = entry
+
+
+# ---------- Providers ----------
+
+class ReplayProvider(llm_providers.Provider):
+    """Answers from recordings or synthesis with simulated latency and failures."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        setting = lambda key, default, cast=str: llm_providers.provider_setting(name, key, default, cast)
+        self.latency = parse_distribution(setting('REPLAY_LATENCY', LLM_REPLAY_LATENCY))
+        self.chunk_latency = parse_distribution(setting('REPLAY_CHUNK_LATENCY', LLM_REPLAY_CHUNK_LATENCY))
+        self.error_rate = setting('REPLAY_ERROR_RATE', LLM_REPLAY_ERROR_RATE, float)
+        self.error_statuses = [int(s) for s in setting('REPLAY_ERROR_STATUSES', LLM_REPLAY_ERROR_STATUSES).split(',') if s]
+        self.retry_after = setting('REPLAY_RETRY_AFTER', LLM_REPLAY_RETRY_AFTER)
+        self.miss = setting('REPLAY_MISS', LLM_REPLAY_MISS)
+        self.rng = random.Random(f"{LLM_REPLAY_SEED}:{name}" if LLM_REPLAY_SEED else None)
+        self.calls = 0
+        self.errors = 0
+
+    def _answer(self, model, messages, params):
+        """(text, recorded_latency_seconds) for a request."""
+        entry = recordings().get(response_cache.cache_key(self.name, model, messages, params))
+        if entry:
+            return entry['response'], entry.get('latency_ms', 0) / 1000
+        if self.miss == 'error':
+            raise LookupError(f"No recorded {self.name} response for this request")
+        return synthesize(messages, params.get('max_tokens')), None
+
+    async def _wait(self, recorded):
+        """Sleep for the time to first token, then maybe fail."""
+        self.calls += 1
+        if self.latency is None:
+            delay = recorded if recorded is not None else 0.0
+        else:
+            delay = self.latency(self.rng)
+        await asyncio.sleep(delay)
+        if self.error_statuses and self.rng.random() < self.error_rate:
+            self.errors += 1
+            status = self.rng.choice(self.error_statuses)
+            raise InjectedError(status, self.retry_after if status == 429 else None)
+
+    async def _complete(self, model, messages, **params):
+        text, recorded = self._answer(model, messages, params)
+        await self._wait(recorded)
+        llm_providers.record_tokens(self.name, sum(llm_providers.estimate_tokens(m['content']) for m in messages),
+                                    llm_providers.estimate_tokens(text))
+        return text
+
+    async def _stream(self, model, messages, **params):
+        text, recorded = self._answer(model, messages, params)
+        await self._wait(recorded)
+        for i, piece in enumerate(split_stream(text)):
+            if i and self.chunk_latency is not None:
+                await asyncio.sleep(self.chunk_latency(self.rng))
+            yield piece
+
+
+class RecordingProvider(llm_providers.Provider):
+    """Calls a real provider and records each answer for replay."""
+
+    def __init__(self, provider):
+        super().__init__(provider.name)
+        self.provider = provider
+
+    async def _complete(self, model, messages, **params):
+        start = time.monotonic()
+        text = await self.provider._complete(model, messages, **params)
+        record(self.name, model, messages, params, text, time.monotonic() - start)
+        return text
+
+    async def _stream(self, model, messages, **params):
+        start = time.monotonic()
+        first = None
+        parts = []
+        async for piece in self.provider._stream(model, messages, **params):
+            if isinstance(piece, llm_providers.Usage):
+                yield piece
+                continue
+            if first is None:
+                first = time.monotonic() - start
+            parts.append(piece)
+            yield piece
+        record(self.name, model, messages, params, "".join(parts).strip(), first or 0.0)
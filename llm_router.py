@@ -0,0 +1,397 @@
+"""
+Latency-aware routing and hedged requests across the LLM providers.
+
+Each task (summary, quiz, chat, memory) has a route: the provider:model
+pairs that may answer it, best first, in LLM_<TASK>_ROUTE, e.g.
+
+    LLM_SUMMARY_ROUTE=gemini:gemini-2.5-flash,openrouter:google/gemini-2.5-flash
+
+The default is the one pair the task has always used. For every pair the
+router keeps the latencies and error rate it has seen on that task and
+sends each call to the fastest healthy pair (by median latency; the time to
+the first piece for streams). Pairs not tried yet go first so they get
+measured, and LLM_ROUTE_EXPLORE of the calls go to another healthy pair so
+the estimates stay current. A pair that fails LLM_ROUTE_FAILURES calls in a
+row (after the provider's own retries), or whose error rate goes over
+LLM_ROUTE_MAX_ERROR_RATE, rests for LLM_ROUTE_COOLDOWN seconds, and a call
+that fails moves on to the next pair.
+
+Our tail latency comes from provider stalls rather than average speed, so
+calls are hedged: when the pair has not answered by the LLM_HEDGE_PERCENTILE
+of its latencies (LLM_HEDGE_DELAY until it has LLM_HEDGE_MIN_SAMPLES), the
+same request goes to the next pair, or the same pair again on a one-pair
+route. The first answer wins and the other request is cancelled. At most
+LLM_HEDGE_BUDGET of the calls are hedged, so a slow provider cannot double
+the load on the others.
+
+The statistics live in the process: the study worker learns them over
+time, while a one-shot CLI call uses the route order and LLM_HEDGE_DELAY.
+Hedge settings can be set per task as LLM_<TASK>_<SETTING>, e.g.
+LLM_CHAT_HEDGE_PERCENTILE=90.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque, namedtuple
+
+import app_log
+import llm_providers
+import metrics
+
+logger = app_log.get_logger('ROUTER')
+
+LLM_HEDGE = os.getenv('LLM_HEDGE', '1') != '0'
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+LLM_HEDGE_DELAY = float(os.getenv('LLM_HEDGE_DELAY', '30'))         # seconds, until a pair has enough samples
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_HEDGE_BUDGET = float(os.getenv('LLM_HEDGE_BUDGET', '0.1'))      # share of calls that may be hedged
+LLM_ROUTE_WINDOW = int(os.getenv('LLM_ROUTE_WINDOW', '100'))         # latencies kept per pair
+LLM_ROUTE_EXPLORE = float(os.getenv('LLM_ROUTE_EXPLORE', '0.05'))
+LLM_ROUTE_FAILURES = int(os.getenv('LLM_ROUTE_FAILURES', '3'))
+LLM_ROUTE_MAX_ERROR_RATE = float(os.getenv('LLM_ROUTE_MAX_ERROR_RATE', '0.5'))
+LLM_ROUTE_COOLDOWN = float(os.getenv('LLM_ROUTE_COOLDOWN', '30'))
+
+ERROR_RATE_WEIGHT = 0.1  # weight of the latest call in a pair's error rate
+
+# One provider:model pair of a route; streams from the router yield the one answering first
+Candidate = namedtuple('Candidate', 'provider model')
+
+
+def parse_route(spec):
+    """Candidates from a route spec like 'gemini:gemini-2.5-flash,openrouter:gpt-4o-mini'."""
+    candidates = []
+    for entry in spec.split(','):
+        provider, _, model = entry.strip().partition(':')
+        if not provider:
+            continue
+        if provider not in llm_providers.PROVIDER_FACTORIES or not model:
+            raise ValueError(f"Invalid LLM route entry: {entry.strip()!r}")
+        candidates.append(Candidate(provider, model))
+    if not candidates:
+        raise ValueError(f"Empty LLM route: {spec!r}")
+    return candidates
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty sequence."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+
+def is_client_error(error):
+    """Whether a call failed because of the request itself (no point trying another pair)."""
+    status = llm_providers.error_status(error)
+    return status is not None and 400 <= status < 500 and not llm_providers.is_retryable(error)
+
+
+class PairStats:
+    """What the router has seen of one pair on one route."""
+
+    def __init__(self):
+        self.latency = {'complete': deque(maxlen=LLM_ROUTE_WINDOW), 'stream': deque(maxlen=LLM_ROUTE_WINDOW)}
+        self.error_rate = 0.0
+        self.failures = 0  # in a row
+        self.down_until = 0.0
+
+    def median(self, kind):
+        samples = self.latency[kind]
+        return percentile(samples, 50) if samples else None
+
+    def healthy(self, now):
+        return now >= self.down_until
+
+
+class Route:
+    """The pairs that can answer one task, with their statistics."""
+
+    def __init__(self, task, spec):
+        self.task = task
+        self.spec = spec
+        self.hedge = llm_providers.provider_setting(task, 'HEDGE', LLM_HEDGE, lambda v: v != '0')
+        self.hedge_percentile = llm_providers.provider_setting(task, 'HEDGE_PERCENTILE', LLM_HEDGE_PERCENTILE, float)
+        self.hedge_delay = llm_providers.provider_setting(task, 'HEDGE_DELAY', LLM_HEDGE_DELAY, float)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self._candidates = None
+        self.stats = {}
+
+    @property
+    def candidates(self):
+        # Parsed on first use, so a bad setting fails the calls rather than the import
+        if self._candidates is None:
+            candidates = parse_route(self.spec)
+            self.stats = {candidate: PairStats() for candidate in candidates}
+            self._candidates = candidates
+        return self._candidates
+
+    def ranked(self, kind):
+        """Candidates in the order to try them: healthy before resting, untried first, then fastest."""
+        now = time.monotonic()
+        with self.lock:
+            self.calls += 1
+
+            def order(candidate):
+                stats = self.stats[candidate]
+                median = stats.median(kind)
+                return not stats.healthy(now), median is not None, median or 0.0
+
+            # sorted() is stable, so ties keep the configured order
+            ranked = sorted(self.candidates, key=order)
+            healthy = [candidate for candidate in ranked if self.stats[candidate].healthy(now)]
+            if len(healthy) > 1 and random.random() < LLM_ROUTE_EXPLORE:
+                explore = random.choice(healthy[1:])
+                ranked.remove(explore)
+                ranked.insert(0, explore)
+        return ranked
+
+    def hedge_after(self, candidate, kind):
+        """Seconds to wait for candidate before hedging, or None to not hedge."""
+        if not self.hedge:
+            return None
+        with self.lock:
+            samples = self.stats[candidate].latency[kind]
+            if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+                return self.hedge_delay
+            return percentile(samples, self.hedge_percentile)
+
+    def take_hedge(self):
+        """Whether the hedge budget allows one more hedge (and use it)."""
+        with self.lock:
+            if self.hedges + 1 > max(1.0, LLM_HEDGE_BUDGET * self.calls):
+                return False
+            self.hedges += 1
+            return True
+
+    def succeeded(self, candidate, kind, seconds):
+        with self.lock:
+            stats = self.stats[candidate]
+            stats.latency[kind].append(seconds)
+            stats.error_rate *= 1 - ERROR_RATE_WEIGHT
+            stats.failures = 0
+        metrics.count('llm_route_calls_total', task=self.task, provider=candidate.provider, result='ok')
+
+    def failed(self, candidate, error):
+        now = time.monotonic()
+        with self.lock:
+            stats = self.stats[candidate]
+            stats.error_rate += ERROR_RATE_WEIGHT * (1 - stats.error_rate)
+            stats.failures += 1
+            rest = stats.healthy(now) and (stats.failures >= LLM_ROUTE_FAILURES
+                                           or stats.error_rate > LLM_ROUTE_MAX_ERROR_RATE)
+            if rest:
+                stats.down_until = now + LLM_ROUTE_COOLDOWN
+        metrics.count('llm_route_calls_total', task=self.task, provider=candidate.provider, result='error')
+        if rest:
+            metrics.count('llm_route_down_total', task=self.task, provider=candidate.provider)
+            logger.warning(f"{candidate.provider}:{candidate.model} rests for {LLM_ROUTE_COOLDOWN:g} s on the "
+                           f"{self.task} route after {stats.failures} failures in a row: {str(error)}",
+                           task=self.task, provider=candidate.provider, model=candidate.model)
+
+    def cancelled(self, candidate, kind, seconds):
+        with self.lock:
+            stats = self.stats[candidate]
+            median = stats.median(kind)
+            # The call would have taken at least this long. Only slower than usual
+            # counts, so a hedge cancelled soon after it started does not look fast
+            if median is not None and seconds > median:
+                stats.latency[kind].append(seconds)
+        metrics.count('llm_route_calls_total', task=self.task, provider=candidate.provider, result='cancelled')
+
+    def status(self):
+        """The route's statistics as a dict (times in milliseconds)."""
+        now = time.monotonic()
+        with self.lock:
+            pairs = []
+            for candidate in self._candidates or []:
+                stats = self.stats[candidate]
+                pairs.append({
+                    "provider": candidate.provider,
+                    "model": candidate.model,
+                    "healthy": stats.healthy(now),
+                    "error_rate": round(stats.error_rate, 3),
+                    "median_ms": {kind: round(stats.median(kind) * 1000, 1)
+                                  for kind in stats.latency if stats.latency[kind]},
+                    "samples": {kind: len(samples) for kind, samples in stats.latency.items()},
+                })
+            return {"route": self.spec, "calls": self.calls, "hedges": self.hedges, "pairs": pairs}
+
+
+_routes = {}
+_routes_lock = threading.Lock()
+
+
+def route(task, default):
+    """The route for a task: LLM_<TASK>_ROUTE, or default (a route spec)."""
+    with _routes_lock:
+        if task not in _routes:
+            _routes[task] = Route(task, llm_providers.provider_setting(task, 'ROUTE', default, str))
+        return _routes[task]
+
+
+def status():
+    """Statistics of every route used so far."""
+    with _routes_lock:
+        routes = dict(_routes)
+    return {task: route.status() for task, route in routes.items()}
+
+
+async def _race(route, kind, call, discard=None):
+    """Run call(candidate) on the route's best candidate, hedging and failing over.
+
+    Returns (candidate, result) of the first call to succeed. Calls still
+    running are cancelled, and discard(result) releases the result of one
+    that finished anyway.
+    """
+    ranked = route.ranked(kind)
+    waiting = list(ranked)
+    running = {}  # task -> (candidate, started, hedge)
+    error = None
+
+    def start(candidate, hedge=False):
+        task = asyncio.ensure_future(call(candidate))
+        running[task] = (candidate, time.monotonic(), hedge)
+
+    start(waiting.pop(0))
+    delay = route.hedge_after(ranked[0], kind)
+    hedge_at = time.monotonic() + delay if delay is not None else None
+    try:
+        while running:
+            timeout = None if hedge_at is None else max(0.0, hedge_at - time.monotonic())
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # Too slow: ask the next pair as well (the same one on a one-pair route)
+                hedge_at = None
+                if route.take_hedge():
+                    start(waiting.pop(0) if waiting else ranked[0], hedge=True)
+                continue
+
+            for task in done:
+                candidate, started, hedge = running.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    if is_client_error(e):
+                        raise
+                    route.failed(candidate, e)
+                    error = e
+                    continue
+                route.succeeded(candidate, kind, time.monotonic() - started)
+                if hedge or any(other[2] for other in running.values()):
+                    metrics.count('llm_hedges_total', task=route.task, result='won' if hedge else 'lost')
+                return candidate, result
+
+            if not running and waiting:
+                metrics.count('llm_failovers_total', task=route.task)
+                start(waiting.pop(0))
+        raise error
+    finally:
+        for task, (candidate, started, hedge) in running.items():
+            task.cancel()
+            route.cancelled(candidate, kind, time.monotonic() - started)
+        if running:
+            # Let the cancelled calls unwind, and release any that finished meanwhile
+            for result in await asyncio.gather(*running, return_exceptions=True):
+                if discard and not isinstance(result, BaseException):
+                    await discard(result)
+
+
+async def _complete(route, messages, **params):
+    async def call(candidate):
+        return await llm_providers.complete(candidate.provider, candidate.model, messages, **params)
+
+    return await _race(route, 'complete', call)
+
+
+async def _stream(route, messages, **params):
+    """Yield the answering Candidate, then its pieces (and a Usage if reported)."""
+    async def first_piece(candidate):
+        pieces = llm_providers.get_provider(candidate.provider).stream(candidate.model, messages, **params)
+        try:
+            return await pieces.__anext__(), pieces
+        except StopAsyncIteration:
+            return None, pieces
+        except BaseException:
+            await pieces.aclose()
+            raise
+
+    async def discard(result):
+        await result[1].aclose()
+
+    candidate, (first, pieces) = await _race(route, 'stream', first_piece, discard)
+    yield candidate
+    try:
+        if first is not None:
+            yield first
+        async for piece in pieces:
+            yield piece
+    except Exception as e:
+        # Too late to move to another pair, but it counts against this one
+        route.failed(candidate, e)
+        raise
+    finally:
+        await pieces.aclose()
+
+
+def complete_sync(route, messages, refresh=False, **params):
+    """Blocking entry point: (candidate, full response text) from the best pair on a route.
+
+    The candidate is the pair that answered, so callers can record the model
+    that actually wrote the text. refresh=True skips the cache lookup (for
+    regenerate) but still stores the new answer.
+    """
+    if not refresh:
+        found = llm_providers.find_cached_answer(route.candidates, messages, params)
+        if found is not None:
+            pair, cached = found
+            return Candidate(*pair), cached
+    provider = route.candidates[0].provider
+    start = time.perf_counter()
+    try:
+        candidate, response = llm_providers.run(_complete(route, messages, **params))
+        provider = candidate.provider
+    finally:
+        metrics.record('llm', time.perf_counter() - start, provider=provider)
+    llm_providers.cache_answer(candidate.provider, candidate.model, messages, params, response)
+    return candidate, response
+
+
+def stream_sync(route, messages, refresh=False, **params):
+    """Blocking generator: the answering Candidate, then response text pieces from the best pair on a route.
+
+    The candidate comes first so callers can record the model that actually
+    wrote the text. A cached answer is yielded as one piece; refresh=True
+    skips the lookup.
+    """
+    if not refresh:
+        found = llm_providers.find_cached_answer(route.candidates, messages, params)
+        if found is not None:
+            pair, cached = found
+            yield Candidate(*pair)
+            yield cached
+            return
+
+    candidate = route.candidates[0]
+    parts = []
+    usage = None
+    start = time.perf_counter()
+    try:
+        for item in llm_providers.iterate_sync(lambda: _stream(route, messages, **params)):
+            if isinstance(item, Candidate):
+                candidate = item
+                yield item
+                continue
+            if isinstance(item, llm_providers.Usage):
+                usage = item
+                continue
+            if not parts:
+                metrics.observe('llm_first_token_seconds', time.perf_counter() - start, provider=candidate.provider)
+            parts.append(item)
+            yield item
+    finally:
+        metrics.record('llm', time.perf_counter() - start, provider=candidate.provider)
+
+    llm_providers.finish_stream(candidate.provider, candidate.model, messages, params, "".join(parts).strip(), usage)
@@ -0,0 +1,222 @@
+"""
+Lightweight in-process metrics and per-request stage timings.
+
+span(stage) times a block into the study_helper_stage_seconds histogram and,
+when the block runs inside a timed request, into that request's timings.
+@timed_request wraps an entry point (generate_summary, ...) so its result
+dict gets a "timings" field like {"db_query": {"ms": 12.5, "count": 3}, ...};
+@timed_stream does the same for the final event of a streaming entry point.
+Timings follow the app_log request id, so work in thread pools started with
+app_log.in_request counts towards its request. Stages can nest (for example
+"llm" inside "summarize"), so their times do not add up to the total.
+
+render() returns everything in the Prometheus text format; the study worker
+serves it at /metrics and the job queue writes it to METRICS_DIR.
+"""
+
+import contextlib
+import functools
+import os
+import threading
+import time
+
+import app_log
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+METRICS_DIR = os.getenv('METRICS_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cache', 'metrics'
+)
+METRICS_WRITE_INTERVAL = float(os.getenv('METRICS_WRITE_INTERVAL', '15'))  # seconds between textfile writes
+
+PREFIX = 'study_helper_'
+
+# Histogram bucket bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HELP = {
+    'stage_seconds': "Time spent per processing stage",
+    'request_seconds': "Time per worker operation",
+    'requests_total': "Operations handled, by result",
+    'llm_tokens_total': "LLM tokens by direction (reported by the provider or estimated)",
+    'llm_cached_tokens_total': "LLM prompt tokens the provider served from its prompt cache",
+    'llm_cache_total': "LLM response cache lookups by result",
+    'llm_retries_total': "LLM calls retried after a failure",
+    'llm_first_token_seconds': "Time to the first streamed LLM piece",
+    'llm_route_calls_total': "Routed LLM calls per provider, by result (ok, error, cancelled)",
+    'llm_route_down_total': "Times a provider was rested on a route after failures",
+    'llm_hedges_total': "Hedged LLM calls, by whether the hedge won",
+    'llm_failovers_total': "Routed LLM calls retried on another provider after a failure",
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count], sum
+_requests = {}    # request id -> timings dict
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def count(name, value=1, **labels):
+    """Add value to a counter."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """Record one observation in a histogram."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        buckets, total = _histograms.get(key) or ([0] * (len(BUCKETS) + 1), 0.0)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+        buckets[-1] += 1
+        _histograms[key] = (buckets, total + seconds)
+
+
+def _add_timing(stage, seconds):
+    timings = _requests.get(app_log.get_request_id())
+    if timings is None:
+        return
+    with _lock:
+        entry = timings.setdefault(stage, {"ms": 0.0, "count": 0})
+        entry["ms"] += seconds * 1000
+        entry["count"] += 1
+
+
+def record(stage, seconds, **labels):
+    """Record a stage duration measured elsewhere."""
+    observe('stage_seconds', seconds, stage=stage, **labels)
+    _add_timing(stage, seconds)
+
+
+@contextlib.contextmanager
+def span(stage, **labels):
+    """Time a block as one stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, **labels)
+
+
+@contextlib.contextmanager
+def collect_timings():
+    """Collect the stage timings of everything the block does for this request."""
+    with app_log.request_context(app_log.get_request_id()) as request_id:
+        previous = _requests.get(request_id)
+        timings = {}
+        _requests[request_id] = timings
+        try:
+            yield timings
+        finally:
+            if previous is None:
+                _requests.pop(request_id, None)
+            else:
+                _requests[request_id] = previous
+
+
+def _rounded(timings, total):
+    result = {stage: {"ms": round(entry["ms"], 1), "count": entry["count"]} for stage, entry in timings.items()}
+    result["total"] = {"ms": round(total * 1000, 1), "count": 1}
+    return result
+
+
+def timed_request(operation):
+    """Decorator for entry points returning a result dict: adds "timings" and request metrics."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            with collect_timings() as timings:
+                result = fn(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            success = bool(isinstance(result, dict) and result.get('success'))
+            observe('request_seconds', elapsed, operation=operation)
+            count('requests_total', operation=operation, success=str(success).lower())
+            if isinstance(result, dict) and METRICS_ENABLED:
+                result["timings"] = _rounded(timings, elapsed)
+            return result
+        return wrapper
+    return decorate
+
+
+def timed_stream(operation):
+    """Decorator like timed_request for event generators: the final done/error event gets "timings"."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            with collect_timings() as timings:
+                for event in fn(*args, **kwargs):
+                    if isinstance(event, dict) and event.get('type') in ('done', 'error'):
+                        elapsed = time.perf_counter() - start
+                        observe('request_seconds', elapsed, operation=operation)
+                        count('requests_total', operation=operation, success=str(event['type'] == 'done').lower())
+                        if METRICS_ENABLED:
+                            event = dict(event, timings=_rounded(timings, elapsed))
+                    yield event
+        return wrapper
+    return decorate
+
+
+# ---------- Export ----------
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(buckets), total) for key, (buckets, total) in _histograms.items()}
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {PREFIX}{name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {PREFIX}{name} histogram")
+        for (metric, labels), (buckets, total) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, value in zip(BUCKETS, buckets):
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', str(bound))])} {value}")
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {buckets[-1]}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {round(total, 6)}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {buckets[-1]}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(name):
+    """Write render() to METRICS_DIR/<name>.prom atomically (node_exporter textfile style)."""
+    if not METRICS_ENABLED:
+        return None
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{name}.prom")
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'w', encoding='utf-8') as f:
+        f.write(render())
+    os.replace(temp, path)
+    return path
@@ -0,0 +1,221 @@
+"""
+Pluggable PDF text extraction backends.
+
+Each backend opens one PDF and returns the text of a page. They are tried in
+PDF_BACKEND_ORDER, fastest first:
+
+    pypdfium2   PDFium bindings; several times faster than the pure-Python parsers
+    pypdf2      PyPDF2, the original extractor
+    pdfminer    pdfminer.six with minimal layout analysis (optional); slower
+                than PyPDF2 on our uploads, so only a last resort for files
+                the others cannot parse
+
+Backends whose package is not installed are skipped. PDF_BACKEND=auto uses
+the first installed one for each document and moves down the chain when a
+document fails to open or a page fails to parse; naming a backend puts it
+first. Page text is normalized the same way whichever backend produced it,
+so cached pages, chunks and summaries do not depend on the engine.
+"""
+
+import importlib.util
+import os
+import re
+import threading
+import unicodedata
+
+import app_log
+
+logger = app_log.get_logger('PDF')
+
+PDF_BACKEND = os.getenv('PDF_BACKEND', 'auto')
+PDF_BACKEND_ORDER = [name.strip() for name in os.getenv('PDF_BACKEND_ORDER', 'pypdfium2,pypdf2,pdfminer').split(',') if name.strip()]
+
+
+class Backend:
+    """One open PDF. Subclasses set page_count and implement page_text()."""
+
+    name = None
+    module = None  # import name of the package the backend needs
+
+    def __init__(self, path):
+        self.path = path
+        self.page_count = 0
+
+    def page_text(self, number):
+        """Raw text of a 1-based page."""
+        raise NotImplementedError
+
+    def page_has_images(self, number):
+        """Whether a page draws any images; True when the backend cannot tell."""
+        return True
+
+    def close(self):
+        pass
+
+
+# PDFium is not thread-safe; the study worker may extract from several threads
+_pdfium_lock = threading.RLock()
+
+
+class PdfiumBackend(Backend):
+    name = 'pypdfium2'
+    module = 'pypdfium2'
+
+    def __init__(self, path):
+        super().__init__(path)
+        import pypdfium2
+        with _pdfium_lock:
+            self.document = pypdfium2.PdfDocument(path)
+            self.page_count = len(self.document)
+
+    def page_text(self, number):
+        with _pdfium_lock:
+            page = self.document[number - 1]
+            try:
+                textpage = page.get_textpage()
+                try:
+                    return textpage.get_text_bounded()
+                finally:
+                    textpage.close()
+            finally:
+                page.close()
+
+    def page_has_images(self, number):
+        import pypdfium2.raw
+        with _pdfium_lock:
+            page = self.document[number - 1]
+            try:
+                return any(True for _ in page.get_objects(filter=[pypdfium2.raw.FPDF_PAGEOBJ_IMAGE]))
+            finally:
+                page.close()
+
+    def close(self):
+        with _pdfium_lock:
+            self.document.close()
+
+
+class PdfminerBackend(Backend):
+    name = 'pdfminer'
+    module = 'pdfminer'
+
+    def __init__(self, path):
+        super().__init__(path)
+        import io
+        from pdfminer.converter import TextConverter
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+
+        self.file = open(path, 'rb')
+        try:
+            self.pages = list(PDFPage.get_pages(self.file))
+        except Exception:
+            self.file.close()
+            raise
+        self.page_count = len(self.pages)
+        self.output = io.StringIO()
+        resources = PDFResourceManager(caching=True)
+        # Without layout analysis (laparams=None) pdfminer emits characters with no
+        # line breaks. Grouping characters into lines is cheap; boxes_flow=None skips
+        # the costly ordering of text boxes.
+        self.device = TextConverter(resources, self.output, laparams=LAParams(boxes_flow=None))
+        self.interpreter = PDFPageInterpreter(resources, self.device)
+
+    def page_text(self, number):
+        self.output.seek(0)
+        self.output.truncate()
+        self.interpreter.process_page(self.pages[number - 1])
+        return self.output.getvalue()
+
+    def close(self):
+        self.device.close()
+        self.file.close()
+
+
+class PyPDF2Backend(Backend):
+    name = 'pypdf2'
+    module = 'PyPDF2'
+
+    def __init__(self, path):
+        super().__init__(path)
+        from PyPDF2 import PdfReader
+        self.file = open(path, 'rb')
+        try:
+            self.reader = PdfReader(self.file)
+            self.page_count = len(self.reader.pages)
+        except Exception:
+            self.file.close()
+            raise
+
+    def page_text(self, number):
+        return self.reader.pages[number - 1].extract_text() or ""
+
+    def page_has_images(self, number):
+        page = self.reader.pages[number - 1]
+        if '/Resources' not in page:
+            # Inherited from the page tree, which PyPDF2 does not resolve here
+            return True
+        resources = page['/Resources']
+        xobjects = resources['/XObject'] if '/XObject' in resources else {}
+        # Images inside form XObjects are not looked up; count the form as a maybe
+        return any(xobjects[name].get('/Subtype') in ('/Image', '/Form') for name in xobjects)
+
+    def close(self):
+        self.file.close()
+
+
+BACKENDS = {backend.name: backend for backend in (PdfiumBackend, PdfminerBackend, PyPDF2Backend)}
+
+_installed = {}
+
+
+def installed(name):
+    """Whether a backend's package can be imported."""
+    if name not in _installed:
+        _installed[name] = name in BACKENDS and importlib.util.find_spec(BACKENDS[name].module) is not None
+    return _installed[name]
+
+
+def backend_chain(preferred=None):
+    """Installed backend names in the order to try them."""
+    preferred = preferred or PDF_BACKEND
+    order = list(PDF_BACKEND_ORDER)
+    if preferred != 'auto':
+        if preferred not in BACKENDS:
+            raise ValueError(f"Unknown PDF backend: {preferred}")
+        order = [preferred] + [name for name in order if name != preferred]
+    return [name for name in order if installed(name)]
+
+
+def open_pdf(path, chain):
+    """Open a PDF with the first backend in chain that can, removing the ones tried from chain."""
+    error = None
+    while chain:
+        name = chain.pop(0)
+        try:
+            return BACKENDS[name](path)
+        except Exception as e:
+            logger.warning(f"{name} could not open {os.path.basename(path)}: {str(e)}")
+            error = e
+    raise error or RuntimeError("No PDF backend is installed")
+
+
+_control_chars = re.compile(r'[\x00-\x08\x0b-\x1f\x7f]')
+_trailing_space = re.compile(r'[ \t]+\n')
+_blank_lines = re.compile(r'\n{3,}')
+
+
+def normalize(text):
+    """Normalize page text so every backend gives the same shape of output.
+
+    Compatibility characters (ligatures, full-width forms) are folded, line
+    endings become \\n, form feeds and other control characters are dropped,
+    trailing spaces and runs of blank lines are trimmed, and a page with text
+    ends with one newline so pages do not run together when joined.
+    """
+    text = unicodedata.normalize('NFKC', text)
+    text = text.replace('\r\n', '\n').replace('\r', '\n').replace('\f', '\n')
+    text = _control_chars.sub('', text)
+    text = _trailing_space.sub('\n', text)
+    text = _blank_lines.sub('\n\n', text).strip('\n')
+    return text + '\n' if text.strip() else ''
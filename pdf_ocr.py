@@ -0,0 +1,138 @@
+"""
+OCR for the image-only pages of scanned PDFs.
+
+Text extraction returns (almost) nothing for a page that is just a scanned
+image. find_image_pages() picks those pages cheaply: the text the parser
+found is shorter than OCR_MIN_CHARS and the page draws at least one image.
+ocr_pages() renders only those pages with PDFium and runs the Tesseract
+command line on each, in a pool of OCR_WORKERS processes, giving every page
+OCR_PAGE_TIMEOUT seconds. Pages with real text never pay for OCR.
+
+Needs pypdfium2 (for rendering) and a tesseract binary on PATH or at
+TESSERACT_CMD; without them OCR is skipped and the pages stay empty.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import app_log
+import extract_limits
+import metrics
+import pdf_backends
+
+logger = app_log.get_logger('OCR')
+activity_log = logger.info
+error_log = logger.error
+
+OCR_ENABLED = os.getenv('OCR_ENABLED', '1') != '0'
+OCR_MIN_CHARS = int(os.getenv('OCR_MIN_CHARS', '20'))            # pages with less text are OCR candidates
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '0')) or os.cpu_count() or 1
+OCR_PAGE_TIMEOUT = float(os.getenv('OCR_PAGE_TIMEOUT', '60'))    # seconds per page
+OCR_DPI = int(os.getenv('OCR_DPI', '300'))
+OCR_LANG = os.getenv('OCR_LANG', 'eng')
+TESSERACT_CMD = os.getenv('TESSERACT_CMD', 'tesseract')
+
+
+def available():
+    """Whether OCR can run here."""
+    return (OCR_ENABLED and pdf_backends.installed('pypdfium2')
+            and shutil.which(TESSERACT_CMD) is not None)
+
+
+def find_image_pages(pdf_path, pages):
+    """Page numbers among pages ([(page_number, text), ...]) that look image-only."""
+    candidates = [number for number, text in pages if len(text.strip()) < OCR_MIN_CHARS]
+    if not candidates:
+        return []
+    document = pdf_backends.open_pdf(pdf_path, pdf_backends.backend_chain())
+    try:
+        return [number for number in candidates if document.page_has_images(number)]
+    finally:
+        document.close()
+
+
+def _render_pgm(pdf_path, number):
+    """Render one page as a grayscale PGM image."""
+    import pypdfium2
+    document = pypdfium2.PdfDocument(pdf_path)
+    try:
+        page = document[number - 1]
+        bitmap = page.render(scale=OCR_DPI / 72, grayscale=True)
+        width, height, stride = bitmap.width, bitmap.height, bitmap.stride
+        data = bytes(bitmap.buffer)
+        page.close()
+    finally:
+        document.close()
+    if stride != width:
+        data = b"".join(data[row * stride:row * stride + width] for row in range(height))
+    return f"P5\n{width} {height}\n255\n".encode('ascii') + data
+
+
+def ocr_page(pdf_path, number):
+    """OCR one page. Returns (page_number, text, error); runs in a pool worker."""
+    start = time.perf_counter()
+    try:
+        with tempfile.TemporaryDirectory(prefix='ocr_') as workdir:
+            image = os.path.join(workdir, 'page.pgm')
+            with open(image, 'wb') as f:
+                f.write(_render_pgm(pdf_path, number))
+            completed = subprocess.run(
+                [TESSERACT_CMD, image, 'stdout', '-l', OCR_LANG, '--dpi', str(OCR_DPI)],
+                capture_output=True,
+                timeout=max(OCR_PAGE_TIMEOUT - (time.perf_counter() - start), 1),
+                # One thread per tesseract; the pool already uses the cores
+                env=dict(os.environ, OMP_THREAD_LIMIT='1')
+            )
+        if completed.returncode != 0:
+            message = completed.stderr.decode('utf-8', errors='replace').strip()[-300:]
+            return number, '', f"tesseract exited with {completed.returncode}: {message}"
+        return number, completed.stdout.decode('utf-8', errors='replace'), None
+    except subprocess.TimeoutExpired:
+        return number, '', f"timed out after {OCR_PAGE_TIMEOUT:g}s"
+    except Exception as e:
+        return number, '', str(e)
+
+
+def ocr_pages(pdf_path, numbers, workers=None):
+    """OCR some pages of a PDF. Returns {page_number: text} for the pages that produced text.
+
+    workers=1 runs in the calling process, e.g. from a worker of another pool.
+    """
+    workers = min(workers or OCR_WORKERS, len(numbers))
+    if not numbers or not available():
+        return {}
+
+    start = time.perf_counter()
+    results = {}
+    # A page may take OCR_PAGE_TIMEOUT in tesseract plus its rendering
+    allowance = OCR_PAGE_TIMEOUT + extract_limits.EXTRACT_PAGE_TIMEOUT
+    extract_limits.progress(None, allowance)
+
+    def finish(number, text, error):
+        extract_limits.progress(number, allowance)
+        if error:
+            metrics.count('ocr_pages_total', result='timeout' if error.startswith('timed out') else 'error')
+            error_log(f"OCR of page {number} of {os.path.basename(pdf_path)} failed: {error}")
+            return
+        metrics.count('ocr_pages_total', result='ok')
+        text = pdf_backends.normalize(text)
+        if text:
+            results[number] = text
+
+    if workers <= 1:
+        for number in numbers:
+            finish(*ocr_page(pdf_path, number))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(ocr_page, pdf_path, number) for number in numbers]
+            for future in as_completed(futures):
+                finish(*future.result())
+
+    metrics.record('ocr', time.perf_counter() - start)
+    activity_log(f"OCR recovered text on {len(results)}/{len(numbers)} pages of {os.path.basename(pdf_path)} "
+                 f"in {time.perf_counter() - start:.1f}s")
+    return results
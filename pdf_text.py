@@ -0,0 +1,138 @@
+"""
+Shared PDF text extraction.
+
+Text is extracted page by page and can be cached per page in the
+extracted_pages table, so callers can ask for just the pages they need and
+an interrupted extraction resumes from the first missing page. The parsing
+itself is done by the backends in pdf_backends.py.
+"""
+
+import os
+import time
+
+import app_log
+import db
+import extract_limits
+import metrics
+import pdf_backends
+
+logger = app_log.get_logger('PDF')
+
+# Pages written to the page cache per round trip while extracting
+PAGE_FLUSH_SIZE = int(os.getenv('PAGE_FLUSH_SIZE', '25'))
+
+
+def iter_pages(pdf_path, pages=None, skip=()):
+    """Yield (page_number, text) for a PDF, 1-based, optionally only for some pages.
+
+    A page the current backend fails on is retried with the next backend in
+    the chain, which then handles the rest of the document.
+    """
+    chain = pdf_backends.backend_chain()
+    document = pdf_backends.open_pdf(pdf_path, chain)
+    extract_limits.progress(0)
+    try:
+        total = document.page_count
+        numbers = range(1, total + 1) if pages is None else sorted(p for p in set(pages) if 1 <= p <= total)
+        for number in numbers:
+            if number in skip:
+                continue
+            start = time.perf_counter()
+            while True:
+                try:
+                    text = document.page_text(number)
+                    break
+                except Exception as e:
+                    if not chain:
+                        raise
+                    logger.warning(f"{document.name} failed on page {number} of {os.path.basename(pdf_path)}: {str(e)}")
+                    document.close()
+                    document = None
+                    document = pdf_backends.open_pdf(pdf_path, chain)
+            metrics.record('pdf_page', time.perf_counter() - start, backend=document.name)
+            extract_limits.progress(number)
+            yield number, pdf_backends.normalize(text)
+    finally:
+        if document is not None:
+            document.close()
+
+
+def extract_pages(pdf_path, pages=None):
+    """Return [(page_number, text), ...] for a PDF."""
+    return list(iter_pages(pdf_path, pages))
+
+
+def join_pages(pages):
+    """Join page texts the same way the whole-document extractor always has."""
+    return "".join(text for _, text in pages).strip()
+
+
+def extract_text_from_pdf(pdf_path):
+    """Extract all text from a PDF."""
+    return join_pages(iter_pages(pdf_path))
+
+
+# ---------- Page cache ----------
+
+def get_cached_pages(note_id, pages=None):
+    """Get cached page texts for a note as {page_number: text}."""
+    query = "SELECT page_number, page_text FROM extracted_pages WHERE note_id = %s"
+    params = [note_id]
+    if pages is not None:
+        pages = sorted(set(pages))
+        if not pages:
+            return {}
+        query += f" AND page_number IN ({', '.join(['%s'] * len(pages))})"
+        params += pages
+
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        cached = dict(cursor.fetchall())
+        cursor.close()
+    return cached
+
+
+def store_pages(note_id, pages):
+    """Cache [(page_number, text), ...] for a note."""
+    if not pages:
+        return
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            """
+            INSERT INTO extracted_pages (note_id, page_number, page_text)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE page_text = VALUES(page_text)
+            """,
+            [(note_id, number, text) for number, text in pages]
+        )
+        conn.commit()
+        cursor.close()
+
+
+def get_note_pages(note_id, pdf_path, pages=None):
+    """Get page texts for a note, extracting and caching only the missing pages.
+
+    Returns [(page_number, text), ...] in page order. With pages=None the whole
+    document is returned, resuming from whatever a previous run already cached.
+    """
+    cached = get_cached_pages(note_id, pages)
+    if pages is not None and all(number in cached for number in pages):
+        return sorted(cached.items())
+
+    batch = []
+    for number, text in iter_pages(pdf_path, pages, skip=cached):
+        cached[number] = text
+        batch.append((number, text))
+        if len(batch) >= PAGE_FLUSH_SIZE:
+            store_pages(note_id, batch)
+            batch = []
+    store_pages(note_id, batch)
+
+    return sorted(cached.items())
+
+
+def extract_note_text(note_id, pdf_path):
+    """Extract all text for a note through the page cache."""
+    return join_pages(get_note_pages(note_id, pdf_path))
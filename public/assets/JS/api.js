@@ -108,16 +108,70 @@ export async function getQuizzes(noteId) {
     return await response.json();
 }
 
-export async function generateQuiz(noteId) {
+export async function generateQuiz(noteId, regenerate = false) {
     const response = await fetch(`${BaseURL}BACKEND/generateQuiz.php`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         credentials: 'include',
-        body: JSON.stringify({ note_id: noteId })
+        body: JSON.stringify({ note_id: noteId, regenerate: regenerate })
     });
     return await response.json();
 }
 
+export async function getJobStatus(jobId) {
+    const response = await fetch(`${BaseURL}BACKEND/jobStatus.php?job_id=${jobId}`, {
+        method: 'GET',
+        credentials: 'include'
+    });
+    return await response.json();
+}
+
+// Poll a queued summary/quiz job until it finishes; resolves with its result
+export async function waitForJob(jobId, { interval = 2000, timeout = 600000 } = {}) {
+    const deadline = Date.now() + timeout;
+    while (Date.now() < deadline) {
+        const status = await getJobStatus(jobId);
+        if (!status.success) {
+            return { success: false, message: status.message };
+        }
+        if (status.job.status === 'completed') {
+            return status.job.result;
+        }
+        if (status.job.status === 'failed') {
+            return { success: false, message: status.job.error || 'Generation failed' };
+        }
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+    return { success: false, message: 'Timed out waiting for generation to finish' };
+}
+
+export async function getExtractionStatus(noteId) {
+    const response = await fetch(`${BaseURL}BACKEND/extractionStatus.php?note_id=${noteId}`, {
+        method: 'GET',
+        credentials: 'include'
+    });
+    return await response.json();
+}
+
+// Poll a PDF note's background text extraction until it finishes; resolves with its status
+export async function waitForExtraction(noteId, { interval = 2000, timeout = 600000 } = {}) {
+    const deadline = Date.now() + timeout;
+    while (Date.now() < deadline) {
+        const status = await getExtractionStatus(noteId);
+        if (!status.success) {
+            return { success: false, message: status.message };
+        }
+        if (status.extraction.status === 'completed') {
+            return { success: true, extraction: status.extraction };
+        }
+        if (status.extraction.status === 'failed') {
+            return { success: false, message: status.extraction.error || 'Text extraction failed' };
+        }
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+    return { success: false, message: 'Timed out waiting for text extraction to finish' };
+}
+
 export async function startChat(noteId) {
     const response = await fetch(`${BaseURL}BACKEND/startChat.php`, {
         method: 'POST',
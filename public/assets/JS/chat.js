@@ -199,18 +199,42 @@ async function sendMessage() {
             credentials: 'include',
             body: JSON.stringify({
                 conversation_id: currentConversationId,
-                message: message
+                message: message,
+                stream: true
             })
         });
 
-        const result = await response.json();
-
-        if (result.success) {
-            // Display AI response
-            displayMessage(result.ai_message);
-        } else {
+        // Errors raised before streaming starts still come back as plain JSON
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!contentType.includes('text/event-stream')) {
+            const result = await response.json();
             alert('Failed to send message: ' + (result.message || 'Unknown error'));
+            return;
         }
+
+        // Show the AI response as it streams in
+        let streamingDiv = null;
+        let streamedText = '';
+
+        await readEventStream(response, (event, data) => {
+            if (event === 'token') {
+                if (!streamingDiv) {
+                    hideTypingIndicator();
+                    streamingDiv = displayMessage({ role: 'assistant', content: '' });
+                }
+                streamedText += data.content;
+                streamingDiv.querySelector('.message-content').textContent = streamedText;
+                scrollToBottom();
+            } else if (event === 'done') {
+                if (streamingDiv) {
+                    streamingDiv.querySelector('.message-content').textContent = data.ai_message.content;
+                } else {
+                    displayMessage(data.ai_message);
+                }
+            } else if (event === 'error') {
+                alert('Failed to send message: ' + (data.message || 'Unknown error'));
+            }
+        });
     } catch (error) {
         console.error('Error sending message:', error);
         alert('Failed to send message. Please try again.');
@@ -223,6 +247,33 @@ async function sendMessage() {
     }
 }
 
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            for (const line of block.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            if (data) onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
 function displayMessage(message) {
     if (!chatMessages) return; // Guard against null DOM elements
 
@@ -241,6 +292,7 @@ function displayMessage(message) {
 
     chatMessages.appendChild(messageDiv);
     scrollToBottom();
+    return messageDiv;
 }
 
 function escapeHtml(text) {
@@ -1,4 +1,4 @@
-import { getQuizzes, generateQuiz } from './api.js';
+import { getQuizzes, generateQuiz, waitForJob, waitForExtraction } from './api.js';
 
 // Quiz data - will be loaded from API
 let quizData = [];
@@ -79,7 +79,17 @@ async function generateQuizForNote() {
     document.querySelector('.generate-btn').disabled = true;
 
     try {
-        const response = await generateQuiz(noteId);
+        // A freshly uploaded PDF may still be extracted in the background. Give it a
+        // short while, then generate anyway: the backend extracts on demand when the
+        // ingestion service is not running or failed
+        await waitForExtraction(noteId, { timeout: 30000 });
+
+        let response = await generateQuiz(noteId);
+
+        // Generation runs in the job queue; wait for it to finish
+        if (response.success && response.job_id) {
+            response = await waitForJob(response.job_id);
+        }
 
         if (response.success && response.quiz) {
             // Hide the generate section and show success message
@@ -108,7 +118,12 @@ async function regenerateQuiz() {
     regenerateBtn.innerHTML = 'Regenerating...';
 
     try {
-        const response = await generateQuiz(noteId);
+        let response = await generateQuiz(noteId, true);
+
+        // Generation runs in the job queue; wait for it to finish
+        if (response.success && response.job_id) {
+            response = await waitForJob(response.job_id);
+        }
 
         if (response.success && response.quiz) {
             // Reload the quiz data and refresh the page display
@@ -1,5 +1,5 @@
 // Summary page functionality
-import { getSummaries, generateSummary } from '../JS/api.js';
+import { getSummaries, generateSummary, waitForJob, waitForExtraction } from '../JS/api.js';
 
 // Function to download summary as PDF
 function downloadSummary() {
@@ -78,10 +78,21 @@ async function handleGenerateSummary(noteId) {
     const summaryContent = document.getElementById('summaryContent');
 
     generateBtn.disabled = true;
-    generateBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Generating...';
+    generateBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Extracting text...';
 
     try {
-        const result = await generateSummary(noteId);
+        // A freshly uploaded PDF may still be extracted in the background. Give it a
+        // short while, then generate anyway: the backend extracts on demand when the
+        // ingestion service is not running or failed
+        await waitForExtraction(noteId, { timeout: 30000 });
+        generateBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Generating...';
+
+        let result = await generateSummary(noteId);
+
+        // Generation runs in the job queue; wait for it to finish
+        if (result.success && result.job_id) {
+            result = await waitForJob(result.job_id);
+        }
 
         if (result.success) {
             // Reload page to fetch the newly generated summary from DB
@@ -0,0 +1,332 @@
+"""
+Question bank for quizzes.
+
+Instead of asking the model for exactly 10 questions in one call, questions
+are generated section by section, validated one at a time and stored in the
+question_bank table under the document's content hash. A quiz is then a
+random sample from the bank, so new quizzes and regenerations are database
+reads once the bank is filled, and a malformed response only loses the
+questions that were actually broken.
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import app_log
+import chunk_index
+import db
+import llm_router
+import metrics
+
+logger = app_log.get_logger('QUESTION_BANK')
+activity_log = logger.info
+error_log = logger.error
+
+QUIZ_SIZE = int(os.getenv('QUIZ_SIZE', '10'))
+QUIZ_BANK_TARGET = int(os.getenv('QUIZ_BANK_TARGET', '30'))         # questions to have banked per document
+QUIZ_SECTION_CHARS = int(os.getenv('QUIZ_SECTION_CHARS', '8000'))
+QUIZ_QUESTIONS_PER_SECTION = int(os.getenv('QUIZ_QUESTIONS_PER_SECTION', '5'))
+QUIZ_MAX_PARALLEL = int(os.getenv('QUIZ_MAX_PARALLEL', '4'))
+QUIZ_PROVIDER = 'openrouter'
+QUIZ_MODEL = "gpt-4o-mini"  # Using a cost-effective model via OpenRouter
+QUIZ_ROUTE = llm_router.route('quiz', f"{QUIZ_PROVIDER}:{QUIZ_MODEL}")  # LLM_QUIZ_ROUTE, see llm_router
+
+LETTERS = ('A', 'B', 'C', 'D')
+CORRECT_RE = re.compile(r"^\(?([A-Da-d])[\).:]?$")
+
+
+def text_hash(text):
+    """SHA-256 of a text, used for section and question keys."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# ---------- Parsing and validation ----------
+
+def validate_question(item):
+    """Return the question in canonical form, or None if it is unusable."""
+    if not isinstance(item, dict):
+        return None
+    question = str(item.get('question') or '').strip()
+    options = item.get('options')
+    if not question or not isinstance(options, list) or len(options) != 4:
+        return None
+    options = [str(option).strip() for option in options]
+    if not all(options) or len(set(options)) != 4:
+        return None
+
+    correct = str(item.get('correct') or '').strip()
+    match = CORRECT_RE.match(correct)
+    if match:
+        letter = match.group(1).upper()
+    elif correct in options:
+        # Some responses give the answer text instead of its letter
+        letter = LETTERS[options.index(correct)]
+    else:
+        return None
+    return {"question": question, "options": options, "correct": letter}
+
+
+def _json_objects(raw):
+    """Yield every top-level JSON object that can be decoded from raw text."""
+    decoder = json.JSONDecoder()
+    position = raw.find('{')
+    while position != -1:
+        try:
+            item, end = decoder.raw_decode(raw, position)
+        except json.JSONDecodeError:
+            position = raw.find('{', position + 1)
+            continue
+        yield item
+        position = raw.find('{', end)
+
+
+def parse_questions(raw):
+    """Parse a model response into valid questions, keeping the good ones on errors.
+
+    Returns (questions, rejected_count).
+    """
+    raw = raw.strip()
+    if raw.startswith('```'):
+        raw = re.sub(r"^```(?:json)?\s*|\s*```$", "", raw)
+
+    try:
+        items = json.loads(raw)
+        if isinstance(items, dict):
+            items = items.get('questions', [items])
+    except json.JSONDecodeError:
+        # Truncated or malformed array: salvage the objects that do parse
+        items = list(_json_objects(raw))
+
+    if not isinstance(items, list):
+        return [], 0
+    questions = [q for q in (validate_question(item) for item in items) if q]
+    return questions, len(items) - len(questions)
+
+
+# ---------- Generation ----------
+
+QUIZ_INSTRUCTIONS = """You write multiple-choice questions (MCQs) about sections of a document. Each question should have:
+- One correct answer
+- Three incorrect options
+- Questions should test key concepts from the content
+
+Return ONLY valid JSON array in this exact format (no markdown, no code blocks, no extra text):
+
+[
+    {
+        "question": "Question text here?",
+        "options": ["Option A", "Option B", "Option C", "Option D"],
+        "correct": "A"
+    }
+]"""
+
+
+def generate_section_questions(number, total, section, count, avoid=()):
+    """Ask the model for questions about one section.
+
+    Returns (valid_questions, rejected_count, model), model being the one that answered.
+
+    The instructions and the section form a prefix that is the same every
+    time the section is asked about, so topping up its questions hits the
+    provider's prompt cache; the count and questions to avoid come after.
+    """
+    avoid_text = ""
+    if avoid:
+        avoid_text = "\nDo not repeat these existing questions:\n" + "\n".join(f"- {q}" for q in avoid)
+
+    messages = [
+        {"role": "system", "content": QUIZ_INSTRUCTIONS},
+        {"role": "user", "content": f"Section {number} of {total} of the document:\n{section}", "cache": True},
+        {"role": "user", "content": f"Generate {count} multiple-choice questions based on the section above.{avoid_text}"},
+    ]
+    candidate, raw = llm_router.complete_sync(
+        QUIZ_ROUTE,
+        messages,
+        max_tokens=300 * count,
+        temperature=0.7
+    )
+    questions, rejected = parse_questions(raw)
+    return questions, rejected, candidate.model
+
+
+def spread_order(n):
+    """Section indices ordered so that any prefix covers the document evenly."""
+    return sorted(range(n), key=lambda i: (i * 0.6180339887) % 1)
+
+
+# ---------- Storage ----------
+
+def bank_size(content_hash):
+    """Number of questions banked for a document."""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM question_bank WHERE content_hash = %s", (content_hash,))
+        (count,) = cursor.fetchone()
+        cursor.close()
+    return count
+
+
+def section_counts(content_hash):
+    """Banked questions per section as {section_key: count}."""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT section_key, COUNT(*) FROM question_bank WHERE content_hash = %s GROUP BY section_key",
+            (content_hash,)
+        )
+        counts = dict(cursor.fetchall())
+        cursor.close()
+    return counts
+
+
+def section_questions(content_hash, section_key):
+    """Question texts already banked for one section."""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT question FROM question_bank WHERE content_hash = %s AND section_key = %s",
+            (content_hash, section_key)
+        )
+        questions = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    return questions
+
+
+def store_questions(content_hash, section_key, section_number, questions, ai_model=QUIZ_MODEL):
+    """Add questions written by ai_model to the bank, skipping ones it already has."""
+    if not questions:
+        return 0
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            """
+            INSERT IGNORE INTO question_bank
+            (content_hash, section_key, section_number, question_hash, question, options, correct, ai_model)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            [(content_hash, section_key, section_number, text_hash(q['question'].lower()),
+              q['question'], json.dumps(q['options']), q['correct'], ai_model) for q in questions]
+        )
+        added = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return added
+
+
+# ---------- Filling and sampling ----------
+
+def _run_sections(content_hash, sections, keys, work):
+    """Generate questions for [(index, count, avoid), ...] in parallel, storing each as it finishes."""
+    added = 0
+    with ThreadPoolExecutor(max_workers=QUIZ_MAX_PARALLEL) as pool:
+        futures = {
+            pool.submit(app_log.in_request(generate_section_questions), i + 1, len(sections), sections[i], count, avoid): i
+            for i, count, avoid in work
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                questions, rejected, model = future.result()
+            except Exception as e:
+                # One failed section does not lose the others
+                error_log(f"Section {i + 1} question generation failed: {str(e)}")
+                continue
+            added += store_questions(content_hash, keys[i], i + 1, questions, model)
+            activity_log(f"Section {i + 1}: kept {len(questions)} questions, rejected {rejected}")
+    return added
+
+
+def fill(content_hash, text, target=None, grow=False):
+    """Generate questions for unbanked sections until the bank holds about target questions.
+
+    Sections that already have questions are asked for more when the bank is
+    still short of a quiz, or, with grow=True (regenerate), of target.
+    Returns the number of questions added.
+    """
+    target = target or QUIZ_BANK_TARGET
+    sections = [chunk for _, chunk in chunk_index.chunk_text(text, limit=QUIZ_SECTION_CHARS)]
+    if not sections:
+        return 0
+    keys = [text_hash(section) for section in sections]
+    counts = section_counts(content_hash)
+    have = sum(counts.values())
+
+    per_section = max(QUIZ_QUESTIONS_PER_SECTION, math.ceil(QUIZ_SIZE / len(sections)))
+    pending = [i for i in spread_order(len(sections)) if keys[i] not in counts]
+    needed = math.ceil(max(0, target - have) / per_section)
+    added = _run_sections(content_hash, sections, keys, [(i, per_section, ()) for i in pending[:needed]])
+    have += added
+
+    wanted = target if grow else QUIZ_SIZE
+    if have < wanted:
+        # Every section is banked (or the new ones were not enough): ask banked
+        # sections for more, starting with the ones that have the fewest
+        counts = section_counts(content_hash)
+        thinnest = sorted((i for i in range(len(sections)) if keys[i] in counts), key=lambda i: counts[keys[i]])
+        needed = math.ceil((wanted - have) / per_section)
+        work = [(i, per_section, section_questions(content_hash, keys[i])) for i in thinnest[:needed]]
+        added += _run_sections(content_hash, sections, keys, work)
+
+    return added
+
+
+def sample(content_hash, size=None):
+    """Draw a quiz from the bank, spreading questions across sections."""
+    size = size or QUIZ_SIZE
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT section_key, question, options, correct FROM question_bank WHERE content_hash = %s",
+            (content_hash,)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+
+    by_section = {}
+    for section_key, question, options, correct in rows:
+        if isinstance(options, (str, bytes)):
+            options = json.loads(options)
+        by_section.setdefault(section_key, []).append(
+            {"question": question, "options": options, "correct": correct}
+        )
+
+    groups = list(by_section.values())
+    random.shuffle(groups)
+    for group in groups:
+        random.shuffle(group)
+
+    chosen = []
+    while len(chosen) < size and any(groups):
+        for group in groups:
+            if group and len(chosen) < size:
+                chosen.append(group.pop())
+    return chosen
+
+
+def build_quiz(content_hash, load_text, refresh=False, size=None):
+    """Sample a quiz from the bank, filling the bank first when it is too small.
+
+    load_text is only called when questions have to be generated. With
+    refresh=True the bank is also topped up towards QUIZ_BANK_TARGET, asking
+    sections that already have questions for new ones, so regenerated
+    quizzes have more to choose from.
+    """
+    size = size or QUIZ_SIZE
+    have = bank_size(content_hash)
+    grow = refresh and have < QUIZ_BANK_TARGET
+    # The text (which may mean parsing the PDF) is only loaded when fill() will generate
+    if have < size or grow:
+        text = load_text()
+        with metrics.span('quiz_fill'):
+            fill(content_hash, text, grow=grow)
+
+    with metrics.span('quiz_sample'):
+        questions = sample(content_hash, size)
+    if len(questions) < size:
+        raise ValueError(f"Only {len(questions)} valid questions could be generated")
+    return questions
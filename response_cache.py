@@ -0,0 +1,166 @@
+"""
+Local exact-match cache for LLM responses.
+
+Responses are stored in a SQLite file keyed by provider, model, the
+whitespace-normalized messages and the generation parameters. The cache is
+bounded by total size (least recently used entries are evicted first) and
+entries expire after LLM_CACHE_TTL seconds. Hit and miss counts are kept in
+the same file so they cover every process that uses it.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', '1') != '0'
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cache', 'llm_responses.sqlite3'
+)
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600)))  # seconds, 0 = never expire
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', str(100 * 1024 * 1024)))
+
+# Check the size bound after this many stores rather than on every one
+EVICT_EVERY = 50
+
+_local = threading.local()
+_stores = 0
+_stores_lock = threading.Lock()
+
+
+def _connect():
+    """One SQLite connection per thread."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(LLM_CACHE_PATH), exist_ok=True)
+        conn = sqlite3.connect(LLM_CACHE_PATH, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                cache_key TEXT PRIMARY KEY,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON responses (last_used)")
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        _local.conn = conn
+    return conn
+
+
+def normalize(text):
+    """Collapse runs of whitespace so formatting-only differences share an entry."""
+    return " ".join(str(text).split())
+
+
+def cache_key(provider, model, messages, params):
+    """Key for a request: provider, model, normalized messages and parameters."""
+    payload = json.dumps({
+        "provider": provider,
+        "model": model,
+        "messages": [{"role": m['role'], "content": normalize(m['content'])} for m in messages],
+        "params": params,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _count(conn, name):
+    conn.execute(
+        "INSERT INTO counters (name, value) VALUES (?, 1) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+        (name,)
+    )
+
+
+def get(provider, model, messages, params):
+    """Return the cached response text, or None on a miss."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    key = cache_key(provider, model, messages, params)
+    now = time.time()
+    conn = _connect()
+    row = conn.execute("SELECT response, created_at FROM responses WHERE cache_key = ?", (key,)).fetchone()
+
+    if row and LLM_CACHE_TTL and now - row[1] > LLM_CACHE_TTL:
+        conn.execute("DELETE FROM responses WHERE cache_key = ?", (key,))
+        row = None
+
+    if row is None:
+        _count(conn, f"{provider}:misses")
+        return None
+
+    conn.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE cache_key = ?", (now, key))
+    _count(conn, f"{provider}:hits")
+    return row[0]
+
+
+def put(provider, model, messages, params, response):
+    """Store a response, replacing any previous entry for the same request."""
+    global _stores
+    if not LLM_CACHE_ENABLED or not response:
+        return
+    now = time.time()
+    conn = _connect()
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO responses (cache_key, provider, model, response, size, created_at, last_used, hits)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+        """,
+        (cache_key(provider, model, messages, params), provider, model, response,
+         len(response.encode('utf-8')), now, now)
+    )
+
+    with _stores_lock:
+        _stores += 1
+        due = _stores % EVICT_EVERY == 1
+    if due:
+        evict()
+
+
+def evict():
+    """Drop expired entries, then least recently used ones until under the size bound."""
+    conn = _connect()
+    removed = 0
+    if LLM_CACHE_TTL:
+        removed += conn.execute("DELETE FROM responses WHERE created_at < ?",
+                                (time.time() - LLM_CACHE_TTL,)).rowcount
+
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total > LLM_CACHE_MAX_BYTES:
+        excess = total - LLM_CACHE_MAX_BYTES
+        doomed = []
+        for key, size in conn.execute("SELECT cache_key, size FROM responses ORDER BY last_used"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM responses WHERE cache_key = ?", doomed)
+        removed += len(doomed)
+    return removed
+
+
+def stats():
+    """Hit/miss counters per provider plus the cache's current size."""
+    conn = _connect()
+    counters = dict(conn.execute("SELECT name, value FROM counters"))
+    entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    providers = {}
+    for name, value in counters.items():
+        provider, kind = name.rsplit(':', 1)
+        providers.setdefault(provider, {"hits": 0, "misses": 0})[kind] = value
+    return {"entries": entries, "bytes": size, "providers": providers}
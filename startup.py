@@ -0,0 +1,128 @@
+"""
+Startup timing for the CLI scripts.
+
+PHP spawns a fresh interpreter for every request the worker does not take,
+so import time is paid on each call. The scripts import what only some
+modes need inside the functions that use it, and check their settings per
+mode instead of at import.
+
+Each script calls begin() before its other imports and ready() when it
+starts on the request. Startup (the time in between) over STARTUP_BUDGET_MS
+is logged as a warning. With --startup-profile on the command line every
+import statement that loads new modules is timed too, and a report of the
+slowest ones is printed to stderr when the process exits:
+
+    py summary_generator.py quiz 12 3 --startup-profile
+"""
+
+import atexit
+import builtins
+import os
+import sys
+import threading
+import time
+
+STARTUP_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', '150'))
+STARTUP_PROFILE_TOP = int(os.getenv('STARTUP_PROFILE_TOP', '15'))  # imports listed in the report
+
+_script = None
+_began = None
+_ready = None
+_modules_at_begin = 0
+_original_import = None
+_main_thread = None
+_imports = {}  # import name -> [cumulative seconds, self seconds]
+_stack = []    # time spent in nested imports, per import being timed
+
+
+def begin(script):
+    """Mark the start of a CLI script; enables profiling for --startup-profile."""
+    global _script, _began, _modules_at_begin
+    _script = script
+    _began = time.perf_counter()
+    _modules_at_begin = len(sys.modules)
+    if '--startup-profile' in sys.argv:
+        sys.argv.remove('--startup-profile')
+        _start_profile()
+
+
+def ready():
+    """Mark the end of startup. Returns the startup time in milliseconds."""
+    global _ready
+    if _began is None or _ready is not None:
+        return None
+    _ready = time.perf_counter()
+    elapsed = (_ready - _began) * 1000
+    if elapsed > STARTUP_BUDGET_MS:
+        import app_log
+        app_log.get_logger('STARTUP').warning(
+            f"{_script} took {elapsed:.0f} ms to start (budget {STARTUP_BUDGET_MS:g} ms)",
+            startup_ms=round(elapsed, 1)
+        )
+    return elapsed
+
+
+def _start_profile():
+    global _original_import, _main_thread
+    _original_import = builtins.__import__
+    _main_thread = threading.get_ident()
+    builtins.__import__ = _timed_import
+    atexit.register(_report)
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # Imports of loaded modules and imports from other threads pass straight through
+    if (level == 0 and not fromlist and name in sys.modules) or threading.get_ident() != _main_thread:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    loaded = len(sys.modules)
+    _stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        if len(sys.modules) > loaded:
+            if level:
+                package = ((globals or {}).get('__package__') or '').rsplit('.', level - 1)[0]
+                name = f"{package}.{name}" if name else package
+            timing = _imports.setdefault(name, [0.0, 0.0])
+            timing[0] += elapsed
+            timing[1] += elapsed - nested
+
+
+def profile():
+    """The startup profile as a dict (times in milliseconds)."""
+    now = time.perf_counter()
+    slowest = sorted(_imports.items(), key=lambda item: item[1][0], reverse=True)[:STARTUP_PROFILE_TOP]
+    return {
+        "script": _script,
+        "ready_ms": round((_ready - _began) * 1000, 1) if _ready is not None else None,
+        "budget_ms": STARTUP_BUDGET_MS,
+        "exit_ms": round((now - _began) * 1000, 1),
+        "modules_loaded": len(sys.modules) - _modules_at_begin,
+        "imports": [{"module": name, "cumulative_ms": round(total * 1000, 1), "self_ms": round(own * 1000, 1)}
+                    for name, (total, own) in slowest]
+    }
+
+
+def _report():
+    report = profile()
+    if report["ready_ms"] is None:
+        # The request went to the study worker (or failed) before ready()
+        ready_line = "not reached (handled by the worker or exited early)"
+    else:
+        verdict = "over" if report["ready_ms"] > report["budget_ms"] else "within"
+        ready_line = f"{report['ready_ms']:.1f} ms, {verdict} the {report['budget_ms']:g} ms budget"
+    lines = [
+        f"startup profile for {report['script']}",
+        f"  startup: {ready_line}",
+        f"  modules loaded: {report['modules_loaded']}",
+        f"  process exit: {report['exit_ms']:.1f} ms",
+        "  slowest imports (cumulative / self ms):",
+    ]
+    lines += [f"  {entry['cumulative_ms']:9.1f} {entry['self_ms']:9.1f}  {entry['module']}" for entry in report["imports"]]
+    print("\n".join(lines), file=sys.stderr, flush=True)
@@ -0,0 +1,178 @@
+"""
+Long-lived local worker for the AI Study Helper.
+
+Imports the SDKs and reads .env once, keeps the API clients in llm_providers
+alive, then serves chat, summary, quiz and extraction requests over localhost
+HTTP so the PHP backend does not have to start a new Python interpreter for
+every call. GET /health reports status (with the latency and error
+statistics of the LLM routes) and GET /metrics serves counters and stage
+latency histograms in the Prometheus text format.
+
+Usage: py study_worker.py [--host 127.0.0.1] [--port 8765]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Modules resolve relative paths such as uploads/ against the project root
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import app_log
+import chat_response
+import content_extractor
+import llm_router
+import metrics
+import response_cache
+import summary_generator
+from worker_client import WORKER_HOST, WORKER_PORT
+
+MAX_CONCURRENCY = int(os.getenv('WORKER_MAX_CONCURRENCY', '8'))
+
+OPERATIONS = {
+    'generate_chat_response': lambda p: chat_response.generate_chat_response(p['context'], p['user_message']),
+    'generate_summary': lambda p: summary_generator.generate_summary(p['note_id'], p['user_id'], p.get('refresh', False)),
+    'generate_quiz': lambda p: summary_generator.generate_quiz(p['note_id'], p['user_id'], p.get('refresh', False)),
+    'extract_and_store_content': lambda p: content_extractor.extract_and_store_content(p['note_id']),
+}
+
+# Operations that yield events, relayed as newline-delimited JSON
+STREAM_OPERATIONS = {
+    'generate_chat_response_stream': lambda p: chat_response.generate_chat_response_stream(p['context'], p['user_message']),
+}
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+logger = app_log.get_logger('WORKER')
+
+
+class WorkerHandler(BaseHTTPRequestHandler):
+    """Handle one JSON operation per POST request."""
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status, text, content_type='text/plain; version=0.0.4; charset=utf-8'):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.strip('/') == 'metrics':
+            # Prometheus text format
+            self._send_text(200, metrics.render())
+        elif self.path.strip('/') == 'health':
+            self._send_json(200, {
+                "success": True,
+                "operations": sorted(OPERATIONS) + sorted(STREAM_OPERATIONS),
+                "llm_cache": response_cache.stats(),
+                "llm_routes": llm_router.status()
+            })
+        else:
+            self._send_json(404, {"success": False, "message": "Not found"})
+
+    def do_POST(self):
+        name = self.path.strip('/')
+        operation = OPERATIONS.get(name) or STREAM_OPERATIONS.get(name)
+        if operation is None:
+            self._send_json(404, {"success": False, "message": f"Unknown operation: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {"success": False, "message": f"Invalid request body: {str(e)}"})
+            return
+
+        # Log lines from this request carry the caller's request id
+        with app_log.request_context(self.headers.get('X-Request-Id')):
+            if name in STREAM_OPERATIONS:
+                self._stream_events(operation, params)
+            else:
+                self._run_operation(operation, params)
+
+    def _run_operation(self, operation, params):
+        with _slots:
+            try:
+                result = operation(params)
+            except KeyError as e:
+                result = {"success": False, "message": f"Missing parameter: {e.args[0]}"}
+            except Exception as e:
+                logger.error(f"Worker operation {self.path} failed: {str(e)}")
+                result = {"success": False, "message": f"Worker error: {str(e)}"}
+
+        if not isinstance(result, dict):
+            result = {"success": False, "message": f"Unexpected result type: {type(result).__name__}"}
+
+        self._send_json(200, result)
+
+    def _stream_events(self, operation, params):
+        """Write each event as one JSON line; the body ends when the connection closes."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.end_headers()
+
+        with _slots:
+            try:
+                for event in operation(params):
+                    self.wfile.write(json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n')
+                    self.wfile.flush()
+            except KeyError as e:
+                self._write_error_event(f"Missing parameter: {e.args[0]}")
+            except (BrokenPipeError, ConnectionResetError):
+                logger.info(f"Client disconnected from {self.path}")
+            except Exception as e:
+                # End the stream with an error event, so the client does not
+                # take the pieces so far for the whole answer
+                logger.error(f"Worker stream {self.path} failed: {str(e)}")
+                self._write_error_event(f"Worker error: {str(e)}")
+
+    def _write_error_event(self, message):
+        event = {"type": "error", "success": False, "message": message}
+        try:
+            self.wfile.write(json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.wfile.flush()
+        except OSError:
+            logger.info(f"Client disconnected from {self.path}")
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+def main():
+    """Start the worker and serve until interrupted."""
+    if sys.stderr.encoding != 'utf-8':
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+    parser = argparse.ArgumentParser(description="AI Study Helper worker")
+    parser.add_argument('--host', default=WORKER_HOST)
+    parser.add_argument('--port', type=int, default=WORKER_PORT)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), WorkerHandler)
+    server.daemon_threads = True
+    logger.info(f"Study worker listening on {args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
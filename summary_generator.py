@@ -1,182 +1,168 @@
-import google.generativeai as genai
-from PyPDF2 import PdfReader
-import mysql.connector
 import os
 import sys
 import json
-from dotenv import load_dotenv
-from openai import OpenAI
-from datetime import datetime
+import hashlib
+import startup
 
-def get_log_timestamp():
-    """Get current timestamp for logging."""
-    return datetime.now().strftime('%d-%b-%Y %H:%M:%S %Z')
+if __name__ == "__main__":
+    startup.begin("summary_generator")
+    # Hand the request to the long-lived worker when one is running
+    import worker_client
+    worker_client.forward_cli("summary_generator", sys.argv[1:])
 
-def activity_log(*args, **kwargs):
-    """Log activity messages to activity.log."""
-    try:
-        timestamp = get_log_timestamp()
-        with open('LOGS/activity.log', 'a', encoding='utf-8') as f:
-            print(f"[{timestamp}]", *args, file=f, **kwargs)
-        # Also print to stderr for server logs
-        print("[ACTIVITY]", *args, file=sys.stderr, **kwargs)
-    except Exception:
-        # Fallback if file logging fails
-        print("[ACTIVITY]", *args, file=sys.stderr, **kwargs)
-
-def error_log(*args, **kwargs):
-    """Log error messages to stderr (goes to error.log via server)."""
-    timestamp = get_log_timestamp()
-    print(f"[{timestamp}] [ERROR]", *args, file=sys.stderr, **kwargs)
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import app_log
+import chunk_index
+import content_index
+import db
+import llm_providers
+import llm_router
+import metrics
+import pdf_text
+
+logger = app_log.get_logger('SUMMARY')
+activity_log = logger.info
+error_log = logger.error
 
 # Load environment variables from .env file
 load_dotenv()
 
 # ---------- CONFIG ----------
-# API Keys
-API_KEY = os.getenv('GEMINI_API_KEY')
-OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY1')
-
-# Database configuration
+# Map-reduce summarization for long documents
+SUMMARY_MODEL = "gemini-2.5-flash"
+# Provider:model pairs that may write summaries (LLM_SUMMARY_ROUTE), see llm_router
+SUMMARY_ROUTE = llm_router.route('summary', f"gemini:{SUMMARY_MODEL}")
+SUMMARY_SINGLE_PASS_CHARS = int(os.getenv('SUMMARY_SINGLE_PASS_CHARS', '60000'))  # longer texts are chunked
+SUMMARY_CHUNK_CHARS = int(os.getenv('SUMMARY_CHUNK_CHARS', '30000'))
+SUMMARY_MAX_PARALLEL = int(os.getenv('SUMMARY_MAX_PARALLEL', '4'))
+
+# Database configuration (connections come from the shared pool in db.py)
 DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASS')
 DB_NAME = os.getenv('DB_NAME')
+DB_VARS = {'DB_USER': DB_USER, 'DB_PASSWORD': DB_PASSWORD, 'DB_NAME': DB_NAME}
 
-# Validate required environment variables
-required_vars = {
-    'GEMINI_API_KEY': API_KEY,
-    'OPENROUTER_API_KEY': OPENROUTER_API_KEY,
-    'DB_USER': DB_USER,
-    'DB_PASSWORD': DB_PASSWORD,
-    'DB_NAME': DB_NAME
-}
-
-missing_vars = [name for name, value in required_vars.items() if not value]
-if missing_vars:
-    error_log(f"Missing required environment variables: {', '.join(missing_vars)}")
-    sys.exit(1)
-
-activity_log("Configuration loaded from environment variables")
-
-# Initialize OpenRouter client
-try:
-    openai_client = OpenAI(
-        api_key=OPENROUTER_API_KEY,
-        base_url="https://openrouter.ai/api/v1"
-    )
-    activity_log("OpenAI client initialized successfully")
-except Exception as e:
-    error_log(f"Failed to initialize OpenAI client: {str(e)}")
-    sys.exit(1)
+# Gemini and OpenRouter clients are created once, on first use, in llm_providers
 # ----------------------------
 
-def get_db_connection():
-    """Create and return a database connection."""
-    return mysql.connector.connect(
-        host=DB_HOST,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME
-    )
+def mode_route(mode):
+    """The LLM route a mode calls."""
+    if mode == 'quiz':
+        import question_bank
+        return question_bank.QUIZ_ROUTE
+    return SUMMARY_ROUTE
+
+def check_config(mode):
+    """Return an error result if an environment variable the mode needs is missing, else None.
+
+    Checked when the mode runs, and only for the API keys of the providers on
+    the mode's route, so a quiz does not fail for a missing Gemini key.
+    """
+    required = {name: os.getenv(name) for name in llm_providers.required_keys(mode_route(mode).candidates)}
+    required.update(DB_VARS)
+    missing_vars = [name for name, value in required.items() if not value]
+    if not missing_vars:
+        return None
+    message = f"Missing required environment variables: {', '.join(missing_vars)}"
+    error_log(message)
+    return {"success": False, "message": message}
+
+# Fixed instructions go first (as the system instruction) and the document
+# after them, so the prompt prefix is identical for every call of a kind
+SUMMARY_INSTRUCTIONS = "Summarize the document you are given in concise points."
+SECTION_INSTRUCTIONS = (
+    "You are given one section of a longer document. "
+    "Summarize this section in concise points, keeping key terms, definitions and figures."
+)
+MERGE_INSTRUCTIONS = (
+    "You are given summaries of consecutive sections of one document. "
+    "Combine them into a single concise point-wise summary of the whole document, "
+    "removing repetition and keeping the document's order."
+)
+
+def call_summary_model(instructions, content, refresh=False):
+    """Send instructions and content to the summary route and return (model, text).
+
+    model is the one that answered, which need not be the first on the route.
+    """
+    messages = [{"role": "system", "content": instructions}, {"role": "user", "content": content, "cache": True}]
+    candidate, text = llm_router.complete_sync(SUMMARY_ROUTE, messages, refresh=refresh)
+    return candidate.model, text
+
+def summarize_text_with_gemini(text, refresh=False):
+    """Send text to Gemini model and get (model, summary), map-reducing long documents."""
+    if len(text) > SUMMARY_SINGLE_PASS_CHARS:
+        return map_reduce_summarize(text, refresh=refresh)
+
+    return call_summary_model(SUMMARY_INSTRUCTIONS, text, refresh)
+
+def chunk_summary_key(model, chunk):
+    """Cache key for the summary of one chunk written by model."""
+    return hashlib.sha256(f"{model}\n{chunk}".encode('utf-8')).hexdigest()
+
+def summarize_chunk(number, total, chunk, refresh=False):
+    """Summarize one section of a long document, as (model, summary)."""
+    return call_summary_model(SECTION_INSTRUCTIONS, f"Section {number} of {total}:\n\n{chunk}", refresh)
+
+def map_reduce_summarize(text, depth=0, refresh=False):
+    """Summarize a long document section by section, then merge the section summaries.
+
+    Sections are summarized concurrently (at most SUMMARY_MAX_PARALLEL at once)
+    and each section summary is cached by content, so regenerating or extending
+    a document only pays for sections that changed. A section summary is
+    cached under the model that wrote it, and one from any model on the route
+    is reused, best first. refresh=True ignores the cached sections.
+    """
+    chunks = [chunk for _, chunk in chunk_index.chunk_text(text, limit=SUMMARY_CHUNK_CHARS)]
+    models = list(dict.fromkeys(candidate.model for candidate in SUMMARY_ROUTE.candidates))
+    keys = [[chunk_summary_key(model, chunk) for model in models] for chunk in chunks]
 
-def extract_text_from_pdf(pdf_path):
-    """Extract all text from a PDF."""
-    activity_log(f"Extracting text from PDF: {pdf_path}")
     try:
-        with open(pdf_path, "rb") as file:
-            reader = PdfReader(file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() or ""
-            activity_log(f"Extracted {len(text)} characters from PDF")
-            return text.strip()
+        cached = {} if refresh else db.get_chunk_summaries([key for chunk_keys in keys for key in chunk_keys])
     except Exception as e:
-        error_log(f"Error extracting text from PDF: {str(e)}")
-        raise
-
-def summarize_text_with_gemini(text):
-    """Send text to Gemini model and get a summary."""
-    genai.configure(api_key=API_KEY)
-    model = genai.GenerativeModel("gemini-2.5-flash")
-
-    prompt = f"Summarize the following document in concise points:\n\n{text}"
-    response = model.generate_content(prompt)
-    return response.text
-
-def generate_quiz_with_openai(text):
-    """Send text to OpenRouter API and get 10 MCQ questions."""
-    prompt = f"""Generate 10 multiple-choice questions (MCQs) based on the following document. Each question should have:
-- One correct answer
-- Three incorrect options
-- Questions should test key concepts from the content
-
-Return ONLY valid JSON array in this exact format (no markdown, no code blocks, no extra text):
-
-[
-    {{
-        "question": "Question text here?",
-        "options": ["Option A", "Option B", "Option C", "Option D"],
-        "correct": "A"
-    }},
-    ... (9 more questions)
-]
-
-Document content:
-{text}
-"""
+        error_log(f"Error reading chunk summary cache: {str(e)}")
+        cached = {}
+
+    summaries = {}
+    for i, chunk_keys in enumerate(keys):
+        found = [cached[key] for key in chunk_keys if key in cached]
+        if found:
+            summaries[i] = found[0]
+
+    missing = [i for i in range(len(chunks)) if i not in summaries]
+    activity_log(f"Map-reduce summary: {len(chunks)} sections, {len(chunks) - len(missing)} cached, "
+                 f"{len(missing)} to summarize with up to {SUMMARY_MAX_PARALLEL} in parallel")
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=SUMMARY_MAX_PARALLEL) as pool:
+            futures = {pool.submit(app_log.in_request(summarize_chunk), i + 1, len(chunks), chunks[i], refresh): i for i in missing}
+            for future in as_completed(futures):
+                i = futures[future]
+                model, summary = future.result()
+                summaries[i] = summary
+                try:
+                    # Store as each section finishes so a failed run keeps its progress
+                    db.save_chunk_summary(chunk_summary_key(model, chunks[i]), model, summary)
+                except Exception as e:
+                    error_log(f"Error caching chunk summary: {str(e)}")
+
+    section_summaries = "\n\n".join(
+        f"Section {i + 1}:\n{summaries[i]}" for i in range(len(chunks))
+    )
 
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",  # Using a cost-effective model via OpenRouter
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=2000,
-            temperature=0.7
-        )
-        quiz_json = response.choices[0].message.content.strip()
-
-        # Clean up any markdown formatting that might be present
-        if quiz_json.startswith('```json'):
-            quiz_json = quiz_json[7:-3]
-        elif quiz_json.startswith('```'):
-            quiz_json = quiz_json[3:-3]
-
-        # Try to parse the JSON
-        quiz_questions = json.loads(quiz_json)
-
-        # Validate the structure
-        if not isinstance(quiz_questions, list) or len(quiz_questions) != 10:
-            raise ValueError("Invalid quiz format: Expected list of 10 questions")
-
-        for i, question in enumerate(quiz_questions):
-            if not all(key in question for key in ['question', 'options', 'correct']):
-                raise ValueError(f"Question {i+1} missing required fields")
-            if not isinstance(question['options'], list) or len(question['options']) != 4:
-                raise ValueError(f"Question {i+1} should have 4 options")
-            if question['correct'] not in ['A', 'B', 'C', 'D']:
-                raise ValueError(f"Question {i+1} has invalid correct answer: {question['correct']}")
-
-        return quiz_questions
-    except json.JSONDecodeError as e:
-        error_log(f"JSON parsing error: {str(e)}")
-        error_log(f"Raw response: {quiz_json[:500]}...")
-        raise ValueError("Invalid JSON response from AI")
-    except Exception as e:
-        error_log(f"Error generating quiz: {str(e)}")
-        raise
+    # Merged section summaries can still be long for very large documents
+    if len(section_summaries) > SUMMARY_SINGLE_PASS_CHARS and depth < 2:
+        return map_reduce_summarize(section_summaries, depth + 1, refresh)
 
+    return call_summary_model(MERGE_INSTRUCTIONS, section_summaries, refresh)
 
 def get_note_content(note_id, user_id):
-    """Get note content from database."""
+    """Get a note with its stored extraction and content index entry from database."""
     try:
         activity_log(f"Attempting to fetch note_id={note_id} for user_id={user_id}")
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # First, check if the note exists and is accessible
-        query = "SELECT id, title, content, file_type, user_id FROM notes WHERE id = %s"
-        cursor.execute(query, (note_id,))
-        note = cursor.fetchone()
+        note = db.fetch_note_bundle(note_id)
 
         if not note:
             activity_log(f"Note with id={note_id} does not exist")
@@ -186,253 +172,227 @@ def get_note_content(note_id, user_id):
             activity_log(f"User {user_id} does not have access to note {note_id}")
             return None
 
-        activity_log(f"Found note: {note}")
+        activity_log(f"Found note {note_id}: {note['title']} ({note['file_type']})")
         return note
 
     except Exception as e:
         error_log(f"Database error in get_note_content: {str(e)}")
         return None
-    finally:
-        try:
-            if 'cursor' in locals():
-                cursor.close()
-            if 'conn' in locals() and conn.is_connected():
-                conn.close()
-        except Exception as e:
-            error_log(f"Error closing database connection: {str(e)}")
 
-def save_summary_to_db(note_id, user_id, summary_text, ai_model="gemini-2.5-flash"):
-    """Save summary to database."""
+def save_summary_to_db(note_id, user_id, summary_text, ai_model=SUMMARY_MODEL, content_hash=None):
+    """Save summary to database, indexing it under content_hash."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insert or update summary
-        query = """
-        INSERT INTO summaries (note_id, user_id, summary_text, ai_model)
-        VALUES (%s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-        summary_text = VALUES(summary_text),
-        created_at = NOW()
-        """
-
-        cursor.execute(query, (note_id, user_id, summary_text, ai_model))
-        conn.commit()
-
-        cursor.close()
-        conn.close()
-
+        db.save_summary(note_id, user_id, summary_text, ai_model, content_hash)
         return True
     except Exception as e:
+        error_log(f"Error saving summary: {str(e)}")
         return False
 
-def save_quiz_to_db(note_id, user_id, quiz_questions, note_title=None):
-    """Save quiz questions to database."""
+def save_quiz_to_db(note_id, user_id, quiz_questions, note_title=None, content_hash=None):
+    """Save quiz questions to database, indexing them under content_hash."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Convert to JSON string for storage
-        questions_json = json.dumps(quiz_questions)
-
-        # Insert or update quiz
-        query = """
-        INSERT INTO quizzes (note_id, user_id, questions, title)
-        VALUES (%s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-        questions = VALUES(questions),
-        title = VALUES(title),
-        created_at = NOW()
-        """
-
-        cursor.execute(query, (note_id, user_id, questions_json, note_title))
-        quiz_id = cursor.lastrowid
-        conn.commit()
-
-        cursor.close()
-        conn.close()
-
-        return quiz_id
+        return db.save_quiz(note_id, user_id, quiz_questions, note_title, content_hash)
     except Exception as e:
         error_log(f"Error saving quiz: {str(e)}")
         return False
 
-def generate_summary(note_id, user_id):
-    """Generate and save summary for a note."""
+def resolve_pdf_path(pdf_path):
+    """Resolve a stored /uploads/ path against the project directory."""
+    if os.path.isabs(pdf_path) and os.path.exists(pdf_path):
+        return pdf_path
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, pdf_path.lstrip('/'))
+
+def get_content_hash(note):
+    """Get a note's content hash, computing it for notes saved before hashing."""
+    if note.get('content_hash'):
+        return note['content_hash']
+    if note['file_type'] == 'PDF Document':
+        pdf_path = resolve_pdf_path(note['content'])
+        return content_index.hash_file(pdf_path) if os.path.exists(pdf_path) else None
+    return content_index.hash_text(note['content'] or '')
+
+def get_index_entry(note, content_hash):
+    """Get previously extracted text and generated outputs for identical content."""
+    if note.get('content_hash'):
+        # Already joined in by get_note_content
+        return note['index']
+    if not content_hash:
+        return None
     try:
-        # Get note details
+        with db.connection() as conn:
+            return content_index.get_entry(conn, content_hash)
+    except Exception as e:
+        error_log(f"Error reading content index: {str(e)}")
+        return None
+
+def get_note_text(note, indexed):
+    """Get the text of a note, preferring stored extractions over parsing the PDF.
+
+    Raises ValueError with a user-facing message when no text is available.
+    """
+    note_id = note['id']
+
+    if note['file_type'] != 'PDF Document':
+        text = note['content'] or ''
+        if not text.strip():
+            raise ValueError("Note content is empty")
+        return text
+
+    if note['extracted_text']:
+        activity_log(f"Using stored extracted content for note {note_id} ({len(note['extracted_text'])} characters)")
+        return note['extracted_text']
+
+    if indexed and indexed['extracted_text']:
+        activity_log(f"Using indexed extracted content for note {note_id} ({len(indexed['extracted_text'])} characters)")
+        return indexed['extracted_text']
+
+    # Fallback: extract on-demand
+    activity_log(f"No stored content found, extracting on-demand for note {note_id}")
+    full_path = resolve_pdf_path(note['content'])
+    activity_log(f"Processing PDF file: {full_path}")
+
+    if not os.path.exists(full_path):
+        raise ValueError(f"PDF file not found at: {full_path}")
+
+    import content_extractor
+    import extract_limits
+    # Parsed (and OCRed if scanned) in a child process under the per-document limits
+    text = pdf_text.join_pages(extract_limits.run(content_extractor.extract_note_pages, note_id, full_path))
+    if not text.strip():
+        raise ValueError("Extracted text from PDF is empty")
+
+    activity_log(f"Extracted {len(text)} characters from PDF on-demand")
+    return text
+
+def load_note_text(note, indexed):
+    """Wrap get_note_text() as (text, error_result)."""
+    try:
+        with metrics.span('note_text'):
+            return get_note_text(note, indexed), None
+    except ValueError as e:
+        error_log(str(e))
+        return None, {"success": False, "message": str(e)}
+    except Exception as e:
+        error_msg = f"Error accessing extracted content or processing PDF: {str(e)}"
+        error_log(error_msg)
+        return None, {"success": False, "message": error_msg}
+
+def finish_summary(note_id, user_id, summary, ai_model=SUMMARY_MODEL, content_hash=None):
+    """Save a summary for the note and build the result."""
+    if save_summary_to_db(note_id, user_id, summary, ai_model, content_hash):
+        return {
+            "success": True,
+            "summary": {
+                "content": summary,
+                "note_id": note_id,
+                "user_id": user_id,
+                "ai_model": ai_model
+            },
+            "message": "Summary generated successfully"
+        }
+    return {"success": False, "message": "Failed to save summary to database"}
+
+def finish_quiz(note_id, user_id, note, quiz_questions, content_hash=None):
+    """Save quiz questions for the note and build the result."""
+    note_title = note.get('title', 'Untitled Quiz')
+    quiz_id = save_quiz_to_db(note_id, user_id, quiz_questions, note_title, content_hash)
+    if quiz_id:
+        return {
+            "success": True,
+            "quiz": {
+                "id": quiz_id,
+                "note_id": note_id,
+                "user_id": user_id,
+                "title": note_title,
+                "questions": quiz_questions
+            },
+            "message": "Quiz generated successfully"
+        }
+    return {"success": False, "message": "Failed to save quiz to database"}
+
+@metrics.timed_request('summary')
+def generate_summary(note_id, user_id, refresh=False):
+    """Generate and save summary for a note. refresh=True regenerates instead of reusing."""
+    error = check_config('summary')
+    if error:
+        return error
+
+    try:
+        # Get note details, its stored extraction and index entry in one query
         note = get_note_content(note_id, user_id)
         if not note:
             return {"success": False, "message": "Note not found"}
 
-        # Check if we have stored extracted content for PDFs
-        if note['file_type'] == 'PDF Document':
-            # First try to get stored extracted content
-            try:
-                conn_check = get_db_connection()
-                cursor_check = conn_check.cursor(dictionary=True)
-                cursor_check.execute(
-                    "SELECT extracted_text FROM extracted_content WHERE note_id = %s AND extraction_status = 'completed'",
-                    (note_id,)
-                )
-                stored_content = cursor_check.fetchone()
-                cursor_check.close()
-                conn_check.close()
-
-                if stored_content and stored_content['extracted_text']:
-                    text_to_summarize = stored_content['extracted_text']
-                    activity_log(f"Using stored extracted content for note {note_id} ({len(text_to_summarize)} characters)")
-
-                else:
-                    # Fallback: extract on-demand
-                    activity_log(f"No stored content found, extracting on-demand for note {note_id}")
-                    pdf_path = note['content']
-
-                    if not os.path.isabs(pdf_path):
-                        script_dir = os.path.dirname(os.path.abspath(__file__))
-                        full_path = os.path.join(script_dir, pdf_path.lstrip('/'))
-                    else:
-                        full_path = pdf_path
-
-                    activity_log(f"Processing PDF file: {full_path}")
-
-                    if not os.path.exists(full_path):
-                        error_msg = f"PDF file not found at: {full_path}"
-                        error_log(error_msg)
-                        return {"success": False, "message": error_msg}
-
-                    text_to_summarize = extract_text_from_pdf(full_path)
-                    if not text_to_summarize.strip():
-                        error_msg = "Extracted text from PDF is empty"
-                        error_log(error_msg)
-                        return {"success": False, "message": error_msg}
-
-                    activity_log(f"Extracted {len(text_to_summarize)} characters from PDF on-demand")
-
-            except Exception as e:
-                error_msg = f"Error accessing extracted content or processing PDF: {str(e)}"
-                error_log(error_msg)
-                return {"success": False, "message": error_msg}
-        else:
-            # For non-PDF content
-            text_to_summarize = note['content']
-            if not text_to_summarize.strip():
-                error_msg = "Note content is empty"
-                error_log(error_msg)
-                return {"success": False, "message": error_msg}
+        # Reuse the summary of identical content uploaded before
+        content_hash = get_content_hash(note)
+        indexed = get_index_entry(note, content_hash)
+        if content_index.REUSE_AI_OUTPUTS and not refresh and indexed and indexed['summary_text']:
+            activity_log(f"Reusing indexed summary for note {note_id} (hash {content_hash[:12]})")
+            return finish_summary(note_id, user_id, indexed['summary_text'],
+                                  indexed['summary_model'] or SUMMARY_MODEL)
+
+        text_to_summarize, error = load_note_text(note, indexed)
+        if error:
+            return error
 
         # Generate summary
         try:
-            # Use the correct variable name that was set in the code above
-            summary = summarize_text_with_gemini(text_to_summarize)
+            ai_model, summary = summarize_text_with_gemini(text_to_summarize, refresh)
             if not summary or not summary.strip():
                 return {"success": False, "message": "Failed to generate summary - empty response from AI model"}
 
         except Exception as e:
             return {"success": False, "message": f"Error generating summary: {str(e)}"}
 
-        # Save to database
-        try:
-            if save_summary_to_db(note_id, user_id, summary):
-                return {
-                    "success": True,
-                    "summary": {
-                        "content": summary,
-                        "note_id": note_id,
-                        "user_id": user_id,
-                        "ai_model": "gemini-2.5-flash"
-                    },
-                    "message": "Summary generated successfully"
-                }
-            else:
-                return {"success": False, "message": "Failed to save summary to database"}
-
-        except Exception as e:
-            return {"success": False, "message": f"Database error: {str(e)}"}
+        # Save to database and the content index
+        return finish_summary(note_id, user_id, summary, ai_model, content_hash)
 
     except Exception as e:
         return {"success": False, "message": f"Unexpected error: {str(e)}"}
 
-def generate_quiz(note_id, user_id):
-    """Generate and save quiz for a note."""
+@metrics.timed_request('quiz')
+def generate_quiz(note_id, user_id, refresh=False):
+    """Generate and save quiz for a note. refresh=True draws a new sample and tops up the bank."""
+    error = check_config('quiz')
+    if error:
+        return error
+
+    import question_bank
+
     try:
-        # Get note details
+        # Get note details, its stored extraction and index entry in one query
         note = get_note_content(note_id, user_id)
         if not note:
             return {"success": False, "message": "Note not found"}
 
-        # Extract text same as summary - prioritize stored content
-        if note['file_type'] == 'PDF Document':
-            # First try to get stored extracted content
-            try:
-                conn_check = get_db_connection()
-                cursor_check = conn_check.cursor(dictionary=True)
-                cursor_check.execute(
-                    "SELECT extracted_text FROM extracted_content WHERE note_id = %s AND extraction_status = 'completed'",
-                    (note_id,)
-                )
-                stored_content = cursor_check.fetchone()
-                cursor_check.close()
-                conn_check.close()
-
-                if stored_content and stored_content['extracted_text']:
-                    text_to_quiz = stored_content['extracted_text']
-                    activity_log(f"Using stored extracted content for quiz generation on note {note_id}")
-
-                else:
-                    # Fallback: extract on-demand
-                    activity_log(f"No stored content found for quiz, extracting on-demand for note {note_id}")
-                    pdf_path = note['content']
-                    if not os.path.isabs(pdf_path):
-                        script_dir = os.path.dirname(os.path.abspath(__file__))
-                        full_path = os.path.join(script_dir, pdf_path.lstrip('/'))
-                    else:
-                        full_path = pdf_path
-
-                    if not os.path.exists(full_path):
-                        return {"success": False, "message": f"PDF file not found: {full_path}"}
-
-                    text_to_quiz = extract_text_from_pdf(full_path)
-                    if not text_to_quiz.strip():
-                        return {"success": False, "message": "Extracted text from PDF is empty"}
-
-            except Exception as e:
-                return {"success": False, "message": f"Error accessing extracted content: {str(e)}"}
-        else:
-            text_to_quiz = note['content']
-            if not text_to_quiz.strip():
-                return {"success": False, "message": "Note content is empty"}
+        # Quizzes are sampled from the document's question bank, which is shared
+        # by identical uploads and only generated when it is too small
+        content_hash = get_content_hash(note)
+        indexed = get_index_entry(note, content_hash)
+
+        text_to_quiz = None
+        if not content_hash:
+            text_to_quiz, error = load_note_text(note, indexed)
+            if error:
+                return error
+            content_hash = content_index.hash_text(text_to_quiz)
+
+        def load_text():
+            if text_to_quiz is not None:
+                return text_to_quiz
+            text, error = load_note_text(note, indexed)
+            if error:
+                raise ValueError(error['message'])
+            return text
 
-        # Generate quiz
         try:
-            quiz_questions = generate_quiz_with_openai(text_to_quiz)
-            if not quiz_questions or len(quiz_questions) != 10:
-                return {"success": False, "message": "Failed to generate 10 questions"}
-
+            quiz_questions = question_bank.build_quiz(content_hash, load_text, refresh)
         except Exception as e:
             return {"success": False, "message": f"Error generating quiz: {str(e)}"}
 
-        # Save to database
-        try:
-            note_title = note.get('title', 'Untitled Quiz')
-            quiz_id = save_quiz_to_db(note_id, user_id, quiz_questions, note_title)
-            if quiz_id:
-                return {
-                    "success": True,
-                    "quiz": {
-                        "id": quiz_id,
-                        "note_id": note_id,
-                        "user_id": user_id,
-                        "title": note_title,
-                        "questions": quiz_questions
-                    },
-                    "message": "Quiz generated successfully"
-                }
-            else:
-                return {"success": False, "message": "Failed to save quiz to database"}
-
-        except Exception as e:
-            return {"success": False, "message": f"Database error: {str(e)}"}
+        # Save to database and the content index
+        return finish_quiz(note_id, user_id, note, quiz_questions, content_hash)
 
     except Exception as e:
         return {"success": False, "message": f"Unexpected error: {str(e)}"}
@@ -454,18 +414,20 @@ def main():
 
     try:
         if len(sys.argv) < 4:
-            raise ValueError("Insufficient arguments. Usage: python summary_generator.py <mode> <note_id> <user_id>")
+            raise ValueError("Insufficient arguments. Usage: python summary_generator.py <mode> <note_id> <user_id> [--refresh]")
 
         mode = sys.argv[1].lower()
         note_id = sys.argv[2]
         user_id = sys.argv[3]
+        refresh = '--refresh' in sys.argv[4:]
 
         # Generate the result - all output here will go to stderr
         sys.stdout = sys.stderr
+        startup.ready()
         if mode == "summary":
-            result = generate_summary(note_id, user_id)
+            result = generate_summary(note_id, user_id, refresh)
         elif mode == "quiz":
-            result = generate_quiz(note_id, user_id)
+            result = generate_quiz(note_id, user_id, refresh)
         else:
             result = {"success": False, "message": f"Unknown mode: {mode}"}
 
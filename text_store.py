@@ -0,0 +1,277 @@
+"""
+Compressed storage of extracted note text with ranged reads.
+
+Extracted text is stored as one binary blob instead of a LONGTEXT value:
+
+    header   magic, version, dictionary id, text length, block and page counts
+    blocks   (first character, compressed size) per block
+    pages    (page number, first character) per page, when known
+    data     the text in blocks of TEXT_BLOCK_CHARS characters, each one
+             zlib-compressed on its own with a shared preset dictionary
+
+Since every block can be inflated by itself, a character or page range only
+needs the header and the blocks it overlaps. open_note_text() reads those
+from MySQL with SUBSTRING(), so a consumer that wants the first few thousand
+characters of a long document moves a few kilobytes instead of the whole text.
+
+Rows written before this format have extracted_blob NULL and keep their text
+in extracted_text; the readers here fall back to it.
+"""
+
+import os
+import struct
+import zlib
+
+import metrics
+
+TEXT_BLOCK_CHARS = int(os.getenv('TEXT_BLOCK_CHARS', '32768'))          # characters per compressed block
+TEXT_COMPRESS_LEVEL = int(os.getenv('TEXT_COMPRESS_LEVEL', '6'))        # zlib level 1-9
+TEXT_HEAD_BYTES = int(os.getenv('TEXT_HEAD_BYTES', '16384'))            # bytes read with the first query
+TEXT_READ_BYTES = int(os.getenv('TEXT_READ_BYTES', str(1024 * 1024)))  # most bytes fetched per later query
+
+MAGIC = b'STX1'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHIII')  # magic, version, dictionary id, reserved, text length, blocks, pages
+ENTRY = struct.Struct('<II')         # block: first char, compressed size / page: number, first char
+
+# Preset dictionaries by id. Stored blobs name the one they were written with,
+# so an entry must never change once released; add a new id instead.
+DICTIONARIES = {
+    1: (
+        "Figure Table Chapter Section Example Definition Theorem Proof Lemma Exercise Summary "
+        "Introduction Conclusion References Appendix Abstract Objectives Key points Note: "
+        "http://www. https://www. .com .org .pdf e.g. i.e. etc. et al. "
+        "Page of the the of and to in is that for are as with be by on this which can or "
+        "an from it at not have has was were their these there its also more such than "
+        "other between each into only used using when where how what will would should "
+        "may must about both through during after before under over however therefore "
+        "because while since within without number system data function value process "
+        "information example problem method model time different important following "
+        "called known given based following result results structure type types level "
+        "first second third one two three example of the is a the number of in order to "
+        "as well as for example such as in the of the to the on the and the is the that the "
+    ).encode('utf-8'),
+}
+DICTIONARY_ID = 1
+
+
+# ---------- Encoding ----------
+
+def _page_starts(pages, text):
+    """Character offsets of each page in join_pages(pages) (which strips the ends)."""
+    raw = "".join(page_text for _, page_text in pages)
+    lead = len(raw) - len(raw.lstrip())
+    starts = []
+    position = 0
+    for number, page_text in pages:
+        starts.append((number, min(max(position - lead, 0), len(text))))
+        position += len(page_text)
+    return starts
+
+
+def encode(text, pages=None, block_chars=None, level=None):
+    """Compress text into a blob. pages ([(page_number, text), ...]) adds a page index."""
+    block_chars = block_chars or TEXT_BLOCK_CHARS
+    level = TEXT_COMPRESS_LEVEL if level is None else level
+    dictionary = DICTIONARIES[DICTIONARY_ID]
+
+    entries = []
+    data = []
+    for start in range(0, len(text), block_chars):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=dictionary)
+        block = compressor.compress(text[start:start + block_chars].encode('utf-8')) + compressor.flush()
+        entries.append(ENTRY.pack(start, len(block)))
+        data.append(block)
+
+    page_entries = [ENTRY.pack(number, start) for number, start in _page_starts(pages, text)] if pages else []
+
+    header = HEADER.pack(MAGIC, VERSION, DICTIONARY_ID, 0, len(text), len(entries), len(page_entries))
+    return b"".join([header] + entries + page_entries + data)
+
+
+def is_blob(value):
+    return isinstance(value, (bytes, bytearray)) and bytes(value[:4]) == MAGIC
+
+
+# ---------- Index ----------
+
+class TextIndex:
+    """Parsed header of a blob: block byte ranges and page offsets."""
+
+    def __init__(self, head):
+        if len(head) < HEADER.size or bytes(head[:4]) != MAGIC:
+            raise ValueError("Not a compressed text blob")
+        _, version, self.dictionary_id, _, self.text_length, block_count, page_count = HEADER.unpack_from(head)
+        if version != VERSION:
+            raise ValueError(f"Unsupported text blob version {version}")
+        self.size = index_size(head)
+        if len(head) < self.size:
+            raise ValueError("Text blob header is truncated")
+
+        offset = self.size
+        self.blocks = []  # (first char, end char, byte offset, byte length)
+        for i in range(block_count):
+            start, length = ENTRY.unpack_from(head, HEADER.size + i * ENTRY.size)
+            self.blocks.append([start, self.text_length, offset, length])
+            if i:
+                self.blocks[i - 1][1] = start
+            offset += length
+
+        pages_at = HEADER.size + block_count * ENTRY.size
+        self.pages = [ENTRY.unpack_from(head, pages_at + i * ENTRY.size) for i in range(page_count)]
+
+    def page_range(self, first, last=None):
+        """Character range (start, end) covering pages first..last, or None without a page index."""
+        if not self.pages:
+            return None
+        last = first if last is None else last
+        start = end = None
+        for i, (number, page_start) in enumerate(self.pages):
+            page_end = self.pages[i + 1][1] if i + 1 < len(self.pages) else self.text_length
+            if first <= number <= last:
+                start = page_start if start is None else start
+                end = page_end
+        return (start, end) if start is not None else (0, 0)
+
+
+def index_size(head):
+    """Bytes taken by the header and index, from at least the first HEADER.size bytes."""
+    _, _, _, _, _, block_count, page_count = HEADER.unpack_from(head)
+    return HEADER.size + (block_count + page_count) * ENTRY.size
+
+
+def _inflate(data, dictionary_id):
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=DICTIONARIES[dictionary_id])
+    return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
+
+
+# ---------- Readers ----------
+
+class StoredText:
+    """Ranged reader over one blob. read(offset, length) returns bytes of the blob."""
+
+    def __init__(self, read, head):
+        head = bytes(head)
+        if len(head) >= HEADER.size and index_size(head) > len(head):
+            head = bytes(read(0, index_size(head)))
+        self._read = read
+        self._head = head
+        self.index = TextIndex(head)
+        self.text_length = self.index.text_length
+
+    @classmethod
+    def from_blob(cls, blob):
+        blob = bytes(blob)
+        return cls(lambda offset, length: blob[offset:offset + length], blob)
+
+    def _fetch(self, blocks):
+        """Raw bytes of consecutive blocks, in as few reads as TEXT_READ_BYTES allows."""
+        pending = []
+        for block in blocks:
+            if pending and pending[-1][2] + pending[-1][3] - pending[0][2] + block[3] > TEXT_READ_BYTES:
+                yield from self._fetch_run(pending)
+                pending = []
+            pending.append(block)
+        if pending:
+            yield from self._fetch_run(pending)
+
+    def _fetch_run(self, blocks):
+        offset = blocks[0][2]
+        length = blocks[-1][2] + blocks[-1][3] - offset
+        if offset + length <= len(self._head):
+            data = self._head[offset:offset + length]
+        else:
+            data = bytes(self._read(offset, length))
+        for block in blocks:
+            yield block, data[block[2] - offset:block[2] - offset + block[3]]
+
+    def iter_range(self, start=0, end=None):
+        """Yield the text between character offsets start and end, one block at a time."""
+        end = self.text_length if end is None else min(end, self.text_length)
+        start = max(start, 0)
+        wanted = [block for block in self.index.blocks if block[0] < end and block[1] > start]
+        for block, data in self._fetch(wanted):
+            with metrics.span('text_decode'):
+                text = _inflate(data, self.index.dictionary_id)
+            yield text[max(start - block[0], 0):end - block[0]]
+
+    def read_range(self, start=0, end=None):
+        return "".join(self.iter_range(start, end))
+
+    def page_range(self, first, last=None):
+        return self.index.page_range(first, last)
+
+    def read_pages(self, first, last=None):
+        """Text of pages first..last, or None when the blob has no page index."""
+        span = self.page_range(first, last)
+        return self.read_range(*span) if span else None
+
+
+class PlainText:
+    """Same interface as StoredText over text kept uncompressed (rows from before extracted_blob)."""
+
+    def __init__(self, text):
+        self.text = text
+        self.text_length = len(text)
+
+    def iter_range(self, start=0, end=None):
+        if start < self.text_length:
+            yield self.text[max(start, 0):end]
+
+    def read_range(self, start=0, end=None):
+        return self.text[max(start, 0):end]
+
+    def page_range(self, first, last=None):
+        return None
+
+    def read_pages(self, first, last=None):
+        return None
+
+
+def decode(blob, fallback=None):
+    """The full text of a blob, or fallback (legacy uncompressed text) when there is no blob."""
+    if blob is None:
+        return fallback
+    return StoredText.from_blob(blob).read_range()
+
+
+# ---------- Database ----------
+
+def open_note_text(conn, note_id):
+    """Open a note's completed extraction for ranged reads. Returns None when there is none.
+
+    Only the first TEXT_HEAD_BYTES of the blob are fetched here; later reads
+    fetch the blocks they need. Keep conn open while reading.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT SUBSTRING(extracted_blob, 1, %s), IF(extracted_blob IS NULL, extracted_text, NULL)
+            FROM extracted_content
+            WHERE note_id = %s AND extraction_status = 'completed'
+            """,
+            (TEXT_HEAD_BYTES, note_id)
+        )
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    if not row:
+        return None
+    head, legacy = row
+    if head is None:
+        return PlainText(legacy) if legacy else None
+
+    def read(offset, length):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT SUBSTRING(extracted_blob, %s, %s) FROM extracted_content WHERE note_id = %s",
+                (offset + 1, length, note_id)
+            )
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+    return StoredText(read, head)
@@ -0,0 +1,183 @@
+"""
+Thin client for the long-lived study worker (study_worker.py).
+
+The CLI scripts call forward_cli() before importing any heavy SDKs. If the
+worker is running, the request is handled there and the script exits;
+otherwise the script falls back to doing the work in-process. A plain
+socket connect checks for the worker first, so a script with no worker to
+talk to does not pay for importing the HTTP client. Only a request that
+never reached the worker falls back; once it is sent, a timeout or broken
+response is reported as a failure rather than running the work twice.
+"""
+
+import json
+import os
+import socket
+import sys
+
+import app_log
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+WORKER_HOST = os.getenv('WORKER_HOST', '127.0.0.1')
+WORKER_PORT = int(os.getenv('WORKER_PORT', '8765'))
+WORKER_TIMEOUT = float(os.getenv('WORKER_TIMEOUT', '300'))
+WORKER_ENABLED = os.getenv('WORKER_ENABLED', '1') != '0'
+
+
+def worker_url(path):
+    """Build a URL on the local worker."""
+    return f"http://{WORKER_HOST}:{WORKER_PORT}/{path.lstrip('/')}"
+
+
+# Operations whose response is newline-delimited JSON events
+STREAM_OPERATIONS = {'generate_chat_response_stream'}
+
+
+def worker_listening():
+    """Whether anything accepts connections on the worker port."""
+    try:
+        socket.create_connection((WORKER_HOST, WORKER_PORT), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+def _post(operation, params, timeout=None):
+    import urllib.request
+    body = json.dumps(params, ensure_ascii=False).encode('utf-8')
+    request = urllib.request.Request(
+        worker_url(operation),
+        data=body,
+        headers={
+            'Content-Type': 'application/json',
+            'X-Request-Id': app_log.get_request_id() or app_log.new_request_id(),
+        },
+        method='POST'
+    )
+    return urllib.request.urlopen(request, timeout=timeout or WORKER_TIMEOUT)
+
+
+def _failure(error, timeout=None):
+    """Result for a request the worker got but did not answer properly."""
+    if isinstance(error, TimeoutError):
+        return {"success": False, "message": f"Worker did not answer within {timeout or WORKER_TIMEOUT:g} s"}
+    if isinstance(error, ValueError):
+        return {"success": False, "message": f"Worker sent an invalid response: {str(error)}"}
+    return {"success": False, "message": f"Worker error: {str(error)}"}
+
+
+def _error_event(error, timeout=None):
+    return json.dumps(dict(_failure(error, timeout), type="error"), ensure_ascii=False).encode('utf-8')
+
+
+def call_worker(operation, params, timeout=None):
+    """Run an operation on the worker. Returns None if the request could not be sent."""
+    if not WORKER_ENABLED:
+        return None
+
+    import urllib.error
+    try:
+        with _post(operation, params, timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        # The worker answered, so report its error instead of running locally
+        try:
+            return json.loads(e.read().decode('utf-8'))
+        except Exception:
+            return {"success": False, "message": f"Worker error: HTTP {e.code}"}
+    except urllib.error.URLError:
+        # Connecting or sending failed (urllib wraps those), so the worker never saw the request
+        return None
+    except (OSError, ValueError) as e:
+        # Sent but timed out, cut off or answered with a malformed body
+        return _failure(e, timeout)
+
+
+def stream_worker(operation, params, timeout=None):
+    """Open a streaming operation on the worker.
+
+    Returns an iterator of raw JSON lines (bytes), or None if the request could not be sent.
+    """
+    if not WORKER_ENABLED:
+        return None
+
+    import urllib.error
+    try:
+        response = _post(operation, params, timeout)
+    except urllib.error.HTTPError as e:
+        return iter([e.read()])
+    except urllib.error.URLError:
+        return None
+    except OSError as e:
+        return iter([_error_event(e, timeout)])
+
+    def lines():
+        with response:
+            try:
+                for line in response:
+                    if line.strip():
+                        yield line.rstrip(b'\r\n')
+            except OSError as e:
+                yield _error_event(e, timeout)
+
+    return lines()
+
+
+def _cli_request(script, args):
+    """Map a CLI invocation to a worker operation and its parameters."""
+    if script == 'summary_generator' and len(args) >= 3:
+        mode = args[0].lower()
+        params = {"note_id": args[1], "user_id": args[2], "refresh": '--refresh' in args[3:]}
+        if mode == 'summary':
+            return 'generate_summary', params
+        if mode == 'quiz':
+            return 'generate_quiz', params
+
+    elif script == 'content_extractor' and len(args) >= 2:
+        if args[0].lower() == 'extract':
+            return 'extract_and_store_content', {"note_id": args[1]}
+
+    elif script == 'chat_response' and len(args) >= 2:
+        try:
+            with open(args[0], 'r', encoding='utf-8') as f:
+                context = f.read().strip()
+        except OSError:
+            # Let the script report the unreadable context file itself
+            return None
+        operation = 'generate_chat_response_stream' if '--stream' in args[2:] else 'generate_chat_response'
+        return operation, {"context": context, "user_message": args[1]}
+
+    return None
+
+
+def forward_cli(script, args):
+    """Forward a CLI call to the worker and exit, or return to run it locally."""
+    # One request id for the call, whether the worker or this process handles it
+    app_log.set_request_id()
+    request = _cli_request(script, args)
+    if request is None or not WORKER_ENABLED or not worker_listening():
+        return
+
+    operation, params = request
+
+    if operation in STREAM_OPERATIONS:
+        lines = stream_worker(operation, params)
+        if lines is None:
+            return
+        for line in lines:
+            sys.stdout.buffer.write(line + b'\n')
+            sys.stdout.flush()
+        sys.exit(0)
+
+    result = call_worker(operation, params)
+    if result is None:
+        return
+
+    sys.stdout.buffer.write(json.dumps(result, ensure_ascii=False).encode('utf-8'))
+    sys.stdout.flush()
+    sys.exit(0)